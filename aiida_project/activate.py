@@ -11,6 +11,7 @@ else:
 
 from aiida_project import utils
 from aiida_project import constants
+from aiida_project.registry import ProjectRegistry
 
 
 """
@@ -25,6 +26,8 @@ class ActivateEnvBase(object):
     set_var = None
     unset_var = None
     cmd_join = None
+    # file extension of the precomputed activation / deactivation scripts
+    script_extension = None
 
     # environment variables to be exported (expects a list of tuples
     # [(ENVVAR, value), ...]
@@ -34,11 +37,56 @@ class ActivateEnvBase(object):
     activate_commands = []
     deactivate_commands = []
 
+    @classmethod
+    def get_script_path(cls, project_name, mode):
+        """
+        Get the path of a project's precomputed activation script.
+
+        :param str project_name: name of the project
+        :param str mode: either 'activate' or 'deactivate'
+        """
+        script_folder = (pathlib.Path.home() / constants.CONFIG_FOLDER
+                         / constants.ACTIVATION_SCRIPTS_FOLDER)
+        return script_folder / "{}.{}.{}".format(project_name, mode,
+                                                 cls.script_extension)
+
+    def build_script_activate(self):
+        """Build the precomputed script activating the project."""
+        raise NotImplementedError
+
+    def build_script_deactivate(self):
+        """Build the precomputed script deactivating the project."""
+        raise NotImplementedError
+
+    def write_scripts(self):
+        """
+        Write the project's precomputed activation / deactivation scripts.
+
+        The scripts are sourced by the shell directly (i.e. without starting
+        python) as long as they are newer than the projects file.
+
+        :returns: list of paths to the written scripts
+        """
+        scripts = [
+            ('activate', self.build_script_activate()),
+            ('deactivate', self.build_script_deactivate()),
+        ]
+        written = []
+        for (mode, contents) in scripts:
+            script_path = self.get_script_path(self.project_name, mode)
+            if not script_path.parent.exists():
+                script_path.parent.mkdir(parents=True)
+            temporary_path = script_path.with_name(script_path.name + '.tmp')
+            with open(str(temporary_path), 'w') as f:
+                f.write(contents)
+            os.replace(str(temporary_path), str(script_path))
+            written.append(script_path)
+        return written
+
     def load_project_spec(self, project_name):
         """Load the specifications for the given project."""
-        project_specs = utils.load_project_spec()
         try:
-            project_spec = project_specs[project_name]
+            project_spec = ProjectRegistry().load(project_name)
         except KeyError:
             raise Exception("Unable to complete activation. Project '{}' "
                             "does not exists.".format(project_name))
@@ -112,28 +160,48 @@ class ActivateEnvBash(ActivateEnvBase):
     set_var = "export {}='{}'"
     unset_var = "unset {}"
     cmd_join = ";"
+    script_extension = "sh"
 
     def __init__(self, project_name):
         """Initialize internal variables."""
         project_spec = self.load_project_spec(project_name)
+        self.project_name = project_name
         env_name = "{}/{}".format(project_spec['env_sub'], project_name)
         manager = project_spec['manager']
         # set required activation / deactivation commands for manager
         if manager == constants.MANAGER_NAME_CONDA:
-            self.check_conda_avail()
-            self.activate_commands = ["conda activate {}".format(env_name)]
-            self.deactivate_commands = ["conda deactivate"]
+            # environments created by micromamba are activated by micromamba
+            # while all others can be activated by conda
+            solver = project_spec.get('solver', constants.CONDA_SOLVER_CONDA)
+            conda_executable = "conda"
+            if solver == constants.CONDA_SOLVER_MICROMAMBA:
+                conda_executable = "micromamba"
+            self.check_conda_avail(conda_executable)
+            self.activate_commands = ["{} activate {}".format(
+                conda_executable, env_name)]
+            env_prefix = pathlib.Path(env_name)
+            self.deactivate_commands = ["{} deactivate".format(
+                conda_executable)]
         elif manager == constants.MANAGER_NAME_VENV:
             venv_activate_script = self.check_virtualenv_path(project_spec)
             self.activate_commands = [". '{}'".format(venv_activate_script)]
             self.deactivate_commands = ["deactivate"]
+            env_prefix = pathlib.Path(venv_activate_script).parent.parent
         else:
             raise Exception("manager '{}' not supported by bash activator"
                             .format(manager))
-        # enable verdi autocomplete upon activation (this is basically an
-        # eval inside eval)
-        self.activate_commands.append("reentry scan -r aiida")
-        self.activate_commands.append("eval \"$(verdi completioncommand)\"")
+        # commands activating the environment itself (precomputed scripts
+        # run their own checks before updating entry points and completion)
+        self.env_activate_commands = list(self.activate_commands)
+        self.project_path = pathlib.Path(project_spec['project_path'])
+        self.env_prefix = env_prefix
+
+        # update aiida's entry points if necessary and enable verdi
+        # autocomplete upon activation
+        self.activate_commands += self.build_cmd_reentry_scan(project_spec,
+                                                              env_prefix)
+        self.activate_commands += self.build_cmd_completion(project_spec,
+                                                            env_prefix)
 
         # setup additional deactivation commands
         self.deactivate_commands.append("complete -r verdi")
@@ -156,12 +224,32 @@ class ActivateEnvBash(ActivateEnvBase):
         :returns: multiline string to be evaluated by the calling shell
         :rtype: str
         """
+        config_folder = pathlib.Path.home() / constants.CONFIG_FOLDER
         setup_string = \
         (
             cls.set_var.format('AIIDA_PROJECT_EXE', executable),  # noqa: E122
+            cls.set_var.format('AIIDA_PROJECT_SCRIPTS', config_folder
+                               / constants.ACTIVATION_SCRIPTS_FOLDER),
+            cls.set_var.format('AIIDA_PROJECT_SPECS', config_folder
+                               / constants.PROJECTS_FOLDER),
             'function _aiida_project_activate() {',
             '  local mode=$1',  # activate / deactivate (must be first arg!)
             '  shift',          # remove $1 from the list of args $@
+            '  local project="$1"',
+            '  if [ "$mode" = deactivate ]; then',
+            '    project="$AIIDA_PROJECT_ACTIVE"',
+            '  fi',
+            # source the precomputed script if it is newer than the project's
+            # spec file, otherwise let aiida-project build (and rewrite) it
+            '  local script="$AIIDA_PROJECT_SCRIPTS/$project.$mode.{}"'
+            .format(cls.script_extension),
+            '  local spec="$AIIDA_PROJECT_SPECS/$project.{}"'
+            .format(ProjectRegistry.spec_extension),
+            '  if [ -n "$project" ] && [ "$#" -le 1 ] && [ -f "$script" ] \\',
+            '     && [ -f "$spec" ] && ! [ "$spec" -nt "$script" ]; then',
+            '    . "$script"',
+            '    return $?',
+            '  fi',
             '  cmd="$("$AIIDA_PROJECT_EXE" "$mode" bash "$@")" || return $?',
             '  eval "$cmd"',
             '}',
@@ -182,17 +270,250 @@ class ActivateEnvBash(ActivateEnvBase):
         )
         return "\n".join(setup_string)
 
-    def check_conda_avail(self):
+    @classmethod
+    def _setup_file(cls, executable, init_file):
+        """
+        Create a versioned init file making aiida-project available in bash.
+
+        The init file is meant to be sourced from .bashrc and rewrites
+        itself (by calling `aiida-project init bash --write`) if the
+        aiida-project executable found on the PATH moved or has been
+        reinstalled since the file was written, i.e. starting a shell does
+        not start python otherwise.
+
+        :param executable: path to the aiida-project executable file
+        :type executable: pathlib.Path
+        :param init_file: path the init file is written to
+        :type init_file: pathlib.Path
+        :returns: contents of the init file
+        :rtype: str
+        """
+        header = (
+            '# aiida-project init file for bash (written by `aiida-project '
+            'init bash --write`, do not edit)',
+            '# init file format: {}'.format(constants.INIT_FILE_VERSION),
+            '# aiida-project version: {}'.format(
+                utils.get_aiida_project_version()),
+            '# aiida-project executable: {}'.format(executable),
+            '_aiida_project_exe="$(type -P aiida-project)"',
+            '_aiida_project_exe="${{_aiida_project_exe:-{}}}"'.format(
+                executable),
+            'if [ -z "$_aiida_project_init_rewritten" ] && {{ [ "$_aiida_'
+            'project_exe" != \'{0}\' ] || [ \'{0}\' -nt \'{1}\' ]; }} \\'
+            .format(executable, init_file),
+            '   && [ -x "$_aiida_project_exe" ] \\',
+            '   && "$_aiida_project_exe" init bash --write \'{}\' '
+            '> /dev/null; then'.format(init_file),
+            '  _aiida_project_init_rewritten=1',
+            '  . \'{}\''.format(init_file),
+            '  unset _aiida_project_init_rewritten',
+            'else',
+            '  unset _aiida_project_exe',
+        )
+        return "\n".join(header) + "\n" + "\n".join(
+            "  " + line for line in cls._setup(executable).split("\n")) + \
+            "\nfi\n"
+
+    def build_script_activate(self):
+        """Build the precomputed script activating the project."""
+        lines = [
+            "# activation script for project '{}' (written by aiida-project, "
+            "do not edit)".format(self.project_name),
+            'if [ -n "$AIIDA_PROJECT_ACTIVE" ]; then',
+            '  echo "currently activated project \'$AIIDA_PROJECT_ACTIVE\' '
+            'needs to be deactivated prior to activating a new project" >&2',
+            '  return 1',
+            'fi',
+            'if [ -n "$AIIDA_PATH" ]; then',
+            '  echo "cannot activate project because AIIDA_PATH is already '
+            'set" >&2',
+            '  return 1',
+            'fi',
+        ]
+        for envvar in self.environment_variables:
+            lines.append(self.set_var.format(*envvar))
+        lines += self.env_activate_commands
+        # entry points and completion are updated by the same commands as
+        # in `build_cmd_reentry_scan` and `build_cmd_completion`
+        project_spec = {'project_path': str(self.project_path)}
+        lines += self.build_cmd_reentry_scan(project_spec, self.env_prefix)
+        lines += self.build_cmd_completion(project_spec, self.env_prefix)
+        return "\n".join(lines) + "\n"
+
+    def build_script_deactivate(self):
+        """Build the precomputed script deactivating the project."""
+        lines = [
+            "# deactivation script for project '{}' (written by "
+            "aiida-project, do not edit)".format(self.project_name),
+        ]
+        lines += self.build_cmd_deactivate().split(self.cmd_join)
+        return "\n".join(lines) + "\n"
+
+    def build_cmd_reentry_scan(self, project_spec, env_prefix):
+        """
+        Build the commands updating reentry's entry point cache.
+
+        `reentry scan` reads the metadata of every installed distribution,
+        i.e. the scan is only run if the fingerprint of the environment's
+        entry points (see `build_cmd_metadata_fingerprint`) differs from the
+        one stored by the last scan. The fingerprint is computed by the
+        shell, i.e. the precomputed activation scripts run the very same
+        check without starting python.
+
+        :param dict project_spec: specifications of the activated project
+        :param env_prefix: path to the project's python environment
+        :type env_prefix: pathlib.Path
+        :returns: list of commands to be run after environment activation
+        """
+        site_packages = self.get_site_packages(env_prefix)
+        if site_packages is None:
+            return ["reentry scan -r aiida"]
+        scan_file = (pathlib.Path(project_spec['project_path'])
+                     / constants.REENTRY_SCAN_FILE)
+        return [self.build_cmd_if_changed(
+            self.build_cmd_metadata_fingerprint(site_packages), scan_file,
+            'reentry scan -r aiida && echo "$_aiida_project_fp" > \'{}\''
+            .format(scan_file))]
+
+    @staticmethod
+    def build_cmd_if_changed(fingerprint, stored_file, update, prefix=''):
+        """
+        Build the command running update if a fingerprint changed.
+
+        The fingerprint is compared to the first line of stored_file and
+        available to update as `$_aiida_project_fp` (update has to store
+        it). Shell builtins are used wherever possible since the command is
+        run on every activation.
+
+        :param str fingerprint: the shell command printing the fingerprint
+        :param stored_file: file containing the last fingerprint
+        :param str update: the shell command run if the fingerprint changed
+        :param str prefix: text prepended to the fingerprint
+        :returns: the command (a single line)
+        """
+        return (
+            '_aiida_project_fp="{prefix}$({fingerprint})"; '
+            '_aiida_project_last=; '
+            '{{ read -r _aiida_project_last < \'{file}\'; }} 2> /dev/null; '
+            'if [ "$_aiida_project_fp" != "$_aiida_project_last" ]; then '
+            '{update}; fi; unset _aiida_project_fp _aiida_project_last'
+            .format(prefix=prefix, fingerprint=fingerprint, file=stored_file,
+                    update=update))
+
+    @staticmethod
+    def build_cmd_metadata_fingerprint(site_packages):
+        """
+        Build the command printing a fingerprint of all entry points.
+
+        The fingerprint covers the names of all entries of site-packages
+        (i.e. the versioned dist-info folders), the contents of all .pth and
+        .egg-link files and of all entry_points.txt files, including the
+        ones in the egg-info folders of editable installs (located in the
+        source tree an egg-link points to).
+
+        :param site_packages: path to the environment's site-packages
+        :returns: shell command writing the fingerprint to stdout
+        """
+        return (
+            "{{ printf '%s\\n' '{0}'/*; cat '{0}'/*.pth '{0}'/*.egg-link "
+            "'{0}'/*.dist-info/entry_points.txt "
+            "'{0}'/*.egg-info/entry_points.txt; "
+            "for link in '{0}'/*.egg-link; do "
+            "[ -f \"$link\" ] && read -r source < \"$link\" "
+            "&& cat \"$source\"/*.egg-info/entry_points.txt; done; "
+            "}} 2> /dev/null | cksum".format(site_packages))
+
+    def build_cmd_completion(self, project_spec, env_prefix):
+        """
+        Build the commands enabling verdi's shell completion.
+
+        Running `verdi completioncommand` imports large parts of aiida-core,
+        i.e. the completion script is cached in the project folder and only
+        regenerated (after the environment has been activated) if the
+        installed aiida-core changed (see `build_cmd_aiida_fingerprint`).
+        The fingerprint is stored in the first line of the cached script.
+
+        :param dict project_spec: specifications of the activated project
+        :param env_prefix: path to the project's python environment
+        :type env_prefix: pathlib.Path
+        :returns: list of commands to be run after environment activation
+        """
+        site_packages = self.get_site_packages(env_prefix)
+        if site_packages is None:
+            # unable to tell if the cache is outdated (this is basically an
+            # eval inside eval)
+            return ["eval \"$(verdi completioncommand)\""]
+        completion_file = (pathlib.Path(project_spec['project_path'])
+                           / constants.VERDI_COMPLETION_FILE)
+        return [
+            self.build_cmd_if_changed(
+                self.build_cmd_aiida_fingerprint(site_packages),
+                completion_file,
+                '{{ echo "$_aiida_project_fp"; verdi completioncommand; }} '
+                '> \'{tmp}\' && mv \'{tmp}\' \'{file}\' || rm -f \'{tmp}\''
+                .format(file=completion_file,
+                        tmp="{}.tmp".format(completion_file)),
+                prefix="# aiida-core: "),
+            self.build_cmd_source_completion(completion_file),
+        ]
+
+    @staticmethod
+    def build_cmd_aiida_fingerprint(site_packages):
+        """
+        Build the command printing a fingerprint of the installed aiida-core.
+
+        The fingerprint covers the name (i.e. the version) and entry points
+        of aiida-core's metadata in site-packages and, for editable
+        installs, the version and entry points of the egg-info in the
+        source tree the egg-link points to.
+
+        :param site_packages: path to the environment's site-packages
+        :returns: shell command writing the fingerprint to stdout
+        """
+        return (
+            "{{ printf '%s\\n' '{0}'/aiida_core-*.dist-info "
+            "'{0}'/aiida_core-*.egg-info; "
+            "cat '{0}'/aiida_core-*.dist-info/entry_points.txt "
+            "'{0}'/aiida_core-*.egg-info/entry_points.txt; "
+            "for link in '{0}'/aiida-core.egg-link '{0}'/aiida_core.egg-link; "
+            "do [ -f \"$link\" ] && read -r source < \"$link\" "
+            "&& grep -h '^Version:' \"$source\"/aiida_core.egg-info/PKG-INFO "
+            "&& cat \"$source\"/aiida_core.egg-info/entry_points.txt; done; "
+            "}} 2> /dev/null | cksum".format(site_packages))
+
+    @staticmethod
+    def build_cmd_source_completion(completion_file):
+        """Build the command sourcing the cached completion script."""
+        return "if [ -f '{0}' ]; then . '{0}'; fi".format(completion_file)
+
+    @staticmethod
+    def get_site_packages(env_prefix):
+        """
+        Return the site-packages folder of an environment.
+
+        :returns: path to site-packages or `None` if it is not found
+        """
+        site_packages = sorted(pathlib.Path(env_prefix).glob(
+            'lib/python*/site-packages'))
+        return site_packages[0] if site_packages else None
+
+    def check_conda_avail(self, conda_executable="conda"):
         """check if conda command is available in shell."""
-        conda_available = utils.check_command_avail('conda')
+        conda_available = utils.check_command_avail(conda_executable)
         if not conda_available:
             raise Exception("unable to activate environment because "
-                            "conda does not seem to be available.")
+                            "{} does not seem to be available."
+                            .format(conda_executable))
 
     def check_virtualenv_path(self, project_spec):
         """check if activate script for virtualenv exists."""
         path_to_env = pathlib.Path(project_spec['env_sub']).absolute()
-        path_to_activation_script = path_to_env / 'bin' / 'activate'
+        # environments are created inside the env folder (named by the
+        # project) but older specs may point to the environment directly
+        path_to_activation_script = (path_to_env / self.project_name
+                                     / 'bin' / 'activate')
+        if not path_to_activation_script.exists():
+            path_to_activation_script = path_to_env / 'bin' / 'activate'
         if not path_to_activation_script.exists():
             raise Exception("Unable to load project. No activation script "
                             "found at location {}"
@@ -201,6 +522,14 @@ class ActivateEnvBash(ActivateEnvBase):
             return str(path_to_activation_script.absolute())
 
 
+def write_activation_scripts(project_name):
+    """Write the precomputed activation scripts for all supported shells."""
+    written = []
+    for shell in constants.SUPPORTED_SHELLS:
+        written += get_activator(shell)(project_name).write_scripts()
+    return written
+
+
 def get_activator(shell):
     if shell not in constants.SUPPORTED_SHELLS:
         raise Exception("Unsupported shell type `{}` (currently supported "
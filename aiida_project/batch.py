@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+
+
+from __future__ import print_function
+
+import sys
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+if sys.version_info >= (3, 0):
+    import pathlib as pathlib
+else:
+    import pathlib2 as pathlib
+
+from aiida_project import utils
+from aiida_project import constants
+from aiida_project.create import get_creator
+from aiida_project.registry import ProjectRegistry
+
+
+"""
+Create several AiiDA projects at once
+"""
+
+
+# keys of a project definition which are not passed on to the creator
+PROJECT_KEYS = ['name', 'manager', 'aiida', 'python', 'path', 'packages']
+
+# creator options used if not defined by the manifest (same defaults as
+# for `aiida-project create`)
+CREATOR_DEFAULTS = {
+    constants.MANAGER_NAME_CONDA: {
+        'single_solve': True,
+        'solver': constants.CONDA_SOLVER_AUTO,
+    },
+    constants.MANAGER_NAME_VENV: {
+        'git_cache': True,
+        'wheelhouse': True,
+        'wheelhouse_size': constants.DEFAULT_WHEELHOUSE_SIZE,
+    },
+}
+
+
+def load_manifest(manifest_file):
+    """
+    Load the project definitions of a manifest file.
+
+    The manifest is a YAML file of the form::
+
+        defaults:           # optional, applied to all projects
+          manager: virtualenv
+          python: '3.8'
+          path: /path/to/projects
+        projects:
+          - name: project_a
+            aiida: 1.6.4
+            packages: [aiida-vasp, aiidateam/aiida-ase:devel]
+          - name: project_b
+            manager: conda
+            aiida: 1.6.4
+            solver: mamba   # any option accepted by the creator
+
+    :param manifest_file: path to the manifest file
+    :returns: list of project definitions (dictionaries) with the defaults
+        applied
+    :rtype: list
+    """
+    with open(str(manifest_file), 'r') as f:
+        manifest = utils.yaml_safe_load(f) or {}
+    if not isinstance(manifest, dict) or not manifest.get('projects'):
+        raise Exception("No projects defined in manifest {}"
+                        .format(manifest_file))
+    defaults = {
+        'manager': constants.MANAGER_NAME_VENV,
+        'python': '3.6',
+        'path': str(pathlib.Path.cwd().absolute()),
+        'packages': [],
+    }
+    defaults.update(manifest.get('defaults') or {})
+    projects = []
+    for definition in manifest['projects']:
+        project = dict(defaults)
+        project.update(definition)
+        if not project.get('name'):
+            raise Exception("Project without name in manifest {}"
+                            .format(manifest_file))
+        for key in ('python', 'aiida'):
+            # YAML reads unquoted versions as numbers, i.e. 3.10 as 3.1
+            if isinstance(project.get(key), (int, float)):
+                raise Exception("The {} version {} of project {} in manifest "
+                                "{} is not a string (please quote it, e.g. "
+                                "'3.10')".format(key, project[key],
+                                                 project['name'],
+                                                 manifest_file))
+        projects.append(project)
+    names = [project['name'] for project in projects]
+    duplicates = sorted(set(name for name in names if names.count(name) > 1))
+    if duplicates:
+        raise Exception("Project(s) defined more than once in manifest {}: "
+                        "{}".format(manifest_file, ", ".join(duplicates)))
+    return projects
+
+
+class ProjectResult(object):
+    """
+    Outcome of the creation of a single project.
+
+    :param str name: name of the project
+    :param bool success: `True` if the project was created
+    :param float seconds: wall time (in seconds) spent on the project
+    :param str error: error message if the creation failed
+    """
+
+    def __init__(self, name, success, seconds, error=None):
+        self.name = name
+        self.success = success
+        self.seconds = seconds
+        self.error = error
+
+
+class BatchCreator(object):
+    """
+    Create several projects concurrently with bounded parallelism.
+
+    Up to `jobs` projects are created at the same time while the
+    network-bound steps (clones, downloads) and the CPU-bound steps
+    (solves, builds, installs) of all projects are limited separately
+    using semaphores shared by all creators.
+
+    :param list projects: project definitions (see `load_manifest`)
+    :param int network_jobs: maximum number of concurrent network-bound
+        steps
+    :param int cpu_jobs: maximum number of concurrent CPU-bound steps
+    :param int jobs: maximum number of projects created at the same time
+        (defaults to `network_jobs + cpu_jobs`)
+    :param bool verbose: pass the output of all commands through while
+        they are running
+    :param tracer: optional tracer recording the steps of all projects
+    :type tracer: trace.Tracer
+    """
+
+    def __init__(self, projects, network_jobs=constants.DEFAULT_NETWORK_JOBS,
+                 cpu_jobs=constants.DEFAULT_CPU_JOBS, jobs=None,
+                 verbose=False, tracer=None):
+        self.projects = projects
+        self.verbose = verbose
+        self.tracer = tracer
+        self.jobs = jobs or network_jobs + cpu_jobs
+        self.phase_limits = {
+            constants.PHASE_NETWORK: threading.Semaphore(network_jobs),
+            constants.PHASE_CPU: threading.Semaphore(cpu_jobs),
+        }
+
+    def get_creator(self, project):
+        """Initialize the creator of a single project definition."""
+        manager = project['manager']
+        EnvCreator = get_creator(manager)
+        creator_options = dict(CREATOR_DEFAULTS.get(manager, {}))
+        creator_options.update((key, value) for (key, value)
+                               in project.items() if key not in PROJECT_KEYS)
+        if isinstance(creator_options.get('wheelhouse_size'), str):
+            creator_options['wheelhouse_size'] = utils.parse_size(
+                creator_options['wheelhouse_size'])
+        creator = EnvCreator(proj_name=project['name'],
+                             proj_path=pathlib.Path(project['path']),
+                             python_version=project['python'],
+                             aiida_version=project.get('aiida'),
+                             packages=list(project['packages']),
+                             **creator_options)
+        return creator
+
+    def create_project(self, project):
+        """
+        Create a single project.
+
+        Existing projects (or project folders) are never touched, i.e. they
+        are reported as failures.
+
+        :returns: the outcome of the creation
+        :rtype: ProjectResult
+        """
+        name = project['name']
+        start = time.time()
+        try:
+            project_folder = pathlib.Path(project['path']) / name
+            if project_folder.exists():
+                raise Exception("Project folder '{}' already exists"
+                                .format(project_folder))
+            if ProjectRegistry().exists(name):
+                raise Exception("Project name `{}` already in use."
+                                .format(name))
+            print("[{}] Creating project ...".format(name))
+            creator = self.get_creator(project)
+            creator.phase_limits = self.phase_limits
+            creator.show_spinner = False
+            creator.verbose = self.verbose
+            creator.tracer = self.tracer
+            creator.create_aiida_project_environment()
+        except Exception as exception:
+            seconds = time.time() - start
+            print("[{}] Failed after {:.1f}s".format(name, seconds))
+            return ProjectResult(name, False, seconds, str(exception))
+        seconds = time.time() - start
+        print("[{}] Done in {:.1f}s".format(name, seconds))
+        return ProjectResult(name, True, seconds)
+
+    def run(self):
+        """
+        Create all projects.
+
+        :returns: the outcome of every project (in the order of the project
+            definitions)
+        :rtype: list
+        """
+        pool = ThreadPoolExecutor(max_workers=max(1, self.jobs))
+        try:
+            futures = [pool.submit(self.create_project, project)
+                       for project in self.projects]
+            results = [future.result() for future in futures]
+        finally:
+            pool.shutdown(wait=True)
+        return results
+
+
+def format_report(results):
+    """
+    Format a consolidated report of a batch creation.
+
+    :param list results: list of `ProjectResult`
+    :returns: multiline report listing every project's status and timing
+    :rtype: str
+    """
+    width = max([len('project')] + [len(result.name) for result in results])
+    lines = ["{:<{width}}  {:<7}  {:>9}".format('project', 'status',
+                                                'time [s]', width=width)]
+    for result in results:
+        status = 'ok' if result.success else 'FAILED'
+        lines.append("{:<{width}}  {:<7}  {:>9.1f}".format(
+            result.name, status, result.seconds, width=width))
+    failed = [result for result in results if not result.success]
+    lines.append("{} of {} project(s) created".format(
+        len(results) - len(failed), len(results)))
+    for result in failed:
+        lines.append("{}: {}".format(result.name, result.error))
+    return "\n".join(lines)
@@ -0,0 +1,580 @@
+# -*- coding: utf-8 -*-
+
+
+from __future__ import print_function
+
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import hashlib
+if sys.version_info >= (3, 0):
+    import pathlib as pathlib
+else:
+    import pathlib2 as pathlib
+
+from aiida_project import utils
+from aiida_project import constants
+
+
+"""
+Caches shared by all AiiDA projects
+"""
+
+
+def get_folder_size(folder):
+    """Return the total size (in bytes) of all files below folder."""
+    total_size = 0
+    for (root, _, files) in os.walk(str(folder)):
+        for filename in files:
+            try:
+                total_size += os.lstat(os.path.join(root, filename)).st_size
+            except OSError:
+                pass
+    return total_size
+
+
+def prune_entries(entries, max_size=None, max_age=None):
+    """
+    Select cache entries to be evicted (least recently used first).
+
+    :param list entries: list of tuples (entry, size, last_used) where size
+        is given in bytes and last_used as timestamp
+    :param int max_size: Maximum size (in bytes) of all remaining entries
+    :param float max_age: Maximum time (in seconds) since an entry was
+        last used
+    :returns: list of entries to be evicted
+    :rtype: list
+    """
+    evict = []
+    keep = []
+    now = time.time()
+    for (entry, size, last_used) in sorted(entries, key=lambda e: e[2]):
+        if max_age is not None and now - last_used > max_age:
+            evict.append(entry)
+        else:
+            keep.append((entry, size))
+    if max_size is not None:
+        total_size = sum(size for (_, size) in keep)
+        for (entry, size) in keep:
+            if total_size <= max_size:
+                break
+            evict.append(entry)
+            total_size -= size
+    return evict
+
+
+class GitMirrorCache(object):
+    """
+    Bare mirrors of source repositories shared across projects.
+
+    Every repository is mirrored once to the cache folder. Before a
+    repository is cloned its mirror is updated by an incremental fetch and
+    the clone is then made locally from the mirror (using hardlinks), i.e.
+    with a warm cache only new commits are downloaded.
+
+    :param cache_folder: Folder containing the mirrors (defaults to the
+        git-cache folder inside the aiida-project configuration folder)
+    :type cache_folder: pathlib.Path
+    """
+
+    def __init__(self, cache_folder=None):
+        if cache_folder is None:
+            cache_folder = (pathlib.Path.home() / constants.CONFIG_FOLDER
+                            / constants.GIT_CACHE_FOLDER)
+        self.cache_folder = pathlib.Path(cache_folder).absolute()
+
+    def get_mirror_path(self, url):
+        """Return the location of the mirror for the repository at url."""
+        repository = url.rstrip('/').split('/')[-1]
+        if repository.endswith('.git'):
+            repository = repository[:-len('.git')]
+        repository = re.sub(r"[^A-Za-z0-9_\.\-]", "_", repository)
+        url_hash = hashlib.sha1(url.encode('utf-8')).hexdigest()[:12]
+        return self.cache_folder / "{}-{}.git".format(repository, url_hash)
+
+    def list_mirrors(self):
+        """Return a list of tuples (mirror_path, size, last_used)."""
+        if not self.cache_folder.exists():
+            return []
+        mirrors = []
+        for mirror in self.cache_folder.glob('*.git'):
+            mirrors.append((mirror, get_folder_size(mirror),
+                            mirror.stat().st_mtime))
+        return mirrors
+
+    def update_mirror(self, url):
+        """
+        Create or update the mirror of the repository at url.
+
+        :returns: path to the updated mirror
+        :rtype: pathlib.Path
+        """
+        mirror = self.get_mirror_path(url)
+        # projects created at the same time may share a mirror
+        with utils.FileLock(mirror.with_suffix('.lock')):
+            return self._update_mirror(url, mirror)
+
+    def _update_mirror(self, url, mirror):
+        """Create or update the mirror (while holding the mirror's lock)."""
+        # (mirrors are mostly made of packs, i.e. few files)
+        size_before = get_folder_size(mirror) if mirror.exists() else 0
+        if mirror.exists():
+            git_command = "git -C {} fetch --prune --quiet".format(mirror)
+        else:
+            if not self.cache_folder.exists():
+                self.cache_folder.mkdir(parents=True)
+            # clone to a temporary location first so that an interrupted
+            # clone never leaves a broken mirror behind
+            partial = mirror.with_suffix('.partial')
+            if partial.exists():
+                shutil.rmtree(str(partial))
+            git_command = ("git clone --mirror --quiet {} {} && mv {} {}"
+                           .format(url, partial, partial, mirror))
+        # the mirror has to serve blobless clones (see `clone`)
+        git_command += (" && git -C {} config uploadpack.allowFilter true"
+                        .format(mirror))
+        result = utils.run_command(git_command, shell=True)
+        if result.returncode:
+            raise Exception("Updating the cached mirror of {} failed. Used "
+                            "command {}, STDERR={}"
+                            .format(url, git_command, result.stderr))
+        utils.record_fetched(get_folder_size(mirror) - size_before)
+        # the modification time of the mirror tracks when it was last used
+        os.utime(str(mirror), None)
+        return mirror
+
+    def clone(self, url, location, branch=None,
+              mode=constants.CLONE_MODE_FULL,
+              depth=constants.DEFAULT_CLONE_DEPTH):
+        """
+        Clone the repository at url to location using the cached mirror.
+
+        Full clones are made from the mirror's path (using hardlinks),
+        shallow and blobless clones from the mirror's file:// URL since git
+        ignores `--depth` and `--filter` for clones from a local path.
+
+        :param str url: URL of the repository
+        :param str location: path to the location on disk
+        :param str branch: Specific branch of the repository
+        :param str mode: Clone mode, i.e. one of
+            `constants.SUPPORTED_CLONE_MODES`
+        :param int depth: Number of commits fetched for shallow clones
+        """
+        if mode not in constants.SUPPORTED_CLONE_MODES:
+            raise Exception("Unknown clone mode `{}` (available modes: {})"
+                            .format(mode, constants.SUPPORTED_CLONE_MODES))
+        print("Updating cached mirror of {} ...".format(url))
+        mirror = self.update_mirror(url)
+        git_clone_args = ["git", "clone", "--single-branch", "--quiet"]
+        source = str(mirror)
+        if mode == constants.CLONE_MODE_SHALLOW:
+            git_clone_args.append("--depth {}".format(depth))
+            source = mirror.as_uri()
+        elif mode == constants.CLONE_MODE_BLOBLESS:
+            git_clone_args.append("--filter=blob:none")
+            source = mirror.as_uri()
+        if branch:
+            git_clone_args.append("--branch {}".format(branch))
+        git_clone_args += [source, location]
+        # point the clone to the original repository instead of the mirror
+        # (missing history and blobs are fetched from there on demand)
+        git_command = "{} && git -C {} remote set-url origin {}".format(
+            " ".join(git_clone_args), location, url)
+        result = utils.run_command(git_command, shell=True)
+        if result.returncode:
+            raise Exception("Cloning {} from the cached mirror failed. Used "
+                            "command {}, STDERR={}"
+                            .format(url, git_command, result.stderr))
+
+    def prune(self, max_size=None, max_age=None):
+        """
+        Evict mirrors by size or by age (least recently used first).
+
+        Mirrors which are being updated (i.e. whose lock is held) are
+        skipped.
+
+        :param int max_size: Maximum total size (in bytes) of the cache
+        :param float max_age: Maximum time (in seconds) since a mirror was
+            last used
+        :returns: list of removed mirrors
+        :rtype: list
+        """
+        evict = prune_entries(self.list_mirrors(), max_size=max_size,
+                              max_age=max_age)
+        removed = []
+        for mirror in evict:
+            lock = utils.FileLock(mirror.with_suffix('.lock'), timeout=0)
+            try:
+                lock.acquire()
+            except Exception:
+                print("Skipping mirror {} (in use)".format(mirror))
+                continue
+            try:
+                shutil.rmtree(str(mirror))
+            finally:
+                lock.release()
+            removed.append(mirror)
+        return removed
+
+
+class Wheelhouse(object):
+    """
+    Wheels of index packages shared across projects.
+
+    Packages are installed with `--find-links` pointing to the wheelhouse.
+    After the install the wheels of all pins it resolved are added to the
+    wheelhouse using `pip wheel --no-deps` (i.e. without resolving again)
+    and the pins are stored, so that the next install of the same
+    requirements does not need the package index at all (`--no-index`) if
+    all wheels are still present. The wheelhouse is bounded in size by
+    evicting the least recently used wheels.
+
+    :param wheelhouse_folder: Folder containing the wheels (defaults to the
+        wheelhouse folder inside the aiida-project configuration folder)
+    :type wheelhouse_folder: pathlib.Path
+    :param int max_size: Maximum total size (in bytes) of all wheels (no
+        limit if `None`)
+    """
+
+    def __init__(self, wheelhouse_folder=None, max_size=None):
+        if wheelhouse_folder is None:
+            wheelhouse_folder = (pathlib.Path.home() / constants.CONFIG_FOLDER
+                                 / constants.WHEELHOUSE_FOLDER)
+        self.wheelhouse_folder = pathlib.Path(wheelhouse_folder).absolute()
+        self.max_size = max_size
+
+    @property
+    def stats_file(self):
+        return self.wheelhouse_folder / constants.WHEELHOUSE_STATS_FILE
+
+    def list_wheels(self):
+        """Return a list of tuples (wheel_path, size, last_used)."""
+        if not self.wheelhouse_folder.exists():
+            return []
+        wheels = []
+        for wheel in self.wheelhouse_folder.glob('*.whl'):
+            stat = wheel.stat()
+            wheels.append((wheel, stat.st_size, stat.st_mtime))
+        return wheels
+
+    def find_wheel(self, name, version):
+        """
+        Find the wheel of a package in the wheelhouse.
+
+        :param str name: name of the package
+        :param str version: exact version of the package
+        :returns: path to the wheel or `None` if no wheel is found
+        """
+        # wheel filenames are of the form name-version-...-tags.whl with
+        # the name normalized to underscores
+        name = utils.normalize_package_name(name)
+        for (wheel, _, _) in self.list_wheels():
+            wheel_name, wheel_version = wheel.name.split('-')[:2]
+            if (utils.normalize_package_name(wheel_name) == name
+                    and wheel_version == version):
+                return wheel
+        return None
+
+    def find_pinned_wheel(self, pin):
+        """
+        Find the wheel of a pin of the form name==version.
+
+        :returns: path to the wheel or `None` if no wheel is found
+        """
+        return self.find_wheel(*pin.split('==', 1))
+
+    def get_missing_pins(self, pins):
+        """Return the pins without a wheel in the wheelhouse."""
+        return [p for p in pins if self.find_pinned_wheel(p) is None]
+
+    @staticmethod
+    def get_resolution_key(requirements):
+        """
+        Return the key of the resolution of the given requirements.
+
+        :param list requirements: everything defining the resolution, i.e.
+            the interpreter, the installer flags and the requirements
+        """
+        key = hashlib.sha256(json.dumps(requirements).encode('utf-8'))
+        return key.hexdigest()[:16]
+
+    def get_resolution_file(self, key):
+        return (self.wheelhouse_folder
+                / constants.WHEELHOUSE_RESOLUTIONS_FOLDER / key)
+
+    def get_resolution(self, key):
+        """
+        Get the pins of a previous resolution.
+
+        :param str key: key of the resolved requirements (see
+            `get_resolution_key()`)
+        :returns: list of pins of the form name==version or `None` if the
+            requirements have not been resolved before
+        """
+        try:
+            with open(str(self.get_resolution_file(key)), 'r') as f:
+                return utils.get_pinned_packages(f)
+        except (IOError, OSError):
+            return None
+
+    def save_resolution(self, key, pins):
+        """Store the pins of the resolution of the requirements key."""
+        resolution_file = self.get_resolution_file(key)
+        if not resolution_file.parent.exists():
+            resolution_file.parent.mkdir(parents=True)
+        temporary_file = resolution_file.with_suffix('.tmp')
+        with open(str(temporary_file), 'w') as f:
+            f.write("".join("{}\n".format(pin) for pin in pins))
+        os.replace(str(temporary_file), str(resolution_file))
+
+    def get_stats(self):
+        """Return the accumulated hit / miss / eviction counts."""
+        stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        try:
+            with open(str(self.stats_file), 'r') as f:
+                stats.update(json.load(f))
+        except (IOError, OSError, ValueError):
+            pass
+        return stats
+
+    def update_stats(self, hits=0, misses=0, evictions=0):
+        """Add the given counts to the accumulated statistics."""
+        stats = self.get_stats()
+        stats['hits'] += hits
+        stats['misses'] += misses
+        stats['evictions'] += evictions
+        if not self.wheelhouse_folder.exists():
+            self.wheelhouse_folder.mkdir(parents=True)
+        temporary_file = self.stats_file.with_suffix('.tmp')
+        with open(str(temporary_file), 'w') as f:
+            json.dump(stats, f)
+        os.replace(str(temporary_file), str(self.stats_file))
+        return stats
+
+    def fill(self, pins, pkg_executable="pip", pkg_flags=None, env=None):
+        """
+        Add the wheels of the given pins to the wheelhouse.
+
+        The pins are the packages an install resolved, i.e. only the wheels
+        missing in the wheelhouse are downloaded (or built) one by one
+        without resolving their dependencies again.
+
+        :param list pins: pins of the form name==version
+        :param str pkg_executable: the pip executable
+        :param list pkg_flags: additional flags passed to `pip wheel`
+        :param dict env: Optional dictionary containing environment variables
+            passed to the subprocess running pip
+        :returns: tuple (hits, misses) containing the names of the wheels
+            taken from the wheelhouse and of the newly added wheels
+        :rtype: tuple
+        """
+        if not self.wheelhouse_folder.exists():
+            self.wheelhouse_folder.mkdir(parents=True)
+        wheels_before = set(w.name for (w, _, _) in self.list_wheels())
+        used = set()
+        missing = []
+        for pin in pins:
+            wheel = self.find_pinned_wheel(pin)
+            if wheel is None:
+                missing.append(pin)
+            else:
+                used.add(wheel.name)
+        if missing:
+            cmd_args = {
+                'exe': pkg_executable,
+                'flags': " ".join(pkg_flags or []),
+                'wheelhouse': self.wheelhouse_folder,
+                'pkgs': " ".join(missing),
+            }
+            cmd_fill = ("{exe} wheel --no-deps {flags} --wheel-dir "
+                        "{wheelhouse} --find-links {wheelhouse} {pkgs}"
+                        .format(**cmd_args))
+            result = utils.run_command(cmd_fill, env=env, shell=True,
+                                       capture=True,
+                                       line_callback=utils.record_download)
+            if result.returncode:
+                raise Exception("Filling the wheelhouse failed (STDERR: {})"
+                                .format(result.stderr))
+        return self.record_usage(wheels_before, used)
+
+    def record_usage(self, wheels_before, used):
+        """
+        Update statistics and usage times after filling the wheelhouse.
+
+        :param set wheels_before: names of all wheels present before
+        :param set used: names of the wheels taken from the wheelhouse
+        :returns: tuple (hits, misses) containing the names of the wheels
+            taken from the wheelhouse and of the newly added wheels
+        :rtype: tuple
+        """
+        hits = []
+        misses = []
+        for (wheel, _, _) in self.list_wheels():
+            if wheel.name not in wheels_before:
+                misses.append(wheel.name)
+            elif wheel.name in used:
+                hits.append(wheel.name)
+            else:
+                continue
+            # the modification time tracks when a wheel was last used
+            os.utime(str(wheel), None)
+        # projects created at the same time may share the wheelhouse
+        with utils.FileLock(self.wheelhouse_folder / '.lock'):
+            self.update_stats(hits=len(hits), misses=len(misses))
+            if self.max_size is not None:
+                self._prune(max_size=self.max_size)
+        return (sorted(hits), sorted(misses))
+
+    def prune(self, max_size=None, max_age=None,
+              grace_period=constants.WHEELHOUSE_GRACE_PERIOD):
+        """
+        Evict wheels by size or by age (least recently used first).
+
+        Wheels used within the grace period are kept (even if the
+        wheelhouse stays larger than max_size) since projects created at
+        the same time may be about to install them. The wheelhouse is
+        locked while wheels are evicted.
+
+        :param int max_size: Maximum total size (in bytes) of all wheels
+        :param float max_age: Maximum time (in seconds) since a wheel was
+            last used
+        :param float grace_period: Minimum time (in seconds) since a wheel
+            was last used before it may be evicted
+        :returns: list of removed wheels
+        :rtype: list
+        """
+        if not self.wheelhouse_folder.exists():
+            return []
+        with utils.FileLock(self.wheelhouse_folder / '.lock'):
+            return self._prune(max_size=max_size, max_age=max_age,
+                               grace_period=grace_period)
+
+    def _prune(self, max_size=None, max_age=None,
+               grace_period=constants.WHEELHOUSE_GRACE_PERIOD):
+        """Evict wheels (see `prune()`) with the wheelhouse locked."""
+        now = time.time()
+        wheels = []
+        recent_size = 0
+        for (wheel, size, last_used) in self.list_wheels():
+            if now - last_used < grace_period:
+                recent_size += size
+            else:
+                wheels.append((wheel, size, last_used))
+        if max_size is not None:
+            # the kept recently used wheels count towards the size
+            max_size = max(0, max_size - recent_size)
+        evict = prune_entries(wheels, max_size=max_size, max_age=max_age)
+        for wheel in evict:
+            wheel.unlink()
+        if evict:
+            self.update_stats(evictions=len(evict))
+        return evict
+
+
+class SourceWheelCache(object):
+    """
+    Wheels built from source repositories keyed by commit SHA.
+
+    Every wheel is stored in a content-addressed folder derived from the
+    repository URL and the commit it was built from, i.e. projects using
+    the same commit of a source package install the very same wheel
+    without cloning or building it again. (Extras do not change the built
+    wheel and are only applied when the wheel is installed.)
+
+    :param cache_folder: Folder containing the wheels (defaults to the
+        wheel-cache folder inside the aiida-project configuration folder)
+    :type cache_folder: pathlib.Path
+    """
+
+    def __init__(self, cache_folder=None):
+        if cache_folder is None:
+            cache_folder = (pathlib.Path.home() / constants.CONFIG_FOLDER
+                            / constants.WHEEL_CACHE_FOLDER)
+        self.cache_folder = pathlib.Path(cache_folder).absolute()
+
+    def get_entry_folder(self, url, commit):
+        """Return the folder containing the wheel built from url@commit."""
+        key = hashlib.sha256("{}@{}".format(url, commit).encode('utf-8'))
+        key = key.hexdigest()
+        return self.cache_folder / key[:2] / key
+
+    def list_entries(self):
+        """Return a list of tuples (entry_folder, size, last_used)."""
+        if not self.cache_folder.exists():
+            return []
+        entries = []
+        for entry in self.cache_folder.glob('??/*'):
+            if entry.is_dir() and not entry.name.endswith('.partial'):
+                entries.append((entry, get_folder_size(entry),
+                                entry.stat().st_mtime))
+        return entries
+
+    def lookup(self, url, commit):
+        """
+        Return the cached wheel for url@commit.
+
+        :returns: path to the wheel or `None` if no wheel has been built
+            for this commit yet
+        """
+        entry = self.get_entry_folder(url, commit)
+        wheels = sorted(entry.glob('*.whl')) if entry.exists() else []
+        if not wheels:
+            return None
+        os.utime(str(entry), None)
+        return wheels[0]
+
+    def build(self, url, commit, source_location, pkg_executable="pip",
+              env=None):
+        """
+        Build the wheel for the source checked out at source_location.
+
+        :param str url: URL of the source repository
+        :param str commit: commit SHA checked out at source_location
+        :param str source_location: path to the checked out sources
+        :param str pkg_executable: the pip executable
+        :param dict env: Optional dictionary containing environment variables
+            passed to the subprocess running pip
+        :returns: path to the cached wheel
+        :rtype: pathlib.Path
+        """
+        entry = self.get_entry_folder(url, commit)
+        # build to a private folder first and move it in place afterwards so
+        # that no incomplete entry is ever visible
+        partial = entry.with_name("{}.{}.partial".format(
+            entry.name, os.getpid()))
+        if partial.exists():
+            shutil.rmtree(str(partial))
+        partial.mkdir(parents=True)
+        cmd_build = ("{} wheel --no-deps --wheel-dir {} {}"
+                     .format(pkg_executable, partial, source_location))
+        result = utils.run_command(cmd_build, env=env, shell=True,
+                                   line_callback=utils.record_download)
+        if result.returncode or not list(partial.glob('*.whl')):
+            shutil.rmtree(str(partial))
+            raise Exception("Building wheel from {} failed (STDERR: {})"
+                            .format(source_location, result.stderr))
+        try:
+            os.rename(str(partial), str(entry))
+        except OSError:
+            # built concurrently by someone else, keep the existing entry
+            shutil.rmtree(str(partial))
+        return self.lookup(url, commit)
+
+    def prune(self, max_size=None, max_age=None):
+        """
+        Evict cached wheels by size or by age (least recently used first).
+
+        :param int max_size: Maximum total size (in bytes) of the cache
+        :param float max_age: Maximum time (in seconds) since a wheel was
+            last used
+        :returns: list of removed cache entries
+        :rtype: list
+        """
+        evict = prune_entries(self.list_entries(), max_size=max_size,
+                              max_age=max_age)
+        for entry in evict:
+            shutil.rmtree(str(entry))
+        return evict
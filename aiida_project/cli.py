@@ -3,8 +3,6 @@
 
 import sys
 import os
-import shutil
-import re
 if sys.version_info >= (3, 0):
     import pathlib as pathlib
 else:
@@ -12,11 +10,13 @@ else:
 
 import click
 
-from aiida_project.create import get_creator
-from aiida_project.activate import get_activator
 from aiida_project import constants
 from aiida_project import utils
 
+# NOTE: the creator, activator and cache modules are imported by the
+# subcommands using them, i.e. the activate / deactivate commands (which
+# are run in the shell's critical path) do not import the creator
+
 
 @click.group('aiida-project')
 def main():
@@ -24,6 +24,51 @@ def main():
     pass
 
 
+def parse_clone_modes(ctx, param, value):
+    """Parse clone mode definitions of the form <package>=<mode>."""
+    clone_modes = {}
+    for definition in value:
+        package, _, mode = definition.rpartition('=')
+        if not package or mode not in constants.SUPPORTED_CLONE_MODES:
+            raise click.BadParameter("expected <username>/<repository>=<mode> "
+                                     "with mode being one of {} (got '{}')"
+                                     .format(constants.SUPPORTED_CLONE_MODES,
+                                             definition))
+        clone_modes[package] = mode
+    return clone_modes
+
+
+def run_creator(creator, trace_file=None):
+    """Create the project (optionally writing a trace of the creation)."""
+    if trace_file:
+        from aiida_project.trace import Tracer
+        creator.tracer = Tracer()
+    try:
+        creator.create_aiida_project_environment()
+    finally:
+        if trace_file:
+            write_trace(creator.tracer, trace_file)
+
+
+def get_given_options(ctx, ignore=()):
+    """Return the options explicitly given on the command line."""
+    from click.core import ParameterSource
+    given = []
+    for param in ctx.command.params:
+        if not isinstance(param, click.Option) or param.name in ignore:
+            continue
+        if ctx.get_parameter_source(param.name) != ParameterSource.DEFAULT:
+            given.append("/".join(param.opts + param.secondary_opts))
+    return given
+
+
+def write_trace(tracer, trace_file):
+    """Write the trace of a creation and tell the user where it is."""
+    trace_file, chrome_file = tracer.write(trace_file)
+    print("Trace written to {} (Chrome trace: {})".format(trace_file,
+                                                          chrome_file))
+
+
 @main.command()
 @click.argument('name', type=str)
 @click.option('--manager', type=click.Choice(["conda", "virtualenv"]),
@@ -46,7 +91,94 @@ def main():
               help=("Alternative location for the environment folder "
                     "(Default installation path is the current working "
                     "directory)"))
-def create(name, manager, aiida_core, python_version, packages, path):
+@click.option('--jobs', '-j', 'jobs', type=click.IntRange(min=1),
+              default=constants.DEFAULT_CLONE_JOBS, show_default=True,
+              help=("Maximum number of source repositories cloned in "
+                    "parallel (virtualenv only)"))
+@click.option('--clone-mode', 'clone_mode',
+              type=click.Choice(constants.SUPPORTED_CLONE_MODES),
+              default=constants.CLONE_MODE_FULL, show_default=True,
+              help=("How source repositories are cloned: 'shallow' clones "
+                    "only fetch the last commits, 'blobless' clones fetch "
+                    "file contents on demand (virtualenv only)"))
+@click.option('--clone-depth', 'clone_depth', type=click.IntRange(min=1),
+              default=constants.DEFAULT_CLONE_DEPTH, show_default=True,
+              help="Number of commits fetched for shallow clones")
+@click.option('--clone-mode-for', 'clone_modes', multiple=True, type=str,
+              callback=parse_clone_modes,
+              help=("Clone mode for a single source package given as "
+                    "<username>/<repository>=<mode> (overrides "
+                    "--clone-mode for this package)"))
+@click.option('--git-cache/--no-git-cache', 'git_cache', default=True,
+              show_default=True,
+              help=("Clone source packages from local mirrors shared by all "
+                    "projects (virtualenv only)"))
+@click.option('--wheelhouse/--no-wheelhouse', 'wheelhouse', default=True,
+              show_default=True,
+              help=("Collect wheels of index packages in a wheelhouse shared "
+                    "by all projects (virtualenv only)"))
+@click.option('--wheelhouse-size', 'wheelhouse_size', type=str,
+              default=constants.DEFAULT_WHEELHOUSE_SIZE, show_default=True,
+              help=("Maximum size of the wheelhouse, least recently used "
+                    "wheels are evicted first"))
+@click.option('--source-install', 'source_install',
+              type=click.Choice(constants.SUPPORTED_SOURCE_INSTALLS),
+              default=constants.SOURCE_INSTALL_EDITABLE, show_default=True,
+              help=("Install source packages in editable mode or from wheels "
+                    "built once per commit and shared by all projects "
+                    "(virtualenv only)"))
+@click.option('--single-solve/--no-single-solve', 'single_solve',
+              default=True, show_default=True,
+              help=("Create the environment and install all packages with a "
+                    "single solve (conda only)"))
+@click.option('--solver', 'solver',
+              type=click.Choice([constants.CONDA_SOLVER_AUTO]
+                                + constants.SUPPORTED_CONDA_SOLVERS),
+              default=constants.CONDA_SOLVER_AUTO, show_default=True,
+              help=("Solver backend used to create the environment, 'auto' "
+                    "picks the fastest one available (conda only)"))
+@click.option('--channel', 'channels', multiple=True, type=str,
+              help=("Conda channel searched for packages, may be given "
+                    "multiple times in order of priority (defaults to "
+                    "'conda_channels' of the configuration file or {}) "
+                    "(conda only)".format(constants.DEFAULT_CONDA_CHANNELS)))
+@click.option('--override-channels/--no-override-channels',
+              'override_channels', default=None,
+              help=("Ignore channels configured in .condarc (conda only)"))
+@click.option('--strict-channel-priority/--no-strict-channel-priority',
+              'strict_channel_priority', default=None,
+              help=("Only take packages from the channel with the highest "
+                    "priority providing them (conda only)"))
+@click.option('--preflight', 'preflight', is_flag=True, default=False,
+              help=("Only show which channels provide the packages without "
+                    "creating the project (conda only)"))
+@click.option('--from-lock', 'lock_file',
+              type=click.Path(exists=True, dir_okay=False),
+              help=("Install exactly the packages of the given lock file "
+                    "(i.e. the {} file of another project) without "
+                    "resolving any dependencies (--python defaults to the "
+                    "python version of the lock file)"
+                    .format(constants.LOCK_FILE)))
+@click.option('--verbose', '-v', 'verbose', is_flag=True, default=False,
+              help=("Show the output of all commands while they are running "
+                    "(it is always written to the project's log files)"))
+@click.option('--trace', 'trace_file', type=click.Path(dir_okay=False),
+              default=None,
+              help=("Write the timing and resource usage of every step "
+                    "(including the bytes it fetched) to the given JSON file "
+                    "(and a Chrome trace to <name>.chrome.json next to it), "
+                    "the bytes received by the whole host are only recorded "
+                    "for the top level step"))
+@click.option('--resume', 'resume', is_flag=True, default=False,
+              help=("Continue the failed creation of project NAME from its "
+                    "first incomplete step (all other options are taken "
+                    "from the failed creation and cannot be given)"))
+@click.pass_context
+def create(ctx, name, manager, aiida_core, python_version, packages, path,
+           jobs, clone_mode, clone_depth, clone_modes, git_cache, wheelhouse,
+           wheelhouse_size, source_install, single_solve, solver, channels,
+           override_channels, strict_channel_priority, preflight, lock_file,
+           verbose, trace_file, resume):
     """
     Create a new AiiDA project environment.
 
@@ -64,28 +196,140 @@ def create(name, manager, aiida_core, python_version, packages, path):
     is expected to be of the form <username>/<repository>:<branch> or
     <username>/<repository>:<branch>[extras] which will also install the
     defined extras.
+
+    If the creation fails after the environment has been built the project
+    folder is kept and the creation can be continued using
+    `aiida-project create --resume NAME`.
     """
+    if resume:
+        # the checkpointed options are used, silently ignoring others would
+        # repeat the failure
+        given = get_given_options(ctx, ignore=('resume', 'verbose',
+                                               'trace_file'))
+        if given:
+            raise click.UsageError("--resume cannot be combined with {}"
+                                   .format(", ".join(given)))
+        from aiida_project.create import resume_creator
+        creator = resume_creator(name)
+        creator.verbose = verbose
+        run_creator(creator, trace_file)
+        return
+    if preflight and manager != constants.MANAGER_NAME_CONDA:
+        raise click.BadParameter("--preflight is only available for conda")
+    if lock_file and packages:
+        raise click.BadParameter("--utility-pkg cannot be combined with "
+                                 "--from-lock")
+    if lock_file and '--python' not in get_given_options(ctx):
+        # default to the python version the lock file was created for
+        python_version = (utils.get_locked_python_version(lock_file)
+                          or python_version)
     # first check if the project folder exists already
     project_folder = pathlib.Path(path) / name
-    if project_folder.exists():
+    if project_folder.exists() and not preflight:
         msg = ("Cannot create project folder '{}' because it already exists! "
                "Delete?".format(project_folder))
         delete = click.confirm(msg)
         if delete:
+            import shutil
             shutil.rmtree(project_folder)
         else:
             sys.exit(1)
     # fetch and setup the chosen environment manager
+    from aiida_project.create import get_creator
     EnvCreator = get_creator(manager)
+    creator_options = {'lock_file': lock_file}
+    if manager == constants.MANAGER_NAME_CONDA:
+        creator_options.update(single_solve=single_solve, solver=solver,
+                               channels=list(channels),
+                               override_channels=override_channels,
+                               strict_channel_priority=strict_channel_priority)
+    elif manager == constants.MANAGER_NAME_VENV:
+        creator_options.update(jobs=jobs, clone_mode=clone_mode,
+                               clone_depth=clone_depth,
+                               clone_modes=clone_modes,
+                               git_cache=git_cache,
+                               wheelhouse=wheelhouse,
+                               wheelhouse_size=utils.parse_size(
+                                   wheelhouse_size),
+                               source_install=source_install)
     creator = EnvCreator(proj_name=name, proj_path=pathlib.Path(path),
                          python_version=python_version,
-                         aiida_version=aiida_core, packages=list(packages))
-    creator.create_aiida_project_environment()
+                         aiida_version=aiida_core, packages=list(packages),
+                         **creator_options)
+    creator.verbose = verbose
+    if preflight:
+        channel_usage = creator.preflight_channels()
+        for (channel, channel_packages) in channel_usage.items():
+            if channel_packages:
+                print("{}: {}".format(channel, ", ".join(channel_packages)))
+            else:
+                print("{}: unused (consider removing it)".format(channel))
+        return
+    run_creator(creator, trace_file)
+
+
+@main.command('create-many')
+@click.argument('manifest', type=click.Path(exists=True, dir_okay=False))
+@click.option('--network-jobs', 'network_jobs', type=click.IntRange(min=1),
+              default=constants.DEFAULT_NETWORK_JOBS, show_default=True,
+              help=("Maximum number of network-bound steps (clones, "
+                    "downloads) run at the same time"))
+@click.option('--cpu-jobs', 'cpu_jobs', type=click.IntRange(min=1),
+              default=constants.DEFAULT_CPU_JOBS, show_default=True,
+              help=("Maximum number of CPU-bound steps (solves, builds, "
+                    "installs) run at the same time"))
+@click.option('--jobs', '-j', 'jobs', type=click.IntRange(min=1),
+              default=None,
+              help=("Maximum number of projects created at the same time "
+                    "(defaults to the sum of network and CPU jobs)"))
+@click.option('--verbose', '-v', 'verbose', is_flag=True, default=False,
+              help=("Show the output of all commands while they are running "
+                    "(interleaved for concurrently created projects)"))
+@click.option('--trace', 'trace_file', type=click.Path(dir_okay=False),
+              default=None,
+              help=("Write the timing and resource usage of every step of "
+                    "all projects (including the bytes it fetched) to the "
+                    "given JSON file (and a Chrome trace to "
+                    "<name>.chrome.json next to it), the bytes received by "
+                    "the whole host are only recorded for the top level "
+                    "steps"))
+def create_many(manifest, network_jobs, cpu_jobs, jobs, verbose, trace_file):
+    """
+    Create all AiiDA projects defined in a manifest file.
+
+    MANIFEST is a YAML file listing the projects (name, manager, aiida,
+    python, path, packages and any other creator option) under `projects`
+    and optional values shared by all projects under `defaults`. The
+    projects are created concurrently and a report of every project's
+    outcome and timing is printed at the end.
+    """
+    from aiida_project.batch import BatchCreator, load_manifest, format_report
+    projects = load_manifest(manifest)
+    tracer = None
+    if trace_file:
+        from aiida_project.trace import Tracer
+        tracer = Tracer()
+    batch_creator = BatchCreator(projects, network_jobs=network_jobs,
+                                 cpu_jobs=cpu_jobs, jobs=jobs,
+                                 verbose=verbose, tracer=tracer)
+    results = batch_creator.run()
+    if trace_file:
+        write_trace(tracer, trace_file)
+    print("")
+    print(format_report(results))
+    if not all(result.success for result in results):
+        sys.exit(1)
 
 
 @main.command()
 @click.argument('shelltype', type=str)
-def init(shelltype):
+@click.option('--write', 'init_file', type=click.Path(dir_okay=False),
+              default=None,
+              help=("Write a versioned init file to the given path instead "
+                    "of printing the init code. The file can be sourced from "
+                    "the shell's startup file and updates itself whenever "
+                    "aiida-project is moved or reinstalled"))
+def init(shelltype, init_file):
     """
     Initialize aiida-project for the shell you are running
     """
@@ -93,11 +337,23 @@ def init(shelltype):
         raise Exception("Unsupported shell type `{}` (currently supported "
                         "shell types: {})"
                         .format(shelltype, constants.SUPPORTED_SHELLS))
+    from aiida_project.activate import get_activator
     activator = get_activator(shelltype)
     executable = pathlib.Path(sys.argv[0]).absolute()
-    # print shell script required to activate the functionality of
-    # aiida-project for a given shell type
-    print(activator._setup(executable))
+    if init_file is None:
+        # print shell script required to activate the functionality of
+        # aiida-project for a given shell type
+        print(activator._setup(executable))
+        return
+    init_file = pathlib.Path(init_file).absolute()
+    if not init_file.parent.exists():
+        init_file.parent.mkdir(parents=True)
+    temporary_file = init_file.with_name(init_file.name + '.tmp')
+    with open(str(temporary_file), 'w') as f:
+        f.write(activator._setup_file(executable, init_file))
+    os.replace(str(temporary_file), str(init_file))
+    print("Init file written to {0} (add `. '{0}'` to your shell's startup "
+          "file)".format(init_file))
 
 
 @main.command()
@@ -114,8 +370,10 @@ def remove(project_name):
     This action will **permanently** delete all data contained in the
     project folder including databases, repositories and configs.
     """
+    from aiida_project.registry import ProjectRegistry
+    registry = ProjectRegistry()
     # check if the project exists before we go any further
-    if not utils.project_name_exists(project_name):
+    if not registry.exists(project_name):
         raise Exception("unable to delete project '{}' because it does not "
                         "exist")
     print("\nWARNING: You are about to delete the AiiDA project '{}'"
@@ -127,13 +385,106 @@ def remove(project_name):
     if delete:
         delete_really = click.confirm("This is your last chance, really?")
     if delete and delete_really:
-        project_spec = utils.load_project_spec()[project_name]
+        project_spec = registry.load(project_name)
         project_path = project_spec['project_path']
         # TODO: add the actual deletion
     else:
         print("Project not deleted!")
 
 
+@main.command()
+@click.argument('project_name', type=str)
+@click.argument('repositories', nargs=-1, type=str)
+def unshallow(project_name, repositories):
+    """
+    Fetch the full history of shallow or blobless source clones.
+
+    Fetches the complete history of all source repositories of the project
+    PROJECT_NAME (or only of the given REPOSITORIES) that have been cloned
+    using the shallow or blobless clone mode.
+    """
+    from aiida_project.registry import ProjectRegistry
+    try:
+        project_spec = ProjectRegistry().load(project_name)
+    except KeyError:
+        raise Exception("Project '{}' does not exist".format(project_name))
+    src_folder = pathlib.Path(project_spec['src_sub'])
+    if repositories:
+        clones = [src_folder / repository for repository in repositories]
+    elif src_folder.exists():
+        clones = sorted(p for p in src_folder.iterdir()
+                        if (p / '.git').exists())
+    else:
+        clones = []
+    for clone in clones:
+        if not (clone / '.git').exists():
+            raise Exception("No git repository found at {}".format(clone))
+        print("Fetching full history of {} ...".format(clone.name))
+        if not utils.unshallow_git_repo(str(clone)):
+            print("Repository {} is already a full clone".format(clone.name))
+
+
+@main.group()
+def cache():
+    """Manage caches shared by all AiiDA projects."""
+    pass
+
+
+@cache.command('prune')
+@click.option('--max-size', 'max_size', type=str, default=None,
+              help=("Evict least recently used entries until each cache is "
+                    "smaller than the given size (i.e. 500M, 2G)"))
+@click.option('--max-age', 'max_age', type=click.FloatRange(min=0),
+              default=None,
+              help="Evict entries not used within the given number of days")
+def cache_prune(max_size, max_age):
+    """
+    Evict cached repository mirrors and wheels by size or by age.
+    """
+    from aiida_project.cache import (GitMirrorCache, Wheelhouse,
+                                     SourceWheelCache)
+    if max_size is None and max_age is None:
+        raise click.UsageError("At least one of --max-size or --max-age "
+                               "is required")
+    if max_size is not None:
+        max_size = utils.parse_size(max_size)
+    if max_age is not None:
+        max_age = max_age * 24 * 60 * 60
+    removed = GitMirrorCache().prune(max_size=max_size, max_age=max_age)
+    for mirror in removed:
+        print("Removed cached mirror {}".format(mirror.name))
+    print("Removed {} cached mirror(s)".format(len(removed)))
+    removed = Wheelhouse().prune(max_size=max_size, max_age=max_age)
+    print("Removed {} wheel(s) from the wheelhouse".format(len(removed)))
+    removed = SourceWheelCache().prune(max_size=max_size, max_age=max_age)
+    print("Removed {} source wheel(s)".format(len(removed)))
+
+
+@cache.command('info')
+def cache_info():
+    """
+    Show size and usage statistics of the shared caches.
+    """
+    from aiida_project.cache import (GitMirrorCache, Wheelhouse,
+                                     SourceWheelCache)
+    mirrors = GitMirrorCache().list_mirrors()
+    print("Git mirrors: {} mirror(s), {:.1f} MB".format(
+        len(mirrors), sum(size for (_, size, _) in mirrors) / 1024.0**2))
+    wheelhouse = Wheelhouse()
+    wheels = wheelhouse.list_wheels()
+    stats = wheelhouse.get_stats()
+    lookups = stats['hits'] + stats['misses']
+    hit_rate = 100.0 * stats['hits'] / lookups if lookups else 0.0
+    print("Wheelhouse: {} wheel(s), {:.1f} MB".format(
+        len(wheels), sum(size for (_, size, _) in wheels) / 1024.0**2))
+    print("Wheelhouse: {} hit(s), {} miss(es) ({:.1f}% hit rate), {} "
+          "eviction(s)".format(stats['hits'], stats['misses'], hit_rate,
+                               stats['evictions']))
+    entries = SourceWheelCache().list_entries()
+    print("Source wheels: {} wheel(s), {:.1f} MB".format(
+        len(entries), sum(size for (_, size, _) in entries) / 1024.0**2))
+
+
 #
 # using activate / deactivate we communicate with the calling shell by
 # printing the commands to stdout, i.e we need to disable all unwanted
@@ -153,9 +504,17 @@ def activate(ctx, args, _help):
         help_txt = ctx.command.get_help(ctx).replace("[ARGS]...", "env_name")
         print("echo \"{}\"".format(help_txt))
     else:
+        from aiida_project.activate import get_activator
         Activator = get_activator(args[0])
         env_name = args[1]
-        print(Activator(env_name).execute(mode="activate"))
+        activator = Activator(env_name)
+        print(activator.execute(mode="activate"))
+        # (re)write the precomputed scripts so that following activations
+        # do not need to start python at all
+        try:
+            activator.write_scripts()
+        except (IOError, OSError):
+            pass
 
 
 @main.command(hidden=True, add_help_option=False)
@@ -176,5 +535,6 @@ def deactivate(ctx, args, _help):
         if active_project_name is None:
             raise Exception("No active project found")
         # get activator for shell and deactivate current aiida project
+        from aiida_project.activate import get_activator
         Activator = get_activator(args[0])
         print(Activator(active_project_name).execute(mode="deactivate"))
@@ -16,14 +16,120 @@ DEFAULT_SRC_SUBFOLDER = "src"
 DEFAULT_ENV_SUBFOLDER = "env"
 AIIDA_SUBFOLDER = ".aiida"
 
+# number of parallel workers used for cloning source packages
+DEFAULT_CLONE_JOBS = 4
+
+# kinds of project creation steps limited separately if several projects
+# are created at once (network-bound: clone, download; cpu-bound: solve,
+# build, install) and the default limits
+PHASE_NETWORK = 'network'
+PHASE_CPU = 'cpu'
+DEFAULT_NETWORK_JOBS = 4
+DEFAULT_CPU_JOBS = 2
+
+# modes for cloning source repositories (shallow clones only fetch the last
+# `depth` commits, blobless clones fetch file contents only on demand)
+CLONE_MODE_FULL = 'full'
+CLONE_MODE_SHALLOW = 'shallow'
+CLONE_MODE_BLOBLESS = 'blobless'
+SUPPORTED_CLONE_MODES = [
+    CLONE_MODE_FULL,
+    CLONE_MODE_SHALLOW,
+    CLONE_MODE_BLOBLESS,
+]
+DEFAULT_CLONE_DEPTH = 1
+
+# modes for installing source packages (editable installs of the cloned
+# sources or wheels built once per commit and cached across projects)
+SOURCE_INSTALL_EDITABLE = 'editable'
+SOURCE_INSTALL_WHEEL = 'wheel'
+SUPPORTED_SOURCE_INSTALLS = [
+    SOURCE_INSTALL_EDITABLE,
+    SOURCE_INSTALL_WHEEL,
+]
+
 # configuration file
 CONFIG_FOLDER = ".aiida_project"
+# registry of all projects, one specification file per project
+PROJECTS_FOLDER = "projects"
+# single file registry used by earlier versions (migrated to the projects
+# folder on first use)
 PROJECTS_FILE = ".projects.yaml"
+# lock serializing writes to the project registry, the maximum time (in
+# seconds) waited for it and the retry policy for transient I/O errors
+REGISTRY_LOCK_FILE = ".projects.lock"
+REGISTRY_LOCK_TIMEOUT = 60
+REGISTRY_RETRIES = 5
+REGISTRY_RETRY_DELAY = 0.05
+# site-wide ("shop") configuration defaults
+CONFIG_FILE = "config.yaml"
+# lock file written to the project folder after the environment was built
+LOCK_FILE = "aiida-project.lock"
+# verdi shell completion cached in the project folder
+VERDI_COMPLETION_FILE = ".verdi_completion.sh"
+# fingerprint of the environment's entry points of the last reentry scan
+REENTRY_SCAN_FILE = ".reentry_scan"
+# precomputed activation / deactivation scripts of all projects (located
+# inside the configuration folder)
+ACTIVATION_SCRIPTS_FOLDER = "activation"
+
+# logs of all commands run while creating a project (located inside the
+# configuration folder, one log file per project and phase) and the number
+# of output lines kept in memory for error messages
+LOGS_FOLDER = "logs"
+COMMAND_TAIL_LINES = 200
+
+# checkpoints of unfinished project creations (inside the configuration
+# folder, one file per project)
+CHECKPOINTS_FOLDER = "checkpoints"
+
+# cached results of command version probes (located inside the configuration
+# folder)
+COMMAND_CACHE_FILE = "command-cache.json"
+
+# shared caches (located inside the configuration folder)
+GIT_CACHE_FOLDER = "git-cache"
+WHEELHOUSE_FOLDER = "wheelhouse"
+WHEELHOUSE_STATS_FILE = ".stats.json"
+# pins of the resolved requirements of previous installs
+WHEELHOUSE_RESOLUTIONS_FOLDER = ".resolutions"
+DEFAULT_WHEELHOUSE_SIZE = "5G"
+# wheels used within this time (in seconds) are never evicted since
+# concurrently created projects may be installing them
+WHEELHOUSE_GRACE_PERIOD = 60 * 60
+WHEEL_CACHE_FOLDER = "wheel-cache"
 
 # define internal names for package managers
 MANAGER_NAME_CONDA = 'conda'
 MANAGER_NAME_VENV = 'virtualenv'
 
+# solver / installer backends usable by the conda manager
+CONDA_SOLVER_AUTO = 'auto'
+CONDA_SOLVER_CONDA = 'conda'
+CONDA_SOLVER_LIBMAMBA = 'libmamba'  # conda using the libmamba solver
+CONDA_SOLVER_MAMBA = 'mamba'
+CONDA_SOLVER_MICROMAMBA = 'micromamba'
+SUPPORTED_CONDA_SOLVERS = [
+    CONDA_SOLVER_CONDA,
+    CONDA_SOLVER_LIBMAMBA,
+    CONDA_SOLVER_MAMBA,
+    CONDA_SOLVER_MICROMAMBA,
+]
+# executables used by the solver backends (conda is used for all others)
+CONDA_SOLVER_EXECUTABLES = {
+    CONDA_SOLVER_MAMBA: 'mamba',
+    CONDA_SOLVER_MICROMAMBA: 'micromamba',
+}
+# channels used by the conda manager if not configured otherwise
+DEFAULT_CONDA_CHANNELS = [
+    'conda-forge',
+    'bioconda',
+    'matsci',
+]
+
+# first conda version using the libmamba solver by default
+CONDA_LIBMAMBA_DEFAULT_VERSION = (23, 10)
+
 # define internal names for shells
 SHELL_NAME_BASH = 'bash'
 
@@ -43,6 +149,9 @@ SUPPORTED_MANAGERS = [
     MANAGER_NAME_VENV,
 ]
 
+# format version of the init files written by `init <shell> --write`
+INIT_FILE_VERSION = 1
+
 # map shell types to their corresponding init scrips
 SCRIPT_MAP = {
     SHELL_NAME_BASH: 'aiida_project.sh',
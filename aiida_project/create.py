@@ -5,19 +5,29 @@ from __future__ import print_function
 
 import sys
 import re
+import json
 import shutil
 import os
+import time
+import threading
+import functools
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
 if sys.version_info >= (3, 0):
     import pathlib as pathlib
 else:
     import pathlib2 as pathlib
 
-import click
 import click_spinner
-import yaml
 
 from aiida_project import utils
 from aiida_project import constants
+from aiida_project import trace
+from aiida_project import tasks
+from aiida_project.cache import (GitMirrorCache, Wheelhouse, SourceWheelCache,
+                                 get_folder_size)
+from aiida_project.registry import ProjectRegistry
+from aiida_project.activate import write_activation_scripts
 
 
 """
@@ -48,6 +58,48 @@ class CreateEnvBase(object):
     pkg_flags_source = None  # additional flags used for source install
     pkg_arguments = None
 
+    # number of source repositories cloned in parallel
+    clone_jobs = constants.DEFAULT_CLONE_JOBS
+    # clone mode used for all source repositories, optionally overwritten
+    # for single packages by mapping <username>/<repository> (or only the
+    # repository name) to a clone mode
+    clone_mode = constants.CLONE_MODE_FULL
+    clone_depth = constants.DEFAULT_CLONE_DEPTH
+    clone_modes = {}
+    # optional cache of repository mirrors (GitMirrorCache) used for cloning
+    git_cache = None
+    # optional wheelhouse (Wheelhouse) shared by all projects for index
+    # packages
+    wheelhouse = None
+    # source packages are either installed in editable mode from the cloned
+    # sources or from wheels cached by commit (SourceWheelCache)
+    source_install = constants.SOURCE_INSTALL_EDITABLE
+    wheel_cache = None
+    # optional lock file of another project, if set the locked packages are
+    # installed as they are without resolving any dependencies
+    lock_file = None
+    # optional dictionary mapping the phase kinds (network / cpu) to
+    # semaphores limiting the number of concurrent steps of this kind across
+    # all creators sharing them (see `aiida_project.batch`)
+    phase_limits = None
+    # spinners are disabled if several projects are created at once
+    show_spinner = True
+    # pass the output of all commands through while they are running
+    # (otherwise it is only written to the log files)
+    verbose = False
+    # optional tracer (trace.Tracer) recording the timing and resources of
+    # every step
+    tracer = None
+    # name of the environment manager and the options the creator was
+    # initialized with (stored in the checkpoint to resume the creation)
+    manager = None
+    init_options = None
+    # continue a failed creation from its checkpoint
+    resume = False
+    # names of the completed steps of the running creation (`None` if no
+    # creation is running)
+    completed = None
+
     # cmd for creating environment
     cmd_env = "{exe} {cmds} {flags} {args}"
     # cmd for installing packages
@@ -65,10 +117,264 @@ class CreateEnvBase(object):
     def src_folder(self):
         return (self.proj_folder / self.src_subfolder).absolute()
 
+    @property
+    def lock_path(self):
+        return (self.proj_folder / constants.LOCK_FILE).absolute()
+
+    @property
+    def checkpoint_file(self):
+        return get_checkpoint_file(self.proj_name)
+
+    @property
+    def log_folder(self):
+        return (pathlib.Path.home() / constants.CONFIG_FOLDER
+                / constants.LOGS_FOLDER / self.proj_name)
+
+    def get_log_file(self, name):
+        """Return the log file of the phase name."""
+        return self.log_folder / "{}.log".format(name)
+
+    def reset_logs(self):
+        """Remove the logs of a previous creation of the project."""
+        if self.log_folder.exists():
+            shutil.rmtree(str(self.log_folder))
+
+    @contextlib.contextmanager
+    def phase(self, name, kind=None):
+        """
+        Run a step of the creation logging to the phase's log file.
+
+        The output of all commands run during the step is written to the
+        log file of the phase (see `get_log_file`) and network- or CPU-bound
+        steps are run within the shared phase limits.
+
+        :param str name: name of the phase (i.e. 'install')
+        :param str kind: kind of the step (i.e. `constants.PHASE_NETWORK`)
+        """
+        with utils.command_log(self.get_log_file(name), verbose=self.verbose):
+            if self.phase_limits is None or kind not in self.phase_limits:
+                with self.span(name, kind):
+                    yield
+                return
+            with self.phase_limits[kind], self.span(name, kind):
+                yield
+
+    @contextlib.contextmanager
+    def span(self, name, category=None, dependencies=None):
+        """
+        Record the step run within the context with the creator's tracer.
+
+        :param str name: name of the step
+        :param str category: kind of the step (defaults to 'step')
+        :param list dependencies: spans of the steps this step depends on
+        """
+        if self.tracer is None:
+            yield None
+            return
+        with self.tracer.span(name, category=category or 'step',
+                              project=self.proj_name,
+                              dependencies=dependencies) as span:
+            yield span
+
+    def run_traced(self, method, *args, **kwargs):
+        """Call a method of the creator recording it as a step."""
+        with self.span(method.__name__):
+            return method(*args, **kwargs)
+
+    def run_checkpointed(self, method, *args, **kwargs):
+        """
+        Call a method of the creator unless it was completed before.
+
+        The step is recorded in the checkpoint once it is completed, i.e. it
+        is skipped when the creation is resumed.
+        """
+        name = method.__name__
+        if name in (self.completed or []):
+            print("Skipping {} (completed before)".format(name))
+            return None
+        result = method(*args, **kwargs)
+        self.mark_completed(name)
+        return result
+
+    def get_task_graph(self):
+        """
+        Return an empty graph for the steps of the creation.
+
+        Up to `clone_jobs` clones are run while the environment is built.
+        """
+        return tasks.TaskGraph(max_workers=max(1, self.clone_jobs) + 1,
+                               span=self.span)
+
+    def add_step(self, graph, method, dependencies=None, **kwargs):
+        """
+        Add a checkpointed method of the creator to the task graph.
+
+        :returns: the name of the task (the method's name)
+        """
+        function = functools.partial(self.run_checkpointed, method, **kwargs)
+        return graph.add(method.__name__, function, dependencies)
+
+    def add_install_steps(self, graph, folders, environment, env=None):
+        """
+        Add the steps installing index and source packages to the graph.
+
+        Source packages are cloned as soon as the source folder exists, i.e.
+        while the environment is built. Building wheels of source packages
+        needs the environment's interpreter and the final install needs
+        everything.
+
+        :param graph: the task graph
+        :type graph: tasks.TaskGraph
+        :param str folders: name of the task creating the folder structure
+        :param str environment: name of the task building the environment
+        :param dict env: Optional dictionary containing environment variables
+            passed to the subprocesses
+        """
+        index_packages = [p for p in self.pkg_arguments if not
+                          utils.assert_package_is_source(p)]
+        source_packages = [p for p in self.pkg_arguments if
+                           utils.assert_package_is_source(p)]
+        self.check_clone_paths(source_packages)
+        dependencies = [environment]
+        clone_tasks = {}
+        if self.source_install == constants.SOURCE_INSTALL_WHEEL:
+            if source_packages:
+                dependencies.append(graph.add(
+                    'get_source_wheels', functools.partial(
+                        self.get_source_wheels, source_packages, env=env),
+                    [environment]))
+        else:
+            for package in source_packages:
+                clone_tasks[package] = graph.add(
+                    'clone_source_package[{}]'.format(package),
+                    functools.partial(self.clone_source_package, package),
+                    [folders])
+            dependencies += list(clone_tasks.values())
+
+        def install_packages():
+            if self.source_install == constants.SOURCE_INSTALL_WHEEL:
+                source_targets = graph.results.get('get_source_wheels', {})
+            else:
+                source_targets = dict(
+                    (package, graph.results[task])
+                    for (package, task) in clone_tasks.items())
+            return self.run_checkpointed(self.install_packages, env=env,
+                                         source_targets=source_targets)
+        return graph.add('install_packages', install_packages, dependencies)
+
+    def check_clone_paths(self, source_packages):
+        """
+        Check that no two source packages are cloned into the same folder.
+
+        Source packages are cloned to the folder named after their repository
+        in parallel, i.e. the clones of `userA/aiida-foo` and `userB/aiida-foo`
+        would overwrite each other.
+
+        :param list source_packages: source package definitions of the form
+            <username>/<repository>:<branch>[extras]
+        """
+        packages_by_repo = {}
+        for package in source_packages:
+            pkg_def, _ = utils.unpack_raw_package_input(package)
+            _, repo, _ = utils.unpack_package_def(pkg_def)
+            packages_by_repo.setdefault(repo, []).append(pkg_def)
+        for (repo, pkg_defs) in sorted(packages_by_repo.items()):
+            if len(pkg_defs) > 1:
+                raise Exception(
+                    "Source packages {} would all be cloned to `{}`"
+                    .format(", ".join("`{}`".format(p) for p in pkg_defs),
+                            self.src_folder / repo))
+
+    def run_task_graph(self, graph):
+        """Run all steps of the creation cleaning up if any step fails."""
+        try:
+            graph.run()
+        except Exception:
+            self.exit_on_exception()
+            raise
+
+    def start_checkpoints(self):
+        """
+        Prepare the checkpoint of the creation.
+
+        A new creation removes the logs and checkpoint of a previous one,
+        a resumed creation continues with all completed steps which are
+        still valid (see `validate_checkpoint`).
+        """
+        self._checkpoint_lock = threading.Lock()
+        if not self.resume:
+            self.reset_logs()
+            self.remove_checkpoint()
+            self.completed = []
+            return
+        checkpoint = load_checkpoint(self.proj_name)
+        self.completed = self.validate_checkpoint(checkpoint['completed'])
+        print("Resuming creation of project {} ({} step(s) completed)"
+              .format(self.proj_name, len(self.completed)))
+
+    def validate_checkpoint(self, completed):
+        """
+        Return the completed steps whose results are still present.
+
+        Clones are valid as long as the cloned repository exists, all
+        other steps are valid as long as the environment exists.
+
+        :param list completed: names of the completed steps
+        :rtype: list
+        """
+        valid = []
+        for name in completed:
+            if name.startswith('clone-'):
+                repo = name[len('clone-'):]
+                done = (self.src_folder / repo / '.git').exists()
+            else:
+                done = self.environment_exists()
+            if done:
+                valid.append(name)
+            else:
+                print("Step {} has to be repeated".format(name))
+        return valid
+
+    def environment_exists(self):
+        """Check the python environment of the project exists."""
+        return (self.env_folder / self.proj_name).exists()
+
+    def mark_completed(self, name):
+        """Record a completed step in the checkpoint."""
+        if self.completed is None:
+            return
+        with self._checkpoint_lock:
+            self.completed.append(name)
+            self.save_checkpoint()
+
+    def save_checkpoint(self):
+        """Write the completed steps and the creator's options."""
+        checkpoint = {
+            'manager': self.manager,
+            'project_folder': str(self.proj_folder),
+            'options': self.init_options,
+            'completed': list(self.completed),
+        }
+        checkpoint_folder = self.checkpoint_file.parent
+        if not checkpoint_folder.exists():
+            checkpoint_folder.mkdir(parents=True, exist_ok=True)
+        utils.write_yaml_atomic(self.checkpoint_file, checkpoint)
+
+    def remove_checkpoint(self):
+        """Remove the checkpoint once it is not needed anymore."""
+        if self.checkpoint_file.exists():
+            self.checkpoint_file.unlink()
+
+    def spinner(self):
+        """Return a spinner shown while a step is running."""
+        disable = self.verbose or not self.show_spinner
+        return click_spinner.spinner(disable=disable)
+
     def create_folder_structure(self):
         """Setup the environments folder structure."""
-        # create the parent folder holding the project
-        self.proj_folder.mkdir(exist_ok=False)
+        # create the parent folder holding the project (the folders exist
+        # already if a failed creation is resumed)
+        self.proj_folder.mkdir(exist_ok=self.resume)
         # once we have setup the parent folder we can create the subfolder
         # structure
         create_subfolder = [self.aiida_subfolder, self.env_subfolder]
@@ -76,7 +382,7 @@ class CreateEnvBase(object):
             create_subfolder += [self.src_subfolder]
         for subfolder in create_subfolder:
             project_subfolder = self.proj_folder / subfolder
-            project_subfolder.mkdir(exist_ok=False)
+            project_subfolder.mkdir(exist_ok=self.resume)
 
     def install_packages_from_index(self, env=None):
         """
@@ -103,12 +409,13 @@ class CreateEnvBase(object):
         }
         cmd_install_index = self.cmd_install.format(**cmd_args)
         print("Installing index packages to environment ...")
-        with click_spinner.spinner():
-            errno, stdout, stderr = utils.run_command(cmd_install_index,
-                                                      env=env, shell=True)
-        if errno:
+        with self.spinner(), self.phase('install', constants.PHASE_CPU):
+            result = utils.run_command(cmd_install_index, env=env,
+                                       shell=True,
+                                       line_callback=utils.record_download)
+        if result.returncode:
             raise Exception("Installation of packages failed (STDERR: {}"
-                            .format(stderr))
+                            .format(result.stderr))
 
     def install_packages_from_source(self, env=None):
         """Install a package directly from source.
@@ -118,41 +425,407 @@ class CreateEnvBase(object):
         :param dict env: Optional dictionary containing environment variables
             passed to the subprocess executing the install
         """
-        source_packages = [p for p in self.pkg_arguments if
-                           utils.assert_package_is_source(p)]
+        self.install_packages(env=env, index=False, source=True)
+
+    def install_packages(self, env=None, index=True, source=True,
+                         source_targets=None):
+        """
+        Install index and source packages using a single installer call.
+
+        Source packages are cloned first (see `clone_source_packages()`) and
+        are then passed to the installer together with all index packages
+        so that all dependencies are resolved in a single pass.
+
+        :param dict env: Optional dictionary containing environment variables
+            passed to the subprocess executing the install
+        :param bool index: If `False` index packages are not installed
+        :param bool source: If `False` source packages are not installed
+        :param dict source_targets: Optional dictionary mapping the source
+            packages to their install targets if they have been cloned (or
+            built) already
+        """
+        index_packages = []
+        if index:
+            index_packages = [p for p in self.pkg_arguments if not
+                              utils.assert_package_is_source(p)]
+        source_packages = []
+        if source:
+            source_packages = [p for p in self.pkg_arguments if
+                               utils.assert_package_is_source(p)]
         # skip this step if there are no packages to be installed
-        if not source_packages:
-            print("No source packages set for installation. Skipping ...")
+        if not index_packages and not source_packages:
+            print("No packages set for installation. Skipping ...")
             return
-        # clone and install defined source packages
-        print("Installing source packages to environment ... ")
+        if self.source_install == constants.SOURCE_INSTALL_WHEEL:
+            if source_targets is None:
+                source_targets = self.get_source_wheels(source_packages,
+                                                        env=env)
+            source_flags = []
+        else:
+            if source_targets is None:
+                source_targets = self.clone_source_packages(source_packages)
+            source_flags = self.pkg_flags_source
+        pkg_flags = list(self.pkg_flags)
+        pins = None
+        if self.wheelhouse is not None and index_packages:
+            # editable installs build the source packages, i.e. they need
+            # the build requirements from the package index
+            if (self.source_install == constants.SOURCE_INSTALL_WHEEL
+                    or not source_packages):
+                pins = self.wheelhouse.get_resolution(
+                    self.get_resolution_key())
+            pkg_flags += self.get_wheelhouse_flags(pins)
+        # index packages are passed as they are while every source package
+        # is prefixed by the source flags, i.e. --editable path[extras]
+        install_targets = list(index_packages)
         for package in source_packages:
-            pkg_def, pkg_extras = utils.unpack_raw_package_input(package)
-            username, repo, branch = utils.unpack_package_def(pkg_def)
-            github_url = utils.build_source_url(username, repo)
-            # put source in source_subfolder / repository_name
-            clone_path = self.src_folder / repo
-            clone_path_str = str(clone_path.absolute())
-            # clone repository to disk
-            utils.clone_git_repo_to_disk(github_url, clone_path_str,
-                                         branch=branch)
-            # build entry of the form path_to_package[extras] which will
-            # be passed to the pip installer
-            pkg_install_path = "{}{}".format(clone_path_str, pkg_extras)
-            # build command for installing packages from source
-            cmd_args = {
-                'exe': self.pkg_executable,
-                'cmds': " ".join(self.pkg_commands),
-                'flags': " ".join(self.pkg_flags_source),
-                'pkgs': pkg_install_path,
-            }
-            cmd_install_source = self.cmd_install.format(**cmd_args)
-            with click_spinner.spinner():
-                errno, stdout, stderr = utils.run_command(cmd_install_source,
-                                                          env=env, shell=True)
-            if errno:
-                raise Exception("Installation of packages failed (STDERR: {}"
-                                .format(stderr))
+            install_targets += source_flags
+            install_targets.append(source_targets[package])
+        cmd_args = {
+            'exe': self.pkg_executable,
+            'cmds': " ".join(self.pkg_commands),
+            'flags': " ".join(pkg_flags),
+            'pkgs': " ".join(install_targets),
+        }
+        cmd_install = self.cmd_install.format(**cmd_args)
+        print("Installing packages to environment ...")
+        with self.spinner(), self.phase('install', constants.PHASE_CPU):
+            result = utils.run_command(cmd_install, env=env, shell=True,
+                                       line_callback=utils.record_download)
+        if result.returncode and "--no-index" in pkg_flags:
+            # the stored resolution may be outdated (e.g. a source package
+            # requires a new dependency)
+            print("Installing from the wheelhouse failed. Retrying with the "
+                  "package index ...")
+            cmd_install = cmd_install.replace("--no-index ", "", 1)
+            with self.spinner(), self.phase('install', constants.PHASE_CPU):
+                result = utils.run_command(
+                    cmd_install, env=env, shell=True,
+                    line_callback=utils.record_download)
+        if result.returncode:
+            # since everything is installed at once we have to find the
+            # responsible package(s) from the installer's output
+            identifiers = {}
+            for package in index_packages:
+                identifiers[package] = [utils.get_package_name(package)]
+            for package in source_packages:
+                pkg_def, _ = utils.unpack_raw_package_input(package)
+                _, repo, _ = utils.unpack_package_def(pkg_def)
+                identifiers[package] = [str(self.src_folder / repo), repo]
+            failed = utils.find_packages_in_output(
+                result.stdout + result.stderr, identifiers)
+            if failed:
+                raise Exception("Installation of packages failed (failed "
+                                "packages: {}) (STDERR: {})"
+                                .format(", ".join(failed), result.stderr))
+            raise Exception("Installation of packages failed (STDERR: {}"
+                            .format(result.stderr))
+        if self.wheelhouse is not None and index_packages:
+            self.fill_wheelhouse(env=env)
+
+    def get_resolution_key(self):
+        """Return the key of the resolution of the requested packages."""
+        return self.wheelhouse.get_resolution_key(
+            list(self.env_arguments) + list(self.pkg_flags)
+            + [self.source_install] + sorted(self.pkg_arguments))
+
+    def get_wheelhouse_flags(self, pins=None):
+        """
+        Return the installer flags taking the wheels from the wheelhouse.
+
+        :param list pins: Optional pins of the form name==version that are
+            installed, if the wheels of all of them are in the wheelhouse the
+            package index is not used at all
+        """
+        flags = ["--find-links {}".format(self.wheelhouse.wheelhouse_folder)]
+        if pins and not self.wheelhouse.get_missing_pins(pins):
+            flags.insert(0, "--no-index")
+        return flags
+
+    def fill_wheelhouse(self, pins=None, env=None):
+        """
+        Add the wheels of the installed packages to the shared wheelhouse.
+
+        If no pins are given the installed packages are listed and their
+        pins are stored as the resolution of the requested packages. A
+        failure is not fatal since the environment is complete anyway.
+
+        :param list pins: Optional pins of the form name==version
+        :param dict env: Optional dictionary containing environment variables
+            passed to the subprocesses filling the wheelhouse
+        """
+        print("Collecting wheels in the wheelhouse ...")
+        try:
+            with self.spinner(), self.phase('wheelhouse',
+                                            constants.PHASE_NETWORK):
+                if pins is None:
+                    result = utils.run_command(self.get_lock_command(),
+                                               env=env, shell=True,
+                                               capture=True)
+                    if result.returncode:
+                        raise Exception("Listing the installed packages "
+                                        "failed (STDERR: {})"
+                                        .format(result.stderr))
+                    pins = utils.get_pinned_packages(
+                        result.stdout.splitlines())
+                    self.wheelhouse.save_resolution(
+                        self.get_resolution_key(), pins)
+                hits, misses = self.wheelhouse.fill(
+                    pins, pkg_executable=self.pkg_executable,
+                    pkg_flags=self.pkg_flags, env=env)
+        except Exception as exception:
+            print("Warning: {}. Continuing without wheelhouse ..."
+                  .format(exception))
+            return
+        print("Wheelhouse: {} wheel(s) reused, {} wheel(s) added"
+              .format(len(hits), len(misses)))
+
+    def clone_source_packages(self, source_packages):
+        """
+        Clone source packages to the project's source folder in parallel.
+
+        At most `clone_jobs` repositories are cloned at the same time. All
+        clones are run to completion even if one of them fails so that every
+        failing package is reported.
+
+        :param list source_packages: source package definitions of the form
+            <username>/<repository>:<branch>[extras]
+        :returns: dictionary mapping every package definition to the install
+            target of the form path_to_package[extras]
+        :rtype: dict
+        """
+        if not source_packages:
+            return {}
+        self.check_clone_paths(source_packages)
+        print("Cloning source packages ... ")
+        return self.run_parallel(self.clone_source_package, source_packages)
+
+    def get_source_wheels(self, source_packages, env=None):
+        """
+        Get wheels for all source packages from the wheel cache.
+
+        Packages not found in the cache are cloned and built in parallel
+        (using at most `clone_jobs` workers).
+
+        :param list source_packages: source package definitions of the form
+            <username>/<repository>:<branch>[extras]
+        :param dict env: Optional dictionary containing environment variables
+            passed to the subprocess building the wheels
+        :returns: dictionary mapping every package definition to the install
+            target of the form path_to_wheel[extras]
+        :rtype: dict
+        """
+        if not source_packages:
+            return {}
+        print("Collecting wheels of source packages ... ")
+        return self.run_parallel(self.get_source_wheel, source_packages,
+                                 env=env)
+
+    def run_parallel(self, function, packages, **kwargs):
+        """
+        Call function for every package using at most `clone_jobs` workers.
+
+        All calls are run to completion even if one of them fails so that
+        every failing package is reported.
+
+        :returns: dictionary mapping every package to the function's result
+        :rtype: dict
+        """
+        pool = ThreadPoolExecutor(max_workers=max(1, self.clone_jobs))
+        parent_span = trace.current_span()
+
+        def run(package):
+            # nest the spans of the workers below the calling step
+            with trace.Tracer.attach(parent_span):
+                return function(package, **kwargs)
+        try:
+            futures = [(package, pool.submit(run, package))
+                       for package in packages]
+            results = {}
+            errors = []
+            for (package, future) in futures:
+                try:
+                    results[package] = future.result()
+                except Exception as exception:
+                    errors.append(str(exception))
+        finally:
+            pool.shutdown(wait=True)
+        if errors:
+            raise Exception("\n".join(errors))
+        return results
+
+    def get_source_wheel(self, package, env=None):
+        """
+        Get the wheel of a single source package from the wheel cache.
+
+        The commit is resolved from the remote repository (no git command is
+        run at all if the package is pinned to a full commit SHA) and the
+        repository is only cloned and built if no wheel is cached for it.
+
+        :param str package: source package definition of the form
+            <username>/<repository>:<branch>[extras]
+        :returns: entry of the form path_to_wheel[extras] which will be
+            passed to the pip installer
+        :rtype: str
+        """
+        pkg_def, pkg_extras = utils.unpack_raw_package_input(package)
+        username, repo, branch = utils.unpack_package_def(pkg_def)
+        github_url = utils.build_source_url(username, repo)
+        log_name = "wheel-{}".format(repo)
+        try:
+            with self.phase(log_name, constants.PHASE_NETWORK):
+                commit = utils.resolve_git_commit(github_url, branch)
+            wheel = self.wheel_cache.lookup(github_url, commit)
+            if wheel is None:
+                clone_target = self.clone_source_package(pkg_def)
+                clone_path, _ = utils.unpack_raw_package_input(clone_target)
+                # the branch may have moved since it has been resolved
+                commit = utils.get_git_head(clone_path)
+                print("Building wheel for {} ({}) ...".format(
+                    pkg_def, commit[:10]))
+                with self.phase(log_name, constants.PHASE_CPU):
+                    wheel = self.wheel_cache.build(
+                        github_url, commit, clone_path,
+                        pkg_executable=self.pkg_executable, env=env)
+            else:
+                print("Using cached wheel for {} ({})".format(
+                    pkg_def, commit[:10]))
+        except Exception as exception:
+            raise Exception("Unable to get wheel for source package `{}`: {}"
+                            .format(pkg_def, exception))
+        return "{}{}".format(wheel, pkg_extras)
+
+    def clone_source_package(self, package):
+        """
+        Clone a single source package to the project's source folder.
+
+        :param str package: source package definition of the form
+            <username>/<repository>:<branch>[extras]
+        :returns: entry of the form path_to_package[extras] which will be
+            passed to the pip installer
+        :rtype: str
+        """
+        pkg_def, pkg_extras = utils.unpack_raw_package_input(package)
+        username, repo, branch = utils.unpack_package_def(pkg_def)
+        github_url = utils.build_source_url(username, repo)
+        # put source in source_subfolder / repository_name
+        clone_path = self.src_folder / repo
+        clone_path_str = str(clone_path.absolute())
+        clone_mode = self.get_clone_mode(pkg_def)
+        phase_name = "clone-{}".format(repo)
+        if phase_name in (self.completed or []):
+            print("Skipping clone of {} (completed before)".format(pkg_def))
+            return "{}{}".format(clone_path_str, pkg_extras)
+        if self.resume and clone_path.exists():
+            # left behind by an interrupted clone of the previous attempt
+            shutil.rmtree(clone_path_str)
+        start = time.time()
+        created = not clone_path.exists()
+        try:
+            # a commit cannot be cloned directly, i.e. the default branch
+            # is cloned first and the commit is checked out afterwards
+            commit = branch if utils.is_commit_sha(branch) else None
+            if commit:
+                branch = None
+            with self.phase(phase_name, constants.PHASE_NETWORK):
+                if self.git_cache is not None:
+                    self.git_cache.clone(github_url, clone_path_str,
+                                         branch=branch, mode=clone_mode,
+                                         depth=self.clone_depth)
+                else:
+                    utils.clone_git_repo_to_disk(github_url, clone_path_str,
+                                                 branch=branch, spinner=False,
+                                                 mode=clone_mode,
+                                                 depth=self.clone_depth)
+                    # (clones from the git cache are local, the objects
+                    # fetched into the mirror are recorded by the cache)
+                    utils.record_fetched(get_folder_size(clone_path / '.git'))
+                if commit:
+                    utils.checkout_git_commit(clone_path_str, commit)
+        except Exception as exception:
+            print("Cloning {} failed!".format(pkg_def))
+            # a partial clone would make a resumed creation fail to clone
+            # into the existing folder (a folder that existed before is
+            # left alone)
+            if created and clone_path.exists():
+                shutil.rmtree(clone_path_str)
+            raise Exception("Unable to clone source package `{}`: {}"
+                            .format(pkg_def, exception))
+        print("Cloning {} done ({:.1f}s)".format(pkg_def, time.time() - start))
+        self.mark_completed(phase_name)
+        return "{}{}".format(clone_path_str, pkg_extras)
+
+    def get_clone_mode(self, package_definition):
+        """
+        Get the clone mode for a source package.
+
+        :param str package_definition: String of the form
+            <username>/<repository>:<branchname> defining the source
+        """
+        username, repo, _ = utils.unpack_package_def(package_definition)
+        user_repo = "{}/{}".format(username, repo)
+        for key in (user_repo, repo):
+            if key in self.clone_modes:
+                return self.clone_modes[key]
+        return self.clone_mode
+
+    def write_lock_file(self, env=None):
+        """
+        Record all packages installed to the environment in a lock file.
+
+        The lock file is written to the project folder and may be passed to
+        `aiida-project create --from-lock` to recreate the environment. A
+        failure is not fatal since the environment is complete anyway.
+
+        :param dict env: Optional dictionary containing environment variables
+            passed to the subprocess listing the installed packages
+        :returns: path to the written lock file or `None` on failure
+        """
+        cmd_lock = self.get_lock_command()
+        with self.phase('lock'):
+            result = utils.run_command(cmd_lock, env=env, shell=True,
+                                       capture=True)
+        if result.returncode:
+            print("Warning: unable to write the lock file (STDERR: {})"
+                  .format(result.stderr))
+            return None
+        with open(str(self.lock_path), 'w') as f:
+            f.write(self.format_lock_file(result.stdout))
+        print("Lock file written to {}".format(self.lock_path))
+        return self.lock_path
+
+    def get_lock_command(self):
+        """Return the command listing the installed packages."""
+        raise NotImplementedError
+
+    def format_lock_file(self, output):
+        """Create the lock file contents from the lock command's output."""
+        return output
+
+    def get_aiida_version_from_lock(self, lock_file):
+        """Get the aiida-core version pinned in the given lock file."""
+        aiida_version = utils.get_locked_version(lock_file, 'aiida-core')
+        if aiida_version is None:
+            raise Exception("Unable to find aiida-core in lock file {} "
+                            "(please define the AiiDA version explicitly)"
+                            .format(lock_file))
+        return aiida_version
+
+    def check_python_version_from_lock(self, lock_file, python_version):
+        """
+        Check the lock file was created for the requested python version.
+
+        The pinned packages are installed without resolving, i.e. they may
+        not be installable for another python version.
+        """
+        locked_version = utils.get_locked_python_version(lock_file)
+        if locked_version is None:
+            return
+        if not utils.python_versions_match(locked_version, python_version):
+            raise Exception("The lock file {} was created for python {} but "
+                            "python {} is requested (use --python {})"
+                            .format(lock_file, locked_version,
+                                    python_version, locked_version))
 
     def build_python_environment(self):
         """Create the python environment with specified python version."""
@@ -166,12 +839,12 @@ class CreateEnvBase(object):
         cmd_create_env = self.cmd_env.format(**cmd_args)
         print("Building new python environment ({}) ... "
               .format(self.proj_name))
-        with click_spinner.spinner():
-            errno, stdout, stderr = utils.run_command(cmd_create_env, env=None,
-                                                      shell=True)
-        if errno:
+        with self.spinner(), self.phase('environment', constants.PHASE_CPU):
+            result = utils.run_command(cmd_create_env, env=None,
+                                       shell=True)
+        if result.returncode:
             raise Exception("Environment setup failed (STDERR: {})"
-                            .format(stderr))
+                            .format(result.stderr))
 
     def get_project_spec(self, proj_name, proj_path, manager, aiida_version,
                          python_version, env_folder, src_folder):
@@ -187,9 +860,43 @@ class CreateEnvBase(object):
         }
         return project_spec
 
+    def register_project(self, project_spec):
+        """Add the project specification to the project registry."""
+        project_spec = dict(project_spec)
+        project_name = project_spec.pop('project_name')
+        ProjectRegistry().add(project_name, project_spec)
+
+    def write_activation_scripts(self):
+        """
+        Write the precomputed activation scripts of the new project.
+
+        A failure is not fatal since the scripts are written on the first
+        activation otherwise.
+        """
+        try:
+            write_activation_scripts(self.proj_name)
+        except Exception as exception:
+            print("Warning: unable to write activation scripts ({})"
+                  .format(exception))
+
     def exit_on_exception(self):
-        """Cleanup if environment creation fails."""
-        shutil.rmtree(str(self.proj_folder.absolute()))
+        """
+        Cleanup if environment creation fails.
+
+        The project folder is only removed if the environment has not been
+        built (i.e. only clones were completed), otherwise it is kept so that
+        the creation can be resumed.
+        """
+        if any(not name.startswith('clone-') for name
+               in self.completed or []):
+            print("Completed steps are kept in {}. Resume the creation with "
+                  "`aiida-project create --resume {}`"
+                  .format(self.proj_folder, self.proj_name))
+        else:
+            shutil.rmtree(str(self.proj_folder.absolute()))
+            self.remove_checkpoint()
+        if self.log_folder.exists():
+            print("Logs of all phases are kept in {}".format(self.log_folder))
 
     def has_source(self):
         """Check for possible defined installations from source."""
@@ -226,42 +933,117 @@ class CreateEnvConda(CreateEnvBase):
         aiidateam/aiida-ase:master, ...)
     :raises Exception: if any package defines extras to be installed (i.e.
         package definition is of the form package[extra])
+    :param bool single_solve: If `True` the environment is created and all
+        packages are installed by a single `conda create` call (i.e. with a
+        single solve) instead of a `conda create` followed by `conda install`
+    :param str solver: Solver backend used for creating the environment and
+        installing packages (i.e. 'conda', 'libmamba', 'mamba',
+        'micromamba' or 'auto' to pick the fastest one available)
+    :param list channels: Channels searched for packages (defaults to the
+        channels of the site-wide configuration or to
+        `constants.DEFAULT_CONDA_CHANNELS`)
+    :param bool override_channels: If `True` channels defined in .condarc
+        are ignored (defaults to the site-wide configuration)
+    :param bool strict_channel_priority: If `True` packages are only taken
+        from the channel with the highest priority providing them (defaults
+        to the site-wide configuration)
+    :param str lock_file: Optional lock file written by `conda list
+        --explicit` (i.e. the lock file of another project). If given, the
+        locked packages are installed without running the solver and
+        `packages` are ignored (`aiida_version` may be `None` in which case
+        it is taken from the lock file)
+
     :raises Exception: if conda is not found on the system
     """
+    # conda's progress message marking the end of the solve
+    solve_done_regex = re.compile(r"^Solving environment.*done\s*$")
+
     def __init__(self, proj_name, proj_path, python_version, aiida_version,
-                 packages):
+                 packages, single_solve=False,
+                 solver=constants.CONDA_SOLVER_CONDA, channels=None,
+                 override_channels=None, strict_channel_priority=None,
+                 lock_file=None):
         # setup internal variables
+        self.manager = constants.MANAGER_NAME_CONDA
+        self.init_options = {
+            'proj_path': str(proj_path.absolute()),
+            'python_version': python_version,
+            'aiida_version': aiida_version,
+            'packages': list(packages),
+            'single_solve': single_solve,
+            'solver': solver,
+            'channels': list(channels) if channels else None,
+            'override_channels': override_channels,
+            'strict_channel_priority': strict_channel_priority,
+            'lock_file': str(lock_file) if lock_file else None,
+        }
         self.proj_name = proj_name
         self.proj_path = proj_path
         self.src_subfolder = constants.DEFAULT_SRC_SUBFOLDER
         self.env_subfolder = constants.DEFAULT_ENV_SUBFOLDER
         self.aiida_subfolder = constants.AIIDA_SUBFOLDER
 
+        # solver backend
+        if solver == constants.CONDA_SOLVER_AUTO:
+            solver = self.detect_solver()
+        if solver not in constants.SUPPORTED_CONDA_SOLVERS:
+            raise Exception("Unknown solver `{}` (available solvers: {})"
+                            .format(solver, constants.SUPPORTED_CONDA_SOLVERS))
+        self.solver = solver
+        self.init_options['solver'] = solver
+        conda_executable = constants.CONDA_SOLVER_EXECUTABLES.get(solver,
+                                                                  "conda")
+        solver_flags = []
+        if solver == constants.CONDA_SOLVER_LIBMAMBA:
+            solver_flags.append("--solver=libmamba")
+
         # environment
         prefix = self.env_folder / self.proj_name
-        self.env_executable = "conda"
+        self.env_executable = conda_executable
         self.env_commands = ["create"]
-        self.env_flags = [
-            "--yes",
+        self.env_flags = ["--yes"] + solver_flags + [
             "--prefix {}".format(str(prefix.absolute())),
         ]
         self.env_arguments = [
             "python={}".format(python_version),
         ]
+        # channels given explicitly take precedence over the site-wide
+        # configuration which takes precedence over the defaults
+        config = utils.load_config()
+        if not channels:
+            channels = config.get('conda_channels',
+                                  constants.DEFAULT_CONDA_CHANNELS)
+        if override_channels is None:
+            override_channels = config.get('conda_override_channels', False)
+        if strict_channel_priority is None:
+            strict_channel_priority = config.get(
+                'conda_strict_channel_priority', False)
+        self.channels = list(channels)
+        channel_flags = ["--channel {}".format(c) for c in self.channels]
+        if override_channels:
+            channel_flags.append("--override-channels")
+        if strict_channel_priority:
+            channel_flags.append("--strict-channel-priority")
+
         # additional packages
-        self.pkg_executable = "conda"
+        self.pkg_executable = conda_executable
         self.pkg_commands = ["install"]
-        self.pkg_flags = [
-            "--yes",
-            "--channel conda-forge",
-            "--channel bioconda",
-            "--channel matsci",
+        self.pkg_flags = ["--yes"] + solver_flags + channel_flags + [
             "--prefix {}".format(str(prefix.absolute())),
         ]
+        if lock_file is not None:
+            self.lock_file = pathlib.Path(lock_file).absolute()
+            self.check_python_version_from_lock(lock_file, python_version)
+            if aiida_version is None:
+                aiida_version = self.get_aiida_version_from_lock(lock_file)
         aiida_core_package = self.create_aiida_package_entry(aiida_version)
         packages_all = list([aiida_core_package] + packages)
         self.pkg_arguments = packages_all
 
+        self.single_solve = single_solve
+        # time spent solving / linking with the single solve (in seconds)
+        self.transaction_timings = {}
+
         # save some vars for crearing the projec spec later
         self._aiida_version = aiida_version
         self._python_version = python_version
@@ -278,15 +1060,32 @@ class CreateEnvConda(CreateEnvBase):
     def check_required_commands(self):
         """Check required commands are available on the system."""
         # no need to check for git in the conda installer since we do not
-        # allow source installes, we only check for conda
-        conda_avail = utils.check_command_avail('conda')
+        # allow source installes, we only check for conda (or the executable
+        # of the chosen solver backend)
+        conda_avail = utils.check_command_avail(self.env_executable)
         if not conda_avail:
-            raise Exception("Unable to find the `conda` executable on the "
-                            "system. Is anaconda on the PATH?")
+            raise Exception("Unable to find the `{0}` executable on the "
+                            "system. Is {0} on the PATH?"
+                            .format(self.env_executable))
+
+    def detect_solver(self):
+        """Detect the fastest solver backend available on the system."""
+        for solver in [constants.CONDA_SOLVER_MAMBA,
+                       constants.CONDA_SOLVER_MICROMAMBA]:
+            executable = constants.CONDA_SOLVER_EXECUTABLES[solver]
+            if utils.find_executable(executable) is not None:
+                return solver
+        # the version probe is cached, i.e. conda is only run once per
+        # installed conda version
+        conda_version = utils.get_command_version('conda')
+        if (conda_version is not None and conda_version[:2]
+                >= constants.CONDA_LIBMAMBA_DEFAULT_VERSION):
+            return constants.CONDA_SOLVER_LIBMAMBA
+        return constants.CONDA_SOLVER_CONDA
 
     def check_name_is_avail(self):
         """Check if chosen project name is available."""
-        if utils.project_name_exists(self.proj_name):
+        if ProjectRegistry().exists(self.proj_name):
             raise Exception("Project name `{}` already in use."
                             .format(self.proj_name))
 
@@ -311,6 +1110,140 @@ class CreateEnvConda(CreateEnvBase):
             raise Exception("Installation of extras only possible for "
                             "`virtualenv` manager")
 
+    def build_python_environment_with_packages(self):
+        """
+        Create the environment and install all packages in one transaction.
+
+        The python version and all package specs are passed to a single
+        `conda create`, i.e. conda only needs to load the repodata and to
+        solve the environment once. The time spent solving and linking is
+        reported afterwards.
+        """
+        cmd_args = {
+            'exe': self.env_executable,
+            'cmds': " ".join(self.env_commands),
+            'flags': " ".join(self.pkg_flags),
+            'args': " ".join(self.env_arguments + self.pkg_arguments),
+        }
+        cmd_create_env = self.cmd_env.format(**cmd_args)
+        print("Building new python environment ({}) including all packages "
+              "... ".format(self.proj_name))
+        start = time.time()
+        solve_done = []
+
+        def record_solve(line):
+            if self.solve_done_regex.match(line):
+                solve_done.append(time.time())
+
+        with self.spinner(), self.phase('environment', constants.PHASE_CPU):
+            result = utils.run_command(
+                cmd_create_env, env=None, shell=True,
+                line_callback=record_solve)
+        end = time.time()
+        if result.returncode:
+            raise Exception("Environment setup failed (STDERR: {})"
+                            .format(result.stderr))
+        self.transaction_timings = {'total': end - start}
+        if solve_done:
+            # conda may retry the solve, the last one is the successful one
+            self.transaction_timings.update({
+                'solve': solve_done[-1] - start,
+                'link': end - solve_done[-1],
+            })
+            print("Solving took {solve:.1f}s, linking took {link:.1f}s"
+                  .format(**self.transaction_timings))
+        else:
+            print("Environment created in {total:.1f}s"
+                  .format(**self.transaction_timings))
+
+    def install_packages_from_lock(self):
+        """
+        Create the environment from the explicit package list of the lock
+        file.
+
+        Explicit package lists contain the URLs of all packages, i.e. the
+        packages are downloaded and linked without loading the repodata and
+        without running the solver (dependencies are not checked at all).
+        """
+        cmd_args = {
+            'exe': self.env_executable,
+            'cmds': " ".join(self.env_commands),
+            'flags': " ".join(self.env_flags),
+            'args': "--file {}".format(self.lock_file),
+        }
+        cmd_create_env = self.cmd_env.format(**cmd_args)
+        print("Building new python environment ({}) from lock file {} ... "
+              .format(self.proj_name, self.lock_file))
+        with self.spinner(), self.phase('environment', constants.PHASE_CPU):
+            result = utils.run_command(cmd_create_env, env=None,
+                                       shell=True)
+        if result.returncode:
+            raise Exception("Environment setup failed (STDERR: {})"
+                            .format(result.stderr))
+
+    def get_lock_command(self):
+        """Return the command writing the explicit package list."""
+        prefix = self.env_folder / self.proj_name
+        # micromamba does not implement `list --explicit`
+        if self.solver == constants.CONDA_SOLVER_MICROMAMBA:
+            lock_commands = "env export --explicit --md5"
+        else:
+            lock_commands = "list --explicit --md5"
+        return "{} {} --prefix {}".format(self.env_executable, lock_commands,
+                                          str(prefix.absolute()))
+
+    def preflight_channels(self):
+        """
+        Check from which channels the requested packages are resolved.
+
+        Runs a dry-run solve of the full environment (nothing is downloaded
+        or installed) to find the channels that actually provide packages,
+        i.e. channels not providing any package can be dropped.
+
+        :returns: dictionary mapping every configured channel to the list of
+            packages it provides (packages taken from channels that are not
+            configured, i.e. from .condarc, are listed under their own
+            channel)
+        :rtype: dict
+        """
+        cmd_args = {
+            'exe': self.env_executable,
+            'cmds': " ".join(self.env_commands),
+            'flags': " ".join(["--dry-run", "--json"] + self.pkg_flags),
+            'args': " ".join(self.env_arguments + self.pkg_arguments),
+        }
+        cmd_dry_run = self.cmd_env.format(**cmd_args)
+        print("Resolving packages ({}) ... ".format(self.proj_name))
+        with self.spinner(), self.phase('preflight', constants.PHASE_CPU):
+            result = utils.run_command(cmd_dry_run, env=None, shell=True,
+                                       capture=True)
+        try:
+            solution = json.loads(result.stdout)
+        except ValueError:
+            solution = {}
+        if result.returncode or not solution.get('success', True):
+            message = solution.get('message', result.stderr)
+            raise Exception("Resolving packages failed (STDERR: {})"
+                            .format(message))
+        channel_usage = dict((channel, []) for channel in self.channels)
+        for package in solution.get('actions', {}).get('LINK', []):
+            channel = self.get_channel_name(package.get('channel', ''))
+            channel_usage.setdefault(channel, []).append(package['name'])
+        return channel_usage
+
+    def get_channel_name(self, channel):
+        """Map a channel as reported by conda to a configured channel."""
+        # depending on the backend channels are reported by name or by URL
+        # (i.e. https://conda.anaconda.org/conda-forge/linux-64)
+        parts = channel.rstrip('/').split('/')
+        for configured_channel in self.channels:
+            if configured_channel in (channel, parts[-1]) or (
+                    len(parts) > 1 and configured_channel == parts[-2]):
+                return configured_channel
+        if len(parts) > 1 and parts[0].endswith(':'):
+            return parts[-2]
+        return channel
+
     def create_spec_entry(self):
         args = [
             self.proj_name,
@@ -322,27 +1255,85 @@ class CreateEnvConda(CreateEnvBase):
             self.src_folder.absolute(),
         ]
         project_spec = self.get_project_spec(*args)
-        utils.save_project_spec(project_spec)
+        # the activator needs to know which executable activates the env
+        project_spec['solver'] = self.solver
+        project_spec['channels'] = list(self.channels)
+        self.register_project(project_spec)
 
     def create_aiida_project_environment(self):
         """Create the folder structure and initialize the environment."""
-        try:
-            self.create_folder_structure()
-            self.build_python_environment()
-            self.install_packages_from_index()
-        except Exception:
-            self.exit_on_exception()
-            raise
-        self.create_spec_entry()
+        self.start_checkpoints()
+        graph = self.get_task_graph()
+        folders = graph.add('create_folder_structure',
+                            self.create_folder_structure)
+        if self.lock_file is not None:
+            self.add_step(graph, self.install_packages_from_lock, [folders])
+        elif self.single_solve:
+            self.add_step(graph, self.build_python_environment_with_packages,
+                          [folders])
+        else:
+            environment = self.add_step(graph, self.build_python_environment,
+                                        [folders])
+            self.add_step(graph, self.install_packages_from_index,
+                          [environment])
+        with self.span('create'):
+            self.run_task_graph(graph)
+            self.run_traced(self.write_lock_file)
+            self.run_traced(self.create_spec_entry)
+            self.run_traced(self.write_activation_scripts)
+        self.remove_checkpoint()
 
 
 class CreateEnvVirtualenv(CreateEnvBase):
     """
     Create new python environment using the virtualenv package manager
+
+    :param int jobs: Maximum number of source repositories that are cloned
+        in parallel
+    :param str clone_mode: Clone mode used for all source packages (i.e.
+        'full', 'shallow' or 'blobless')
+    :param int clone_depth: Number of commits fetched for shallow clones
+    :param dict clone_modes: Optional dictionary mapping source packages
+        (<username>/<repository> or only <repository>) to the clone mode
+        used for this package instead of `clone_mode`
+    :param bool git_cache: If `True` source packages are cloned from local
+        mirrors shared by all projects (see `cache.GitMirrorCache`)
+    :param bool wheelhouse: If `True` wheels of index packages are collected
+        in a wheelhouse shared by all projects (see `cache.Wheelhouse`)
+    :param int wheelhouse_size: Maximum size (in bytes) of the wheelhouse
+    :param str source_install: How source packages are installed, i.e.
+        'editable' (from the cloned sources) or 'wheel' (from wheels built
+        once per commit and cached by `cache.SourceWheelCache`)
+    :param str lock_file: Optional lock file written by `pip freeze` (i.e.
+        the lock file of another project). If given, the locked packages are
+        installed with `--no-deps` and `packages` are ignored
+        (`aiida_version` may be `None` in which case it is taken from the
+        lock file)
     """
     def __init__(self, proj_name, proj_path, python_version, aiida_version,
-                 packages):
+                 packages, jobs=constants.DEFAULT_CLONE_JOBS,
+                 clone_mode=constants.CLONE_MODE_FULL,
+                 clone_depth=constants.DEFAULT_CLONE_DEPTH, clone_modes=None,
+                 git_cache=False, wheelhouse=False, wheelhouse_size=None,
+                 source_install=constants.SOURCE_INSTALL_EDITABLE,
+                 lock_file=None):
         # setup internal variables
+        self.manager = constants.MANAGER_NAME_VENV
+        self.init_options = {
+            'proj_path': str(proj_path.absolute()),
+            'python_version': python_version,
+            'aiida_version': aiida_version,
+            'packages': list(packages),
+            'jobs': jobs,
+            'clone_mode': clone_mode,
+            'clone_depth': clone_depth,
+            'clone_modes': dict(clone_modes or {}),
+            'git_cache': git_cache,
+            'wheelhouse': wheelhouse,
+            'wheelhouse_size': wheelhouse_size,
+            'source_install': source_install,
+            'lock_file': str(lock_file) if lock_file else None,
+        }
         self.proj_name = proj_name
         self.proj_path = proj_path
         self.src_subfolder = constants.DEFAULT_SRC_SUBFOLDER
@@ -364,6 +1355,22 @@ class CreateEnvVirtualenv(CreateEnvBase):
         self.pkg_commands = ["install"]
         self.pkg_flags = ["--pre"]
         self.pkg_flags_source = ["--editable"]
+        self.clone_jobs = jobs
+        self.clone_mode = clone_mode
+        self.clone_depth = clone_depth
+        self.clone_modes = dict(clone_modes or {})
+        if git_cache:
+            self.git_cache = GitMirrorCache()
+        if wheelhouse:
+            self.wheelhouse = Wheelhouse(max_size=wheelhouse_size)
+        self.source_install = source_install
+        if source_install == constants.SOURCE_INSTALL_WHEEL:
+            self.wheel_cache = SourceWheelCache()
+        if lock_file is not None:
+            self.lock_file = pathlib.Path(lock_file).absolute()
+            self.check_python_version_from_lock(lock_file, python_version)
+            if aiida_version is None:
+                aiida_version = self.get_aiida_version_from_lock(lock_file)
         aiida_core_package = self.create_aiida_package_entry(aiida_version)
         packages_all = list([aiida_core_package] + packages)
         self.pkg_arguments = packages_all
@@ -391,6 +1398,11 @@ class CreateEnvVirtualenv(CreateEnvBase):
                             "source. Either install git or switch to "
                             "non-source installation!")
 
+    def environment_exists(self):
+        """Check the virtual environment of the project exists."""
+        activate_script = self.env_folder / self.proj_name / 'bin' / 'activate'
+        return activate_script.exists()
+
     def create_aiida_package_entry(self, aiida_version):
         """Create the package entry for aiida-core installation."""
         # directly return if aiida-core is defined to be installed from source
@@ -407,6 +1419,85 @@ class CreateEnvVirtualenv(CreateEnvBase):
                 raise Exception("Defined AiiDA version '{}' is malformed!"
                                 .format(aiida_version))
 
+    def install_packages_from_lock(self, env=None):
+        """
+        Install the packages pinned in the lock file.
+
+        All packages are installed with `--no-deps`, i.e. pip does not run
+        its resolver at all. Editable packages defined in the lock file are
+        cloned to the project's source folder.
+
+        :param dict env: Optional dictionary containing environment variables
+            passed to the subprocess executing the install
+        """
+        pkg_flags = list(self.pkg_flags) + [
+            "--no-deps",
+            "--src {}".format(self.src_folder),
+        ]
+        pins = None
+        if self.wheelhouse is not None:
+            with open(str(self.lock_file), 'r') as f:
+                requirements = f.read().splitlines()
+            # editable packages are cloned from their repositories
+            if not any(r.strip().startswith('-e') for r in requirements):
+                pins = utils.get_pinned_packages(requirements)
+            pkg_flags += self.get_wheelhouse_flags(pins)
+        cmd_args = {
+            'exe': self.pkg_executable,
+            'cmds': " ".join(self.pkg_commands),
+            'flags': " ".join(pkg_flags),
+            'pkgs': "--requirement {}".format(self.lock_file),
+        }
+        cmd_install = self.cmd_install.format(**cmd_args)
+        print("Installing packages from lock file {} ...".format(
+            self.lock_file))
+        with self.spinner(), self.phase('install', constants.PHASE_CPU):
+            result = utils.run_command(cmd_install, env=env, shell=True,
+                                       line_callback=utils.record_download)
+        if result.returncode:
+            raise Exception("Installation of packages failed (STDERR: {})"
+                            .format(result.stderr))
+        if pins:
+            self.fill_wheelhouse(pins, env=env)
+
+    def get_lock_command(self):
+        """Return the command listing the installed packages."""
+        return "{} freeze".format(self.pkg_executable)
+
+    def format_lock_file(self, output):
+        """Add a header and hashes (if possible) to the pip freeze output."""
+        requirements = [line.strip() for line in output.splitlines()
+                        if line.strip()]
+        header = ["# aiida-project lock file (virtualenv, python {})"
+                  .format(self._python_version)]
+        return "\n".join(header + self.add_hashes(requirements)) + "\n"
+
+    def add_hashes(self, requirements):
+        """
+        Add the hashes of the wheels in the wheelhouse to the requirements.
+
+        Since pip requires hashes for either all or none of the requirements
+        the requirements are returned unchanged if a single wheel is missing
+        (or if a requirement is not pinned to a version, i.e. editable
+        packages).
+        """
+        if self.wheelhouse is None:
+            return requirements
+        hashed_requirements = []
+        for requirement in requirements:
+            if requirement.startswith('#'):
+                hashed_requirements.append(requirement)
+                continue
+            match = re.match(r"^([\w.\-]+)==([^\s;]+)$", requirement)
+            wheel = None
+            if match is not None:
+                wheel = self.wheelhouse.find_wheel(*match.groups())
+            if wheel is None:
+                return requirements
+            hashed_requirements.append("{} --hash=sha256:{}".format(
+                requirement, utils.get_file_hash(wheel)))
+        return hashed_requirements
+
     def create_spec_entry(self):
         aiida_pkg_def = self._aiida_version
         if utils.assert_package_is_source(aiida_pkg_def):
@@ -423,7 +1514,7 @@ class CreateEnvVirtualenv(CreateEnvBase):
             self.src_folder.absolute(),
         ]
         project_spec = self.get_project_spec(*args)
-        utils.save_project_spec(project_spec)
+        self.register_project(project_spec)
 
     def create_aiida_project_environment(self):
         """Create the folder structure and initialize the environment."""
@@ -435,15 +1526,63 @@ class CreateEnvVirtualenv(CreateEnvBase):
         old_path = current_env['PATH']
         new_path = str(venv_prefix / 'bin') + os.pathsep + old_path
         current_env['PATH'] = new_path
-        try:
-            self.create_folder_structure()
-            self.build_python_environment()
-            self.install_packages_from_index(env=current_env)
-            self.install_packages_from_source(env=current_env)
-        except Exception:
-            self.exit_on_exception()
-            raise
-        self.create_spec_entry()
+        self.start_checkpoints()
+        # source packages are cloned while the environment is built
+        graph = self.get_task_graph()
+        folders = graph.add('create_folder_structure',
+                            self.create_folder_structure)
+        environment = self.add_step(graph, self.build_python_environment,
+                                    [folders])
+        if self.lock_file is not None:
+            self.add_step(graph, self.install_packages_from_lock,
+                          [environment], env=current_env)
+        else:
+            self.add_install_steps(graph, folders, environment,
+                                   env=current_env)
+        with self.span('create'):
+            self.run_task_graph(graph)
+            self.run_traced(self.write_lock_file, env=current_env)
+            self.run_traced(self.create_spec_entry)
+            self.run_traced(self.write_activation_scripts)
+        self.remove_checkpoint()
+
+
+def get_checkpoint_file(proj_name):
+    """Return the location of the checkpoint of a project's creation."""
+    return (pathlib.Path.home() / constants.CONFIG_FOLDER
+            / constants.CHECKPOINTS_FOLDER / "{}.yaml".format(proj_name))
+
+
+def load_checkpoint(proj_name):
+    """
+    Load the checkpoint of a failed project creation.
+
+    :returns: dictionary containing the environment manager, the options
+        of the creator and the names of the completed steps
+    :rtype: dict
+    """
+    checkpoint_file = get_checkpoint_file(proj_name)
+    if not checkpoint_file.exists():
+        raise Exception("No unfinished creation of project `{}` found"
+                        .format(proj_name))
+    with open(str(checkpoint_file), 'r') as f:
+        return utils.yaml_safe_load(f)
+
+
+def resume_creator(proj_name):
+    """
+    Initialize the creator resuming a failed project creation.
+
+    :param str proj_name: name of the project
+    :returns: the creator (with the options of the failed creation)
+    """
+    checkpoint = load_checkpoint(proj_name)
+    EnvCreator = get_creator(checkpoint['manager'])
+    options = dict(checkpoint['options'])
+    options['proj_path'] = pathlib.Path(options['proj_path'])
+    creator = EnvCreator(proj_name=proj_name, **options)
+    creator.resume = True
+    return creator
 
 
 def get_creator(manager):
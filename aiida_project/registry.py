@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+
+
+from __future__ import print_function
+
+import os
+import sys
+import copy
+import time
+if sys.version_info >= (3, 0):
+    import pathlib as pathlib
+else:
+    import pathlib2 as pathlib
+
+from aiida_project import utils
+from aiida_project import constants
+
+
+"""
+Registry of all projects managed by aiida-project
+"""
+
+
+# parsed specification files and registry folder listings of the current
+# process (keyed by their path and invalidated by a changed stat_key)
+_spec_cache = {}
+_names_cache = {}
+
+
+def stat_key(path):
+    """
+    Return a key identifying the current version of a file (or folder).
+
+    Atomically replaced files get a new inode, i.e. the key changes even
+    if the replacement has the same size and modification time.
+    """
+    stat = os.stat(str(path))
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+def retry_on_error(function, retries=constants.REGISTRY_RETRIES,
+                   delay=constants.REGISTRY_RETRY_DELAY):
+    """
+    Call function and retry on transient I/O errors.
+
+    Missing files are not considered transient (i.e. they are raised
+    immediately), other errors (i.e. a file replaced while it is opened on
+    Windows) are retried with exponentially increasing delays.
+
+    :param function: callable without arguments
+    :param int retries: maximum number of retries
+    :param float delay: delay (in seconds) before the first retry
+    :returns: the return value of function
+    """
+    for attempt in range(retries + 1):
+        try:
+            return function()
+        except FileNotFoundError:
+            raise
+        except (IOError, OSError):
+            if attempt == retries:
+                raise
+            time.sleep(delay * 2**attempt)
+
+
+class ProjectRegistry(object):
+    """
+    Project specifications stored as one YAML file per project.
+
+    Every project is stored in its own file `<project_name>.yaml` inside the
+    registry folder, i.e. looking up, adding or removing a single project
+    only reads or writes that file regardless of the number of registered
+    projects. Projects found in the (legacy) single projects file are
+    migrated to the registry folder once, the first time the registry is
+    accessed.
+
+    All modifications are serialized by an inter-process lock and every
+    file is written to a unique temporary file first which then atomically
+    replaces the original, i.e. concurrent readers never see partially
+    written files and concurrent writers never lose registrations.
+
+    Parsed specification files are memoized per process (invalidated if
+    the file's inode, size or modification time changes), i.e. repeated
+    lookups of the same project do not read or parse the file again.
+
+    :param registry_folder: Folder containing the project specifications
+        (defaults to the projects folder inside the aiida-project
+        configuration folder)
+    :type registry_folder: pathlib.Path
+    """
+
+    spec_extension = 'yaml'
+
+    def __init__(self, registry_folder=None):
+        config_folder = pathlib.Path.home() / constants.CONFIG_FOLDER
+        if registry_folder is None:
+            registry_folder = config_folder / constants.PROJECTS_FOLDER
+        self.registry_folder = pathlib.Path(registry_folder).absolute()
+        self.legacy_file = config_folder / constants.PROJECTS_FILE
+        self.lock_file = config_folder / constants.REGISTRY_LOCK_FILE
+
+    def lock(self):
+        """Return the lock serializing modifications of the registry."""
+        return utils.FileLock(self.lock_file,
+                              timeout=constants.REGISTRY_LOCK_TIMEOUT)
+
+    @staticmethod
+    def write_atomic(path, project_spec):
+        """Write project_spec to path by atomically replacing the file."""
+        retry_on_error(lambda: utils.write_yaml_atomic(path, project_spec))
+        # the written spec is still valid as long as the file is unchanged
+        _spec_cache[str(path)] = (stat_key(path), copy.deepcopy(project_spec))
+
+    def get_spec_path(self, project_name):
+        """Return the location of the specification file of a project."""
+        if (not project_name or project_name.startswith('.')
+                or os.sep in project_name
+                or (os.altsep and os.altsep in project_name)):
+            raise Exception("Invalid project name '{}'".format(project_name))
+        return self.registry_folder / "{}.{}".format(project_name,
+                                                     self.spec_extension)
+
+    def migrate(self):
+        """
+        Migrate the projects of the legacy projects file to the registry.
+
+        The specifications are written to a temporary folder first which
+        is then renamed to the registry folder, i.e. the migration is either
+        completed or not started at all. The legacy file is kept (renamed
+        with a `.migrated` suffix) as a backup.
+
+        :returns: `True` if projects were migrated, `False` otherwise
+        """
+        if self.registry_folder.exists() or not self.legacy_file.exists():
+            return False
+        with self.lock():
+            # another process may have completed the migration meanwhile
+            if (self.registry_folder.exists()
+                    or not self.legacy_file.exists()):
+                return False
+            with open(str(self.legacy_file), 'r') as f:
+                project_specs = utils.yaml_safe_load(f) or {}
+            temporary_folder = self.registry_folder.with_name(
+                self.registry_folder.name + '.migrating')
+            temporary_folder.mkdir(parents=True, exist_ok=True)
+            for (project_name, project_spec) in project_specs.items():
+                spec_path = temporary_folder / self.get_spec_path(
+                    project_name).name
+                self.write_atomic(spec_path, project_spec)
+            os.rename(str(temporary_folder), str(self.registry_folder))
+            migrated_file = self.legacy_file.with_name(
+                self.legacy_file.name + '.migrated')
+            os.replace(str(self.legacy_file), str(migrated_file))
+        print("Migrated {} project(s) from {} to {}"
+              .format(len(project_specs), self.legacy_file,
+                      self.registry_folder), file=sys.stderr)
+        return True
+
+    def exists(self, project_name):
+        """Check if a project of the given name is registered."""
+        self.migrate()
+        return self.get_spec_path(project_name).is_file()
+
+    def load(self, project_name):
+        """
+        Load the specification of a single project.
+
+        :param str project_name: name of the project
+        :returns: the project specification
+        :rtype: dict
+        :raises KeyError: if the project is not registered
+        """
+        self.migrate()
+        spec_path = self.get_spec_path(project_name)
+        try:
+            key = retry_on_error(lambda: stat_key(spec_path))
+        except (IOError, OSError):
+            raise KeyError(project_name)
+        cached = _spec_cache.get(str(spec_path))
+        if cached is None or cached[0] != key:
+
+            def read_spec():
+                with open(str(spec_path), 'r') as f:
+                    return f.read()
+            try:
+                contents = retry_on_error(read_spec)
+            except (IOError, OSError):
+                raise KeyError(project_name)
+            # the key was taken before reading, i.e. a file replaced in
+            # between is simply parsed again by the next call
+            cached = (key, utils.yaml_safe_load(contents) or {})
+            _spec_cache[str(spec_path)] = cached
+        return copy.deepcopy(cached[1])
+
+    def save(self, project_name, project_spec):
+        """
+        Add (or replace) the specification of a single project.
+
+        :param str project_name: name of the project
+        :param dict project_spec: the project specification
+        """
+        self.migrate()
+        spec_path = self.get_spec_path(project_name)
+        with self.lock():
+            self.registry_folder.mkdir(parents=True, exist_ok=True)
+            self.write_atomic(spec_path, project_spec)
+
+    def add(self, project_name, project_spec):
+        """
+        Register a new project.
+
+        In contrast to `save` the check for an existing project and the
+        registration happen while holding the lock, i.e. of several
+        concurrent registrations using the same name only one succeeds.
+
+        :param str project_name: name of the project
+        :param dict project_spec: the project specification
+        :raises Exception: if the project name is already in use
+        """
+        self.migrate()
+        spec_path = self.get_spec_path(project_name)
+        with self.lock():
+            if spec_path.exists():
+                raise Exception("Project name `{}` already in use."
+                                .format(project_name))
+            self.registry_folder.mkdir(parents=True, exist_ok=True)
+            self.write_atomic(spec_path, project_spec)
+
+    def remove(self, project_name):
+        """Remove a project from the registry (if it is registered)."""
+        self.migrate()
+        spec_path = self.get_spec_path(project_name)
+        with self.lock():
+            if spec_path.exists():
+                retry_on_error(spec_path.unlink)
+            _spec_cache.pop(str(spec_path), None)
+
+    def list_names(self):
+        """Return the (sorted) names of all registered projects."""
+        self.migrate()
+        if not self.registry_folder.exists():
+            return []
+        key = stat_key(self.registry_folder)
+        cached = _names_cache.get(str(self.registry_folder))
+        if cached is None or cached[0] != key:
+            suffix = '.' + self.spec_extension
+            names = sorted(filename[:-len(suffix)] for filename
+                           in os.listdir(str(self.registry_folder))
+                           if filename.endswith(suffix)
+                           and not filename.startswith('.'))
+            cached = (key, names)
+            _names_cache[str(self.registry_folder)] = cached
+        return list(cached[1])
+
+    def load_all(self):
+        """Load the specifications of all registered projects."""
+        project_specs = {}
+        for project_name in self.list_names():
+            try:
+                project_specs[project_name] = self.load(project_name)
+            except KeyError:  # removed in the meantime
+                pass
+        return project_specs
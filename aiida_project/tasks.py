@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+
+from __future__ import print_function
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from aiida_project import trace
+
+
+"""
+Run the steps of a project creation as a graph of dependent tasks
+"""
+
+
+class Task(object):
+    """
+    A step of the creation depending on other steps.
+
+    :param str name: unique name of the task
+    :param function: callable without arguments running the step
+    :param list dependencies: names of the tasks which have to be completed
+        before this task is started
+    """
+
+    def __init__(self, name, function, dependencies=None):
+        self.name = name
+        self.function = function
+        self.dependencies = list(dependencies or [])
+        # span recording the task (if traced)
+        self.span = None
+
+
+class TaskGraph(object):
+    """
+    Run tasks concurrently as soon as all their dependencies are completed.
+
+    Tasks have to be added after their dependencies, i.e. the graph is
+    always acyclic. If a task fails, all tasks depending on it are skipped
+    while independent tasks are run to completion so that their results
+    are kept (see `CreateEnvBase.run_checkpointed`).
+
+    :param int max_workers: maximum number of tasks running at the same time
+    :param span: optional function returning a context manager recording
+        a task, called with the task's name and the keyword arguments
+        `category` and `dependencies` (the spans of the task's dependencies),
+        i.e. `CreateEnvBase.span`
+    """
+
+    def __init__(self, max_workers=2, span=None):
+        self.max_workers = max_workers
+        self.span = span
+        self.tasks = []
+        # results of all completed tasks (by task name)
+        self.results = {}
+
+    def add(self, name, function, dependencies=None):
+        """
+        Add a task to the graph.
+
+        :returns: the name of the task (to be used as dependency)
+        :rtype: str
+        """
+        names = [task.name for task in self.tasks]
+        if name in names:
+            raise Exception("Task `{}` is defined more than once"
+                            .format(name))
+        for dependency in dependencies or []:
+            if dependency not in names:
+                raise Exception("Unknown dependency `{}` of task `{}`"
+                                .format(dependency, name))
+        self.tasks.append(Task(name, function, dependencies))
+        return name
+
+    def get_task(self, name):
+        for task in self.tasks:
+            if task.name == name:
+                return task
+        raise KeyError(name)
+
+    def run_task(self, task, parent_span):
+        """Run a single task (in a worker thread)."""
+        # nest the spans of the workers below the calling step
+        with trace.Tracer.attach(parent_span):
+            if self.span is None:
+                return task.function()
+            dependency_spans = [self.get_task(name).span
+                                for name in task.dependencies]
+            with self.span(task.name, category='task',
+                           dependencies=[span for span in dependency_spans
+                                         if span is not None]) as span:
+                task.span = span
+                return task.function()
+
+    def run(self):
+        """
+        Run all tasks.
+
+        :returns: dictionary mapping the task names to the tasks' results
+        :rtype: dict
+        :raises Exception: if any task failed (the task's exception if only
+            a single task failed)
+        """
+        parent_span = trace.current_span()
+        pending = list(self.tasks)
+        running = {}
+        failed = set()
+        exceptions = []
+        pool = ThreadPoolExecutor(max_workers=max(1, self.max_workers))
+        try:
+            while pending or running:
+                for task in list(pending):
+                    if any(name in failed for name in task.dependencies):
+                        # skip the task (and all tasks depending on it)
+                        pending.remove(task)
+                        failed.add(task.name)
+                    elif all(name in self.results
+                             for name in task.dependencies):
+                        pending.remove(task)
+                        future = pool.submit(self.run_task, task,
+                                             parent_span)
+                        running[future] = task
+                if not running:
+                    break
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    task = running.pop(future)
+                    try:
+                        self.results[task.name] = future.result()
+                    except Exception as exception:
+                        failed.add(task.name)
+                        exceptions.append(exception)
+        finally:
+            pool.shutdown(wait=True)
+        if len(exceptions) == 1:
+            raise exceptions[0]
+        if exceptions:
+            raise Exception("\n".join(str(exception) for exception
+                                      in exceptions))
+        return self.results
@@ -0,0 +1,371 @@
+# -*- coding: utf-8 -*-
+
+
+from __future__ import print_function
+
+import sys
+import json
+import time
+import threading
+import contextlib
+if sys.version_info >= (3, 0):
+    import pathlib as pathlib
+else:
+    import pathlib2 as pathlib
+
+
+"""
+Timing instrumentation of the project creation
+"""
+
+
+# open spans of the current thread (innermost span last)
+_local = threading.local()
+
+
+def get_span_stack():
+    """Return the stack of spans opened by the current thread."""
+    if not hasattr(_local, 'spans'):
+        _local.spans = []
+    return _local.spans
+
+
+def current_span():
+    """Return the innermost span of the current thread (or `None`)."""
+    spans = get_span_stack()
+    return spans[-1] if spans else None
+
+
+def record_command(result):
+    """
+    Add the resources used by a command to the current span.
+
+    Called by `utils.run_command` for every command, commands run outside
+    of any span are not recorded.
+
+    :param result: the command's result
+    :type result: utils.CommandResult
+    """
+    span = current_span()
+    if span is not None:
+        span.add_usage(commands=1, cpu_seconds=result.cpu_seconds,
+                       max_rss=result.max_rss)
+
+
+def record_probe(command, kind, seconds):
+    """
+    Add the latency of a command probe to the current span.
+
+    Called by `utils.record_probe` for every lookup / version probe of an
+    executable, probes outside of any span are not recorded.
+
+    :param str command: name of the probed executable
+    :param str kind: kind of the probe ('path', 'version' or 'cached')
+    :param float seconds: time the probe took
+    """
+    span = current_span()
+    if span is not None:
+        span.add_probe(command, kind, seconds)
+
+
+def record_fetched(nbytes):
+    """
+    Add bytes fetched over the network to the current span.
+
+    Called by `utils.record_fetched` for every download a step can
+    attribute to itself (i.e. the objects fetched into a git mirror or the
+    downloads reported by pip), downloads outside of any span are not
+    recorded.
+
+    :param int nbytes: number of fetched bytes
+    """
+    span = current_span()
+    if span is not None:
+        span.add_usage(fetched_bytes=nbytes)
+
+
+def read_received_bytes():
+    """
+    Return the number of bytes received by all network interfaces.
+
+    The counters are host wide (i.e. they include the traffic of other
+    processes) and only available on Linux.
+
+    :returns: received bytes or `None` if the counters are not available
+    """
+    try:
+        with open('/proc/net/dev', 'r') as f:
+            lines = f.readlines()[2:]
+    except (IOError, OSError):
+        return None
+    received = 0
+    for line in lines:
+        interface, _, counters = line.partition(':')
+        if interface.strip() == 'lo' or not counters.split():
+            continue
+        received += int(counters.split()[0])
+    return received
+
+
+class Span(object):
+    """
+    A timed step of the creation.
+
+    Besides the wall time every span accumulates the resources of all
+    commands run within the span (or any of its child spans): CPU time
+    (user + system) of the commands, the peak resident set size of the
+    largest command and the bytes the step fetched over the network (see
+    `record_fetched`). Top level spans additionally record the bytes
+    received over the network by the whole host (see
+    `read_received_bytes`), these counters include the traffic of all
+    concurrently running steps (and of other processes).
+
+    :param int span_id: identifier of the span (unique per tracer)
+    :param str name: name of the step (i.e. 'environment')
+    :param str category: kind of the step (i.e. `constants.PHASE_CPU`)
+    :param str project: name of the project the step belongs to
+    :param parent: parent span (or `None` for top level spans)
+    :param list dependencies: spans which had to be completed before this
+        span was started (see `tasks.TaskGraph`)
+    """
+
+    def __init__(self, span_id, name, category, project=None, parent=None,
+                 dependencies=None):
+        self.span_id = span_id
+        self.name = name
+        self.category = category
+        self.project = project
+        self.parent = parent
+        self.dependencies = list(dependencies or [])
+        self.thread = threading.current_thread().name
+        self.start = None
+        self.end = None
+        self.commands = 0
+        self.cpu_seconds = 0.0
+        self.max_rss = 0
+        self.fetched_bytes = 0
+        # bytes received by the host while the span was open (top level
+        # spans only)
+        self.top_level_host_received_bytes = None
+        # command probes run within the span (not including child spans)
+        self.probes = []
+        self.error = None
+        self._received_start = None
+        self._lock = threading.Lock()
+
+    def add_usage(self, commands=0, cpu_seconds=None, max_rss=None,
+                  fetched_bytes=0):
+        """Add the resources used by commands to this span."""
+        with self._lock:
+            self.commands += commands
+            self.cpu_seconds += cpu_seconds or 0.0
+            self.max_rss = max(self.max_rss, max_rss or 0)
+            self.fetched_bytes += fetched_bytes
+
+    def add_probe(self, command, kind, seconds):
+        """Add a command probe run within this span."""
+        with self._lock:
+            self.probes.append({'command': command, 'kind': kind,
+                                'seconds': seconds})
+
+    def open(self):
+        self.start = time.time()
+        if self.parent is None:
+            self._received_start = read_received_bytes()
+
+    def close(self, error=None):
+        self.end = time.time()
+        self.error = error
+        if self._received_start is not None:
+            received = read_received_bytes()
+            if received is not None:
+                self.top_level_host_received_bytes = (
+                    received - self._received_start)
+        if self.parent is not None:
+            self.parent.add_usage(commands=self.commands,
+                                  cpu_seconds=self.cpu_seconds,
+                                  max_rss=self.max_rss,
+                                  fetched_bytes=self.fetched_bytes)
+
+    @property
+    def seconds(self):
+        if self.start is None or self.end is None:
+            return None
+        return self.end - self.start
+
+
+class Tracer(object):
+    """
+    Record the spans of one or several project creations.
+
+    The tracer may be shared by creators running in different threads (see
+    `aiida_project.batch`). Spans opened by the same thread are nested,
+    spans of worker threads are attached to a parent span explicitly (see
+    `attach`).
+    """
+
+    def __init__(self):
+        self.start = time.time()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, name, category='step', project=None, dependencies=None):
+        """
+        Record the step run within the context as a span.
+
+        :param str name: name of the step
+        :param str category: kind of the step
+        :param str project: name of the project (defaults to the project of
+            the parent span)
+        :param list dependencies: spans the step depends on
+        """
+        parent = current_span()
+        if project is None and parent is not None:
+            project = parent.project
+        with self._lock:
+            span = Span(len(self.spans), name, category, project=project,
+                        parent=parent, dependencies=dependencies)
+            self.spans.append(span)
+        spans = get_span_stack()
+        spans.append(span)
+        span.open()
+        try:
+            yield span
+        except BaseException as exception:
+            span.close(error=str(exception) or type(exception).__name__)
+            raise
+        else:
+            span.close()
+        finally:
+            spans.pop()
+
+    @staticmethod
+    @contextlib.contextmanager
+    def attach(span):
+        """
+        Nest the spans of the current (worker) thread below span.
+
+        :param span: the parent span (i.e. `current_span()` of the thread
+            submitting the work) or `None`
+        """
+        if span is None:
+            yield
+            return
+        spans = get_span_stack()
+        spans.append(span)
+        try:
+            yield
+        finally:
+            spans.pop()
+
+    def to_dict(self):
+        """
+        Return all recorded spans as a JSON serializable dictionary.
+
+        Start times are relative to the creation of the tracer.
+        """
+        spans = []
+        for span in self.spans:
+            spans.append({
+                'id': span.span_id,
+                'parent': (span.parent.span_id if span.parent is not None
+                           else None),
+                'dependencies': [dependency.span_id for dependency
+                                 in span.dependencies],
+                'name': span.name,
+                'category': span.category,
+                'project': span.project,
+                'thread': span.thread,
+                'start': span.start - self.start,
+                'wall_seconds': span.seconds,
+                'cpu_seconds': span.cpu_seconds,
+                'max_rss_bytes': span.max_rss,
+                'fetched_bytes': span.fetched_bytes,
+                'top_level_host_received_bytes':
+                    span.top_level_host_received_bytes,
+                'commands': span.commands,
+                'probes': list(span.probes),
+                'error': span.error,
+            })
+        return {'start': self.start, 'spans': spans}
+
+    def to_chrome_trace(self):
+        """
+        Return all recorded spans as Chrome trace events.
+
+        The result can be loaded in chrome://tracing or ui.perfetto.dev.
+        Every project is shown as a process and every thread as a thread
+        of it. Dependencies between spans are shown as flow arrows from the
+        end of the dependency to the start of the dependent span.
+        """
+        projects = []
+        threads = []
+        events = []
+        for span in self.spans:
+            if span.end is None:
+                continue
+            if span.project not in projects:
+                projects.append(span.project)
+            if span.thread not in threads:
+                threads.append(span.thread)
+            args = {
+                'cpu_seconds': round(span.cpu_seconds, 6),
+                'max_rss_bytes': span.max_rss,
+                'fetched_bytes': span.fetched_bytes,
+                'top_level_host_received_bytes':
+                    span.top_level_host_received_bytes,
+                'commands': span.commands,
+            }
+            if span.error is not None:
+                args['error'] = span.error
+            events.append({
+                'name': span.name,
+                'cat': span.category,
+                'ph': 'X',
+                'ts': int((span.start - self.start) * 1e6),
+                'dur': int((span.end - span.start) * 1e6),
+                'pid': projects.index(span.project) + 1,
+                'tid': threads.index(span.thread) + 1,
+                'args': args,
+            })
+        for span in self.spans:
+            for dependency in span.dependencies:
+                if span.end is None or dependency.end is None:
+                    continue
+                flow = {'name': 'dependency', 'cat': 'dependency',
+                        'id': "{}-{}".format(dependency.span_id,
+                                             span.span_id)}
+                events.append(dict(
+                    flow, ph='s', ts=int((dependency.end - self.start) * 1e6),
+                    pid=projects.index(dependency.project) + 1,
+                    tid=threads.index(dependency.thread) + 1))
+                events.append(dict(
+                    flow, ph='f', bp='e',
+                    ts=int((span.start - self.start) * 1e6),
+                    pid=projects.index(span.project) + 1,
+                    tid=threads.index(span.thread) + 1))
+        for (index, project) in enumerate(projects):
+            events.append({'name': 'process_name', 'ph': 'M',
+                           'pid': index + 1,
+                           'args': {'name': project or 'aiida-project'}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write(self, trace_file):
+        """
+        Write the trace as JSON and as Chrome trace events.
+
+        The Chrome trace is written next to trace_file with the suffix
+        `.chrome.json` (i.e. out.json and out.chrome.json).
+
+        :param trace_file: path of the JSON trace
+        :returns: paths of the JSON and the Chrome trace
+        :rtype: tuple
+        """
+        trace_file = pathlib.Path(trace_file)
+        chrome_file = trace_file.with_name(trace_file.stem + '.chrome.json')
+        with open(str(trace_file), 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+        with open(str(chrome_file), 'w') as f:
+            json.dump(self.to_chrome_trace(), f)
+        return (trace_file, chrome_file)
@@ -2,41 +2,157 @@
 
 from __future__ import print_function
 
+import os
 import re
 import sys
-import subprocess
+import time
+import threading
+import contextlib
 if sys.version_info >= (3, 0):
     import pathlib as pathlib
 else:
     import pathlib2 as pathlib
 
-import click_spinner
-import yaml
 
 from aiida_project import constants
 
+# NOTE: heavier modules (subprocess, yaml, click_spinner, ...) are imported
+# by the functions using them since this module is imported by the
+# activate / deactivate commands which are run in the shell's critical path
 
-def clone_git_repo_to_disk(github_url, location, branch=None):
+
+def clone_git_repo_to_disk(github_url, location, branch=None, spinner=True,
+                           mode=constants.CLONE_MODE_FULL,
+                           depth=constants.DEFAULT_CLONE_DEPTH):
     """
     Clone the git repository at github_url to location on disk.
 
     :param str github_url: URL to github repository
     :param str branch: Specific branch of the github repository
     :param str location: path to the location disk
+    :param bool spinner: If `False` no spinner is shown while cloning (i.e.
+        when multiple repositories are cloned at the same time)
+    :param str mode: Clone mode, i.e. one of `constants.SUPPORTED_CLONE_MODES`
+    :param int depth: Number of commits fetched for shallow clones
     """
+    if mode not in constants.SUPPORTED_CLONE_MODES:
+        raise Exception("Unknown clone mode `{}` (available modes: {})"
+                        .format(mode, constants.SUPPORTED_CLONE_MODES))
     git_clone_args = ["git", "clone", "--single-branch"]
+    if mode == constants.CLONE_MODE_SHALLOW:
+        git_clone_args.append("--depth {}".format(depth))
+    elif mode == constants.CLONE_MODE_BLOBLESS:
+        git_clone_args.append("--filter=blob:none")
     if branch:
         git_clone_args.append("--branch {}".format(branch))
     git_clone_args.append("{}".format(github_url))
     git_clone_args.append("{}".format(location))
     git_clone_command = " ".join(git_clone_args)
     print("Cloning repository {} ...".format(github_url))
-    with click_spinner.spinner():
-        errcode, stdout, stderr = run_command(git_clone_command, shell=True)
-    if errcode:
+    import click_spinner
+    with click_spinner.spinner(disable=not spinner):
+        result = run_command(git_clone_command, shell=True)
+    if result.returncode:
         raise Exception("Cloning the repository from GitHub failed. Used "
                         "command {}, STDERR={}"
-                        .format(git_clone_command, stderr))
+                        .format(git_clone_command, result.stderr))
+
+
+def unshallow_git_repo(location):
+    """
+    Fetch the full history of a shallow or blobless clone.
+
+    :param str location: path to the cloned repository on disk
+    :returns: `True` if history was fetched, `False` if the repository
+        already is a full clone
+    :rtype: bool
+    """
+    git_folder = pathlib.Path(location) / ".git"
+    git_commands = []
+    if (git_folder / "shallow").exists():
+        git_commands.append("git -C {} fetch --unshallow".format(location))
+    result = run_command(
+        "git -C {} config --get remote.origin.partialclonefilter"
+        .format(location), shell=True)
+    if not result.returncode and result.stdout.strip():
+        # drop the filter first, otherwise the refetch would apply it again
+        git_commands += [
+            ("git -C {} config --unset remote.origin.partialclonefilter"
+             .format(location)),
+            "git -C {} fetch --refetch origin".format(location),
+            "git -C {} config remote.origin.promisor false".format(location),
+        ]
+    for git_command in git_commands:
+        result = run_command(git_command, shell=True)
+        if result.returncode:
+            raise Exception("Fetching the full history of {} failed. Used "
+                            "command {}, STDERR={}"
+                            .format(location, git_command, result.stderr))
+    return bool(git_commands)
+
+
+def is_commit_sha(ref):
+    """Check if a git reference is a full commit SHA."""
+    return ref is not None and re.match(r"^[0-9a-f]{40}$", ref) is not None
+
+
+def resolve_git_commit(url, ref=None):
+    """
+    Resolve a branch or tag of a remote repository to its commit SHA.
+
+    The remote is only queried for its references, nothing is cloned.
+
+    :param str url: URL of the repository
+    :param str ref: branch or tag name (defaults to the remote HEAD)
+    :returns: the commit SHA the reference points to
+    :rtype: str
+    """
+    if is_commit_sha(ref):
+        return ref
+    git_command = "git ls-remote {} {}".format(url, ref or "HEAD")
+    result = run_command(git_command, shell=True, capture=True)
+    if result.returncode:
+        raise Exception("Unable to query references of {}. Used command {}, "
+                        "STDERR={}".format(url, git_command, result.stderr))
+    refs = {}
+    for line in result.stdout.splitlines():
+        if line.strip():
+            sha, name = line.split()
+            refs[name] = sha
+    # prefer branches over (peeled) tags with the same name
+    candidates = ["refs/heads/{}", "refs/tags/{}^{{}}", "refs/tags/{}", "{}"]
+    for candidate in candidates:
+        name = candidate.format(ref or "HEAD")
+        if name in refs:
+            return refs[name]
+    raise Exception("Reference `{}` not found in repository {}"
+                    .format(ref, url))
+
+
+def get_git_head(location):
+    """Return the commit SHA checked out at location."""
+    git_command = "git -C {} rev-parse HEAD".format(location)
+    result = run_command(git_command, shell=True)
+    if result.returncode:
+        raise Exception("Unable to determine the checked out commit of {} "
+                        "(STDERR={})".format(location, result.stderr))
+    return result.stdout.strip()
+
+
+def checkout_git_commit(location, commit):
+    """
+    Fetch and checkout a specific commit in the repository at location.
+
+    :param str location: path to the cloned repository on disk
+    :param str commit: full SHA of the commit to check out
+    """
+    git_command = ("git -C {loc} fetch --quiet origin {sha} && "
+                   "git -C {loc} checkout --quiet {sha}"
+                   .format(loc=location, sha=commit))
+    result = run_command(git_command, shell=True)
+    if result.returncode:
+        raise Exception("Checking out commit {} failed. Used command {}, "
+                        "STDERR={}".format(commit, git_command, result.stderr))
 
 
 def build_source_url(username, repository):
@@ -50,12 +166,189 @@ def build_source_url(username, repository):
     return base_url.format(username=username, repository=repository)
 
 
-def run_command(command, shell=True, env=None):
-    """Run a command through python subprocess."""
+class CommandResult(object):
+    """
+    Result of a command run by `run_command`.
+
+    Unless the complete output was requested only the last lines of stdout
+    and stderr are kept. For compatibility the result unpacks to the tuple
+    (returncode, stdout, stderr).
+
+    :param str command: the command
+    :param int returncode: exit code of the command
+    :param str stdout: (tail of the) output written to stdout
+    :param str stderr: (tail of the) output written to stderr
+    :param float seconds: wall time (in seconds) of the command
+    :param log_file: log file the complete output was written to (if any)
+    :type log_file: pathlib.Path
+    :param float cpu_seconds: CPU time (user + system) of the command and
+        all its children (`None` if not available)
+    :param int max_rss: peak resident set size (in bytes) of the command or
+        its largest child (`None` if not available)
+    """
+
+    def __init__(self, command, returncode, stdout, stderr, seconds,
+                 log_file=None, cpu_seconds=None, max_rss=None):
+        self.command = command
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.seconds = seconds
+        self.log_file = log_file
+        self.cpu_seconds = cpu_seconds
+        self.max_rss = max_rss
+
+    def __iter__(self):
+        return iter((self.returncode, self.stdout, self.stderr))
+
+
+# log file and verbosity used by run_command if not given explicitly (set
+# per thread by `command_log`, created at import time since threads may run
+# commands concurrently; threading is imported by click anyway)
+_command_log = threading.local()
+
+
+def get_command_log():
+    """Return the thread's settings of `command_log` (log_file, verbose)."""
+    return (getattr(_command_log, 'log_file', None),
+            getattr(_command_log, 'verbose', False))
+
+
+@contextlib.contextmanager
+def command_log(log_file=None, verbose=False):
+    """
+    Set the log file and verbosity of all commands run by the current thread.
+
+    Used for functions which run commands but do not know the project or
+    the phase they are run for.
+
+    :param log_file: file the output of every command is appended to
+    :type log_file: pathlib.Path
+    :param bool verbose: If `True` the output is also passed through to
+        stdout / stderr while the command is running
+    """
+    previous = get_command_log()
+    _command_log.log_file, _command_log.verbose = log_file, verbose
+    try:
+        yield
+    finally:
+        _command_log.log_file, _command_log.verbose = previous
+
+
+def run_command(command, shell=True, env=None, line_callback=None,
+                capture=False, log_file=None, verbose=None):
+    """
+    Run a command through python subprocess.
+
+    The output is streamed line by line, i.e. it is written to the log file
+    (and passed through if verbose) while the command is running, and only
+    the last `constants.COMMAND_TAIL_LINES` lines of stdout and stderr are
+    kept in memory unless capture is set.
+
+    :param line_callback: Optional function which is called with every line
+        of the command's stdout as soon as the line has been written
+    :param bool capture: If `True` the complete stdout and stderr are kept
+        (i.e. for commands whose output is parsed)
+    :param log_file: Optional file the output is appended to (defaults to
+        the log file set by `command_log`)
+    :type log_file: pathlib.Path
+    :param bool verbose: If `True` the output is passed through to stdout /
+        stderr (defaults to the verbosity set by `command_log`)
+    :returns: the command's result
+    :rtype: CommandResult
+    """
+    import subprocess
+    from collections import deque
+    default_log_file, default_verbose = get_command_log()
+    if log_file is None:
+        log_file = default_log_file
+    if verbose is None:
+        verbose = default_verbose
+    log = None
+    if log_file is not None:
+        log_file = pathlib.Path(log_file)
+        if not log_file.parent.exists():
+            log_file.parent.mkdir(parents=True, exist_ok=True)
+        log = open(str(log_file), 'a')
+        log.write("$ {}\n".format(command))
+        log.flush()
+    log_lock = threading.Lock()
+    maxlen = None if capture else constants.COMMAND_TAIL_LINES
+    start = time.time()
     proc = subprocess.Popen(command, stdout=subprocess.PIPE,
                             stderr=subprocess.PIPE, shell=shell, env=env)
-    stdout, stderr = proc.communicate()
-    return (proc.returncode, stdout.decode(), stderr.decode())
+
+    def consume(stream, lines, passthrough, callback=None):
+        for raw_line in iter(stream.readline, b''):
+            line = raw_line.decode(errors='replace')
+            lines.append(line)
+            if log is not None:
+                with log_lock:
+                    log.write(line)
+            if verbose:
+                passthrough.write(line)
+                passthrough.flush()
+            if callback is not None:
+                callback(line)
+
+    stdout_lines = deque(maxlen=maxlen)
+    stderr_lines = deque(maxlen=maxlen)
+    # read stderr in the background to avoid blocking the command when the
+    # pipe's buffer runs full while we are reading stdout line by line
+    stderr_reader = threading.Thread(target=consume, args=(
+        proc.stderr, stderr_lines, sys.stderr))
+    stderr_reader.start()
+    try:
+        consume(proc.stdout, stdout_lines, sys.stdout, line_callback)
+    finally:
+        stderr_reader.join()
+        rusage = wait_for_process(proc)
+        seconds = time.time() - start
+        if log is not None:
+            log.write("# exit code {} after {:.1f}s\n".format(
+                proc.returncode, seconds))
+            log.close()
+    result = CommandResult(command, proc.returncode, "".join(stdout_lines),
+                           "".join(stderr_lines), seconds, log_file=log_file)
+    if rusage is not None:
+        result.cpu_seconds = rusage.ru_utime + rusage.ru_stime
+        # ru_maxrss is given in kilobytes on Linux but in bytes on macOS
+        scale = 1 if sys.platform == 'darwin' else 1024
+        result.max_rss = rusage.ru_maxrss * scale
+    # (see `record_probe`)
+    trace = sys.modules.get('aiida_project.trace')
+    if trace is not None:
+        trace.record_command(result)
+    return result
+
+
+def wait_for_process(proc):
+    """
+    Wait for a process and return its resource usage.
+
+    The resource usage includes all children the process has waited for
+    (i.e. the commands run by the shell).
+
+    :param proc: the process
+    :type proc: subprocess.Popen
+    :returns: the resource usage (see `resource.getrusage`) or `None` if it
+        is not available (i.e. on Windows)
+    """
+    pid = getattr(proc, 'pid', None)
+    if pid is None or not hasattr(os, 'wait4') or proc.returncode is not None:
+        proc.wait()
+        return None
+    try:
+        _, status, rusage = os.wait4(pid, 0)
+    except OSError:
+        # already reaped, i.e. by someone else calling wait()
+        proc.wait()
+        return None
+    if os.WIFSIGNALED(status):
+        proc.returncode = -os.WTERMSIG(status)
+    else:
+        proc.returncode = os.WEXITSTATUS(status)
+    return rusage
 
 
 def assert_valid_aiida_version(aiida_version_string):
@@ -131,56 +424,502 @@ def unpack_raw_package_input(package):
         return (package, '')
 
 
-def check_command_avail(command, test_version=True):
+def get_package_name(package):
+    """
+    Extract the bare package name from an index package definition.
+
+    :param str package: package definition of the form
+        name[extras]==version (or any other version specifier)
+    """
+    return re.split(r"[\[=<>!~;@\s]", package.strip())[0]
+
+
+def normalize_package_name(name):
+    """Normalize a package name (i.e. Aiida_Core -> aiida-core)."""
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def get_file_hash(path, algorithm='sha256'):
+    """Calculate the hexdigest of the file located at path."""
+    import hashlib
+    digest = hashlib.new(algorithm)
+    with open(str(path), 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_locked_version(lock_file, package_name):
+    """
+    Get the version of a package pinned in a lock file.
+
+    :param lock_file: path to a lock file written by `pip freeze` (i.e.
+        lines of the form name==version) or by `conda list --explicit` (i.e.
+        lines of the form https://.../name-version-build.tar.bz2)
+    :param str package_name: name of the package
+    :returns: the pinned version or `None` if the package is not found
+    """
+    package_name = normalize_package_name(package_name)
+    explicit_regex = re.compile(r"/([^/]+)-([^-/]+)-[^-/]+\.(?:tar\.bz2|conda)"
+                                r"(?:#\w+)?$")
+    with open(str(lock_file), 'r') as f:
+        for line in f:
+            line = line.strip()
+            match = re.match(r"^([\w.\-]+)==([^\s;]+)", line)
+            if match is None:
+                match = explicit_regex.search(line)
+            if (match and normalize_package_name(match.group(1))
+                    == package_name):
+                return match.group(2)
+    return None
+
+
+def get_locked_python_version(lock_file):
+    """
+    Get the python version a lock file was created for.
+
+    :param lock_file: path to a lock file written by aiida-project (i.e.
+        with the header written for virtualenv projects) or by `conda list
+        --explicit`
+    :returns: the python version or `None` if it is not recorded
+    """
+    with open(str(lock_file), 'r') as f:
+        header = f.readline()
+    match = re.match(r"^# aiida-project lock file \(\w+, python ([^)\s]+)\)",
+                     header)
+    if match is not None:
+        return match.group(1)
+    return get_locked_version(lock_file, 'python')
+
+
+def python_versions_match(version_a, version_b):
+    """
+    Check two python versions agree in all components given by both.
+
+    I.e. 3.8 matches 3.8.13 but 3.1 does not match 3.10.
+    """
+    components_a = str(version_a).split('.')
+    components_b = str(version_b).split('.')
+    length = min(len(components_a), len(components_b))
+    return components_a[:length] == components_b[:length]
+
+
+def get_pinned_packages(requirements):
+    """
+    Get the packages pinned to an exact version in a list of requirements.
+
+    :param list requirements: lines of the form name==version (e.g. written
+        by `pip freeze`), all other lines (editable packages, comments, ...)
+        are skipped
+    :returns: list of the pins of the form name==version
+    :rtype: list
+    """
+    pins = []
+    for line in requirements:
+        match = re.match(r"^([\w.\-]+)==([^\s;]+)", line.strip())
+        if match is not None:
+            pins.append("{}=={}".format(*match.groups()))
+    return pins
+
+
+def find_packages_in_output(output, identifiers):
+    """
+    Find packages that are mentioned in the output of a failed command.
+
+    :param str output: output of the failed command
+    :param dict identifiers: dictionary mapping package definitions to a
+        list of strings identifying the package in the output (i.e. the
+        package name or the path of a source package)
+    :returns: list of package definitions that are mentioned in the output
+    :rtype: list
+    """
+    found = []
+    for (package, names) in identifiers.items():
+        for name in names:
+            # package names are compared case-insensitive and treat
+            # -, _ and . as equivalent (as pip does)
+            pattern = r"[-_.]".join(re.escape(part) for part in
+                                    re.split(r"[-_.]", name))
+            regex = r"(?<![\w\-./]){}(?![\w\-/])".format(pattern)
+            if re.search(regex, output, flags=re.IGNORECASE):
+                found.append(package)
+                break
+    return found
+
+
+def parse_size(size):
+    """
+    Convert a human readable size to bytes.
+
+    :param str size: size of the form N, NK, NM, NG or NT (where N may be a
+        floating point number, i.e. 1.5G)
+    :rtype: int
+    """
+    units = {'': 1, 'K': 1024, 'M': 1024**2, 'G': 1024**3, 'T': 1024**4}
+    match = re.match(r"^\s*([0-9]*\.?[0-9]+)\s*([KMGT]?)i?B?\s*$",
+                     str(size), flags=re.IGNORECASE)
+    if match is None:
+        raise Exception("Malformed size '{}' (expected i.e. 500M or 2G)"
+                        .format(size))
+    number, unit = match.groups()
+    return int(float(number) * units[unit.upper()])
+
+
+def record_probe(command, kind, start):
+    """
+    Record the latency of a command probe started at time start.
+
+    The probe is added to the current span of the creation's trace (see
+    `trace.record_probe`). Without a tracer the trace module is never
+    imported, i.e. it is not imported here either (activation imports as
+    little as possible).
+
+    :param str command: name of the probed executable
+    :param str kind: kind of the probe ('path', 'version' or 'cached')
+    :returns: the time the probe took in seconds
+    """
+    seconds = time.time() - start
+    trace = sys.modules.get('aiida_project.trace')
+    if trace is not None:
+        trace.record_probe(command, kind, seconds)
+    return seconds
+
+
+def record_fetched(nbytes):
+    """
+    Record bytes fetched over the network by the running step.
+
+    The bytes are added to the current span of the creation's trace (see
+    `trace.record_fetched`), like `record_probe` without importing the
+    trace module.
+
+    :param int nbytes: number of fetched bytes
+    """
+    trace = sys.modules.get('aiida_project.trace')
+    if trace is not None and nbytes > 0:
+        trace.record_fetched(nbytes)
+
+
+def get_download_size(line):
+    """
+    Get the size of a download reported by pip.
+
+    :param str line: line of pip's output, i.e.
+        `Downloading six-1.16.0-py2.py3-none-any.whl (11 kB)`
+    :returns: size in bytes or `None` if the line reports no download
+    """
+    match = re.match(r"^\s*Downloading \S+ \(([\d.]+) (bytes|kB|MB|GB)\)",
+                     line)
+    if match is None:
+        return None
+    units = {'bytes': 1, 'kB': 1000, 'MB': 1000 ** 2, 'GB': 1000 ** 3}
+    return int(float(match.group(1)) * units[match.group(2)])
+
+
+def record_download(line):
+    """
+    Record the download reported in a line of pip's output (if any).
+
+    Passed as `line_callback` to `run_command` for pip commands.
+    """
+    size = get_download_size(line)
+    if size is not None:
+        record_fetched(size)
+
+
+def find_executable(command):
+    """
+    Find an executable on the PATH without starting a subprocess.
+
+    :param str command: name of the executable (i.e. 'conda')
+    :returns: absolute path to the executable or `None` if it is not found
+    """
+    start = time.time()
+    found = None
+    if os.path.dirname(command):
+        candidates = [command]
+    else:
+        candidates = [os.path.join(folder, command) for folder in
+                      os.environ.get('PATH', '').split(os.pathsep) if folder]
+    for candidate in candidates:
+        if os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+            found = os.path.abspath(candidate)
+            break
+    record_probe(command, 'path', start)
+    return found
+
+
+def load_command_cache():
+    """Load the cached command probes from the command cache file."""
+    import json
+    cache_file = (pathlib.Path.home() / constants.CONFIG_FOLDER
+                  / constants.COMMAND_CACHE_FILE)
+    try:
+        with open(str(cache_file), 'r') as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def save_command_cache(command_cache):
+    """Write the cached command probes to the command cache file."""
+    import json
+    config_folder = pathlib.Path.home() / constants.CONFIG_FOLDER
+    if not config_folder.exists():
+        config_folder.mkdir(parents=True)
+    cache_file = config_folder / constants.COMMAND_CACHE_FILE
+    temporary_file = cache_file.with_name(cache_file.name + '.tmp')
+    with open(str(temporary_file), 'w') as f:
+        json.dump(command_cache, f, indent=2, sort_keys=True)
+    os.replace(str(temporary_file), str(cache_file))
+
+
+def probe_command(command):
+    """
+    Run `command --version` and cache the result on disk.
+
+    Results are cached by the resolved path of the executable and its
+    modification time, i.e. the probe is only run again if the executable
+    has been replaced (i.e. updated). The latency of every probe is traced
+    (see `record_probe`) and reported if the probe actually had to be run.
+
+    :param str command: name of the executable (i.e. 'conda')
+    :returns: dictionary containing the `returncode` and the `output` of the
+        probe or `None` if the executable is not found on the PATH
+    """
+    executable = find_executable(command)
+    if executable is None:
+        return None
+    start = time.time()
+    resolved = os.path.realpath(executable)
+    mtime = os.stat(resolved).st_mtime
+    command_cache = load_command_cache()
+    probe = command_cache.get(resolved)
+    if probe is not None and probe.get('mtime') == mtime:
+        record_probe(command, 'cached', start)
+        return probe
+    result = run_command("{} --version".format(executable), shell=True)
+    seconds = record_probe(command, 'version', start)
+    print("Probed `{} --version` in {:.2f}s".format(command, seconds),
+          file=sys.stderr)
+    probe = {
+        'mtime': mtime,
+        'returncode': result.returncode,
+        'output': result.stdout + result.stderr,
+        'probe_time': seconds,
+    }
+    command_cache[resolved] = probe
+    try:
+        save_command_cache(command_cache)
+    except (IOError, OSError):
+        pass
+    return probe
+
+
+def get_command_version(command):
+    """
+    Get the version of a command from its (cached) `command --version`.
+
+    :param str command: Command to test
+    :returns: tuple of integers (i.e. (23, 11, 0)) or `None` if the command
+        is not available or does not print a version
+    """
+    probe = probe_command(command)
+    if probe is None or probe['returncode']:
+        return None
+    match = re.search(r"(\d+(?:\.\d+)+)", probe['output'])
+    if match is None:
+        return None
+    return tuple(int(number) for number in match.group(1).split('.'))
+
+
+def get_aiida_project_version():
+    """Return the installed version of aiida-project (or 'unknown')."""
+    try:
+        from importlib.metadata import version
+        return version('aiida-project')
+    except Exception:
+        return 'unknown'
+
+
+def check_command_avail(command, test_version=False):
     """
     Test if a command is available in the current shell environment.
 
     :param str command: Command to test
-    :param bool test_version: If `True` command --version will be checked
-        instead of the plain command
+    :param bool test_version: If `True` the command is only considered to be
+        available if `command --version` succeeds (the result of this probe
+        is cached, see `probe_command()`), otherwise the command only needs
+        to be found on the PATH
     """
-    # run command --version because some commands do not exit with
-    # exitcode 0 when called without any arguments (i.e. git)
     if test_version:
-        command_to_check = "{} --version".format(command)
-    else:
-        command_to_check = command
-    errno, stdout, stderr = run_command(command_to_check, shell=True)
-    if errno:
-        print("Failed! Command {} not found".format(command_to_check))
-        return False
+        probe = probe_command(command)
+        available = probe is not None and probe['returncode'] == 0
     else:
+        available = find_executable(command) is not None
+    if not available:
+        print("Failed! Command {} not found".format(command))
+    return available
+
+
+class FileLock(object):
+    """
+    Exclusive inter-process lock based on a lock file.
+
+    The lock is acquired by polling a non-blocking lock of the lock file
+    (flock on POSIX systems, msvcrt.locking on Windows) until the timeout
+    is reached. Separately opened locks also exclude each other within the
+    same process, i.e. the lock is safe to use from multiple threads.
+
+    :param lock_file: path to the lock file (created if missing)
+    :type lock_file: pathlib.Path
+    :param float timeout: maximum time (in seconds) waited for the lock
+        (wait forever if `None`)
+    """
+
+    def __init__(self, lock_file, timeout=None):
+        self.lock_file = pathlib.Path(lock_file)
+        self.timeout = timeout
+        self._fd = None
+
+    def _try_lock(self):
+        """Try to lock the lock file once, return `True` on success."""
+        if constants.ON_WIN:
+            import msvcrt
+            try:
+                msvcrt.locking(self._fd, msvcrt.LK_NBLCK, 1)
+            except (IOError, OSError):
+                return False
+        else:
+            import fcntl
+            try:
+                fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError):
+                return False
         return True
 
+    def acquire(self):
+        if not self.lock_file.parent.exists():
+            self.lock_file.parent.mkdir(parents=True, exist_ok=True)
+        self._fd = os.open(str(self.lock_file), os.O_RDWR | os.O_CREAT)
+        start = time.time()
+        delay = 0.001
+        while not self._try_lock():
+            if (self.timeout is not None
+                    and time.time() - start > self.timeout):
+                os.close(self._fd)
+                self._fd = None
+                raise Exception("Unable to acquire the lock {} (held for "
+                                "more than {}s)"
+                                .format(self.lock_file, self.timeout))
+            time.sleep(delay)
+            delay = min(delay * 2, 0.1)
+
+    def release(self):
+        if self._fd is None:
+            return
+        if constants.ON_WIN:
+            import msvcrt
+            os.lseek(self._fd, 0, os.SEEK_SET)
+            msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+        self._fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+def yaml_safe_load(stream):
+    """Parse YAML using libyaml's CSafeLoader if available."""
+    import yaml
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    return yaml.load(stream, Loader=loader)
+
+
+def yaml_safe_dump(data, stream=None):
+    """Write YAML (block style) using libyaml's CSafeDumper if available."""
+    import yaml
+    dumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+    return yaml.dump(data, stream, Dumper=dumper, default_flow_style=False)
+
+
+def write_yaml_atomic(path, data):
+    """
+    Write data as YAML to path by atomically replacing the file.
+
+    Readers never see a partially written file. The temporary file is
+    unique per process and thread, i.e. concurrent writers never write to
+    the same temporary file.
 
-def load_project_spec():
-    """Load config specs from .projects file."""
+    :param path: path of the written file
+    :type path: pathlib.Path
+    :param data: YAML serializable data
+    """
+    temporary_path = path.with_name(".{}.{}-{}.tmp".format(
+        path.name, os.getpid(), os.urandom(4).hex()))
+    try:
+        with open(str(temporary_path), 'w') as f:
+            yaml_safe_dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(str(temporary_path), str(path))
+    finally:
+        if temporary_path.exists():
+            temporary_path.unlink()
+
+
+def load_config():
+    """
+    Load the site-wide configuration from the config file.
+
+    The configuration file (located in the aiida-project configuration
+    folder) may define defaults for the following keys:
+
+    * conda_channels: list of channels used by the conda manager
+    * conda_override_channels: ignore channels defined in .condarc
+    * conda_strict_channel_priority: enable strict channel priority
+    """
     home = pathlib.Path().home()
-    config_folder = home / constants.CONFIG_FOLDER
-    projects_file = str(config_folder / constants.PROJECTS_FILE)
+    config_file = home / constants.CONFIG_FOLDER / constants.CONFIG_FILE
     try:
-        with open(projects_file, 'r') as f:
-            project_specs = yaml.safe_load(f)
+        with open(str(config_file), 'r') as f:
+            config = yaml_safe_load(f)
     except FileNotFoundError:
-        project_specs = {}
-    return project_specs
+        config = None
+    return config or {}
+
+
+def load_project_spec():
+    """Load the specifications of all registered projects."""
+    from aiida_project.registry import ProjectRegistry
+    return ProjectRegistry().load_all()
+
+
+def get_project_spec(project_name):
+    """
+    Load the specification of a single registered project.
+
+    :raises KeyError: if the project is not registered
+    """
+    from aiida_project.registry import ProjectRegistry
+    return ProjectRegistry().load(project_name)
 
 
 def save_project_spec(project_spec):
-    """Save project specfication to .projects file."""
-    home = pathlib.Path().home()
-    config_folder = home / constants.CONFIG_FOLDER
-    if not config_folder.exists():
-        config_folder.mkdir()
-    projects_file = str(config_folder / constants.PROJECTS_FILE)
-    project_specs = load_project_spec()
+    """Save project specfication to the project registry."""
+    from aiida_project.registry import ProjectRegistry
     project_name = project_spec.pop('project_name')
-    project_specs.update({project_name: project_spec})
-    with open(projects_file, 'w') as f:
-        yaml.dump(project_specs, f, default_flow_style=False)
+    ProjectRegistry().save(project_name, project_spec)
 
 
 def project_name_exists(project_name):
     """Check if the project name is already in use."""
-    project_names = load_project_spec().keys()
-    return project_name in project_names
+    from aiida_project.registry import ProjectRegistry
+    return ProjectRegistry().exists(project_name)
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the orchestration overhead of `aiida-project create`.
+
+Projects are created end-to-end (i.e. including the interpreter startup)
+with stub executables replacing conda, virtualenv, pip and git (see
+`stubs.py`). Without latency the measured time is the time spent in
+aiida-project itself. The latency added to every stub call allows to see how
+the orchestration scales with slow package managers.
+
+Run with `python benchmarks/bench_create.py [latency]`.
+"""
+from __future__ import print_function
+
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+if sys.version_info >= (3, 0):
+    import pathlib as pathlib
+else:
+    import pathlib2 as pathlib
+
+import stubs
+
+
+REPEAT = 3
+
+# (manager, command line options) of the benchmarked projects
+SCENARIOS = {
+    'virtualenv': ['--manager', 'virtualenv', '--aiida', '1.6.4',
+                   '--python', '3.8', '--no-wheelhouse', '--no-git-cache',
+                   '--utility-pkg', 'aiida-vasp',
+                   '--utility-pkg', 'aiidateam/aiida-ase:devel',
+                   '--utility-pkg', 'aiidateam/aiida-cp2k:develop'],
+    'conda': ['--manager', 'conda', '--aiida', '1.6.4', '--python', '3.8',
+              '--utility-pkg', 'aiida-vasp'],
+}
+
+
+def create_project(folder, scenario, index, latency):
+    """
+    Create a single project and return its wall time and stub calls.
+
+    :returns: tuple of the wall time (in seconds) and the number of stub
+        calls
+    """
+    calls_file = folder / 'calls-{}-{}.txt'.format(scenario, index)
+    env = stubs.get_stub_environment(folder / 'bin', folder, latency=latency,
+                                     calls_file=calls_file)
+    command = [str(folder / 'bin' / 'aiida-project'), 'create',
+               '--path', str(folder / 'projects')]
+    command += SCENARIOS[scenario]
+    command.append('{}_{}'.format(scenario, index))
+    start = time.perf_counter()
+    process = subprocess.Popen(command, env=env, stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT)
+    output, _ = process.communicate()
+    seconds = time.perf_counter() - start
+    if process.returncode:
+        raise Exception("Creating the {} project failed:\n{}"
+                        .format(scenario, output.decode()))
+    with open(str(calls_file), 'r') as f:
+        calls = len(f.readlines())
+    return (seconds, calls)
+
+
+def run(latency=0.0, repeat=REPEAT):
+    """
+    Run the benchmark.
+
+    :returns: dictionary mapping benchmark names to the best wall time (in
+        seconds) and dictionary mapping them to the number of stub calls
+    """
+    folder = pathlib.Path(tempfile.mkdtemp())
+    timings = {}
+    calls = {}
+    try:
+        stubs.write_stub_executables(folder / 'bin')
+        (folder / 'projects').mkdir()
+        for scenario in sorted(SCENARIOS):
+            results = [create_project(folder, scenario, index, latency)
+                       for index in range(repeat)]
+            name = 'create.{}'.format(scenario)
+            timings[name] = min(seconds for (seconds, _) in results)
+            calls[name] = results[0][1]
+    finally:
+        shutil.rmtree(str(folder))
+    return (timings, calls)
+
+
+def main(latency):
+    timings, calls = run(latency)
+    print("{:<24} {:>12} {:>8}".format('benchmark', 'time [ms]', 'calls'))
+    for (name, seconds) in sorted(timings.items()):
+        print("{:<24} {:>12.1f} {:>8}".format(name, seconds * 1e3,
+                                              calls[name]))
+
+
+if __name__ == '__main__':
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 0.0)
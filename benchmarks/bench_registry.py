@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark of the project registry.
+
+Compares the time needed to look up a single project in registries of 10,
+1k and 10k projects for
+
+* the legacy single projects file (parsed with PyYAML's pure python and,
+  if available, libyaml's C loader),
+* the per-project registry (first lookup in a new process and memoized
+  lookups afterwards).
+
+Registering a new project and listing all projects are measured as well.
+
+Run with `python benchmarks/bench_registry.py [sizes ...]`.
+"""
+from __future__ import print_function
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+if sys.version_info >= (3, 0):
+    import pathlib as pathlib
+else:
+    import pathlib2 as pathlib
+
+import yaml
+
+# import the aiida_project package of this checkout (without installing it)
+sys.path.insert(0, os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+
+from aiida_project import constants
+from aiida_project import registry as project_registry
+
+
+DEFAULT_SIZES = [10, 1000, 10000]
+REPEAT = 5
+
+
+def get_project_spec(index):
+    project_path = '/home/user/projects/project_{}'.format(index)
+    return {
+        'project_path': project_path,
+        'aiida': '1.6.4',
+        'python': '3.8',
+        'env_sub': project_path + '/env',
+        'src_sub': project_path + '/src',
+        'manager': constants.MANAGER_NAME_CONDA,
+        'solver': constants.CONDA_SOLVER_LIBMAMBA,
+        'channels': list(constants.DEFAULT_CONDA_CHANNELS),
+    }
+
+
+def best_of(function, repeat=REPEAT):
+    """Return the best wall time (in seconds) of repeat calls."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def benchmark(size, folder, legacy=True):
+    """Return the timings of a registry with size projects."""
+    project_specs = {'project_{}'.format(index): get_project_spec(index)
+                     for index in range(size)}
+    wanted = 'project_{}'.format(size // 2)
+    timings = {}
+    if legacy:
+        timings.update(benchmark_legacy(project_specs, wanted, folder))
+    # the per-project registry only reads the file of the wanted project
+    registry = project_registry.ProjectRegistry(folder / 'projects')
+    registry.registry_folder.mkdir()
+    for (project_name, project_spec) in project_specs.items():
+        registry.write_atomic(registry.get_spec_path(project_name),
+                              project_spec)
+
+    def cold_lookup():
+        project_registry._spec_cache.clear()
+        return registry.load(wanted)
+    timings['registry (cold)'] = best_of(cold_lookup)
+    registry.load(wanted)
+    timings['registry (memoized)'] = best_of(lambda: registry.load(wanted))
+    added = iter(range(size, size + REPEAT))
+    timings['registry (add)'] = best_of(lambda: registry.add(
+        'project_{}'.format(next(added)), get_project_spec(size)))
+
+    def cold_list():
+        project_registry._names_cache.clear()
+        return registry.list_names()
+    timings['registry (list)'] = best_of(cold_list)
+    return timings
+
+
+def benchmark_legacy(project_specs, wanted, folder):
+    """Return the lookup timings of the legacy single projects file."""
+    # the legacy file has to be parsed as a whole for every lookup
+    legacy_file = folder / constants.PROJECTS_FILE
+    with open(str(legacy_file), 'w') as f:
+        yaml.dump(project_specs, f, Dumper=getattr(yaml, 'CSafeDumper',
+                                                   yaml.SafeDumper))
+
+    def legacy_lookup(loader):
+        with open(str(legacy_file), 'r') as f:
+            return yaml.load(f, Loader=loader)[wanted]
+    timings = {
+        'legacy (python)': best_of(lambda: legacy_lookup(yaml.SafeLoader)),
+    }
+    if hasattr(yaml, 'CSafeLoader'):
+        timings['legacy (libyaml)'] = best_of(
+            lambda: legacy_lookup(yaml.CSafeLoader))
+    return timings
+
+
+def run(sizes=DEFAULT_SIZES, legacy=False):
+    """
+    Run the benchmark for registries of the given sizes.
+
+    The legacy projects file is only benchmarked if legacy is set (it only
+    serves as reference and takes long for large registries).
+
+    :returns: dictionary mapping benchmark names (i.e.
+        `registry.1000.registry_cold`) to the best wall time (in seconds)
+    """
+    results = {}
+    for size in sizes:
+        folder = pathlib.Path(tempfile.mkdtemp())
+        try:
+            timings = benchmark(size, folder, legacy=legacy)
+        finally:
+            shutil.rmtree(str(folder))
+        for (name, seconds) in timings.items():
+            key = name.replace(' (', '_').rstrip(')')
+            results['registry.{}.{}'.format(size, key)] = seconds
+    return results
+
+
+def main(sizes):
+    print("{:>8}  {:<20} {:>12}".format('projects', 'operation',
+                                        'time [ms]'))
+    for size in sizes:
+        folder = pathlib.Path(tempfile.mkdtemp())
+        try:
+            timings = benchmark(size, folder)
+        finally:
+            shutil.rmtree(str(folder))
+        for (name, seconds) in timings.items():
+            print("{:>8}  {:<20} {:>12.3f}".format(size, name, seconds * 1e3))
+
+
+if __name__ == '__main__':
+    main([int(size) for size in sys.argv[1:]] or DEFAULT_SIZES)
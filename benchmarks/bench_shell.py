@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the shell integration.
+
+Measures the wall time of
+
+* `aiida-project init bash` (run for every new shell unless the init file
+  written by `init bash --write` is used),
+* activating and deactivating a project end-to-end in bash, both through
+  the precomputed activation scripts (warm) and through aiida-project
+  itself (cold, i.e. after the project's spec file has changed).
+
+A virtualenv project is created with the stub executables first (see
+`stubs.py`). Requires bash >= 5 (for $EPOCHREALTIME).
+
+Run with `python benchmarks/bench_shell.py [latency]`.
+"""
+from __future__ import print_function
+
+import sys
+import shutil
+import tempfile
+import subprocess
+if sys.version_info >= (3, 0):
+    import pathlib as pathlib
+else:
+    import pathlib2 as pathlib
+
+import stubs
+from bench_registry import best_of
+
+
+REPEAT = 10
+
+# activates and deactivates the project repeat times printing the time
+# stamps before and after every step ($1: project, $2: repeat, $3: cold)
+ACTIVATION_SCRIPT = """
+eval "$(aiida-project init bash)"
+for i in $(seq "$2"); do
+  if [ "$3" = cold ]; then touch "$AIIDA_PROJECT_SPECS/$1.yaml"; fi
+  t0=$EPOCHREALTIME
+  aiida-project-bash activate "$1" > /dev/null || exit 1
+  t1=$EPOCHREALTIME
+  if [ "$3" = cold ]; then touch "$AIIDA_PROJECT_SPECS/$1.yaml"; fi
+  t2=$EPOCHREALTIME
+  aiida-project-bash deactivate > /dev/null || exit 1
+  t3=$EPOCHREALTIME
+  echo "$t0 $t1 $t2 $t3"
+done
+"""
+
+
+def time_activation(env, project, repeat, cold):
+    """Return the best activation and deactivation time in bash."""
+    mode = 'cold' if cold else 'warm'
+    output = subprocess.check_output(
+        ['bash', '-c', ACTIVATION_SCRIPT, 'bash', project, str(repeat),
+         mode], env=env)
+    activations = []
+    deactivations = []
+    for line in output.decode().splitlines():
+        # $EPOCHREALTIME uses the locale's decimal separator
+        t0, t1, t2, t3 = [float(stamp.replace(',', '.'))
+                          for stamp in line.split()]
+        activations.append(t1 - t0)
+        deactivations.append(t3 - t2)
+    return (min(activations), min(deactivations))
+
+
+def run(latency=0.0, repeat=REPEAT):
+    """
+    Run the benchmark.
+
+    :returns: dictionary mapping benchmark names to the best wall time (in
+        seconds)
+    """
+    folder = pathlib.Path(tempfile.mkdtemp())
+    timings = {}
+    try:
+        stubs.write_stub_executables(folder / 'bin')
+        env = stubs.get_stub_environment(folder / 'bin', folder,
+                                         latency=latency)
+        executable = str(folder / 'bin' / 'aiida-project')
+        subprocess.check_output(
+            [executable, 'create', '--manager', 'virtualenv', '--aiida',
+             '1.6.4', '--python', '3.8', '--no-wheelhouse', '--path',
+             str(folder), 'project'], env=env)
+        timings['init.bash'] = best_of(lambda: subprocess.check_output(
+            [executable, 'init', 'bash'], env=env), repeat=repeat)
+        # the first activation updates the cached completion script
+        time_activation(env, 'project', 1, cold=False)
+        for cold in (False, True):
+            activation, deactivation = time_activation(env, 'project',
+                                                       repeat, cold)
+            mode = 'cold' if cold else 'warm'
+            timings['activate.{}'.format(mode)] = activation
+            timings['deactivate.{}'.format(mode)] = deactivation
+    finally:
+        shutil.rmtree(str(folder))
+    return timings
+
+
+def main(latency):
+    print("{:<24} {:>12}".format('benchmark', 'time [ms]'))
+    for (name, seconds) in sorted(run(latency).items()):
+        print("{:<24} {:>12.1f}".format(name, seconds * 1e3))
+
+
+if __name__ == '__main__':
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 0.0)
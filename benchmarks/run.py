@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Run all benchmarks and compare them to the stored baseline.
+
+The benchmarks (see `bench_create.py`, `bench_shell.py` and
+`bench_registry.py`) use stub executables instead of the real package
+managers, i.e. they measure the overhead of aiida-project itself. Every
+benchmark is compared to `baseline.json` and the run fails if a benchmark
+got slower than the baseline by more than the tolerance.
+
+Run with `python benchmarks/run.py` and store new results as baseline with
+`python benchmarks/run.py --update-baseline`. Timings depend on the
+machine, i.e. update the baseline before comparing on a new machine.
+"""
+from __future__ import print_function
+
+import os
+import sys
+import json
+import platform
+import argparse
+
+# import the aiida_project package of this checkout (without installing it)
+sys.path.insert(0, os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+
+import bench_create
+import bench_shell
+import bench_registry
+
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'baseline.json')
+
+# a benchmark regressed if it is slower than the baseline by more than the
+# relative tolerance *and* by more than the absolute tolerance (which
+# avoids false alarms for sub-millisecond benchmarks)
+DEFAULT_TOLERANCE = 0.5
+ABSOLUTE_TOLERANCE = 0.005
+
+
+def run_benchmarks(latency=0.0, sizes=bench_registry.DEFAULT_SIZES):
+    """Run all benchmarks and return their timings (in seconds)."""
+    timings = {}
+    create_timings, _ = bench_create.run(latency)
+    timings.update(create_timings)
+    timings.update(bench_shell.run(latency))
+    timings.update(bench_registry.run(sizes))
+    return timings
+
+
+def get_machine():
+    """Describe the machine the benchmarks are run on."""
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def compare(timings, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Compare timings to the baseline timings.
+
+    :returns: list of tuples (name, time, baseline time) of all regressed
+        benchmarks
+    """
+    regressions = []
+    for (name, seconds) in sorted(timings.items()):
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+        if (seconds > reference * (1.0 + tolerance)
+                and seconds - reference > ABSOLUTE_TOLERANCE):
+            regressions.append((name, seconds, reference))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="latency (in seconds) of every stub call")
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=bench_registry.DEFAULT_SIZES,
+                        help="registry sizes (number of projects)")
+    parser.add_argument('--baseline', default=BASELINE_FILE,
+                        help="baseline file (default: %(default)s)")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="allowed relative slowdown (default: "
+                             "%(default)s)")
+    parser.add_argument('--output', default=None,
+                        help="write the results to the given JSON file")
+    parser.add_argument('--update-baseline', action='store_true',
+                        help="store the results as new baseline")
+    args = parser.parse_args()
+    timings = run_benchmarks(args.latency, args.sizes)
+    results = {'machine': get_machine(), 'latency': args.latency,
+               'timings': timings}
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        if baseline.get('latency') != args.latency:
+            print("Warning: baseline was recorded with a latency of {}s"
+                  .format(baseline.get('latency')))
+    baseline_timings = baseline.get('timings', {})
+    print("{:<32} {:>12} {:>12}".format('benchmark', 'time [ms]',
+                                        'base [ms]'))
+    for (name, seconds) in sorted(timings.items()):
+        reference = baseline_timings.get(name)
+        print("{:<32} {:>12.3f} {:>12}".format(
+            name, seconds * 1e3,
+            '-' if reference is None else "{:.3f}".format(reference * 1e3)))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print("Baseline written to {}".format(args.baseline))
+        return 0
+    regressions = compare(timings, baseline_timings, args.tolerance)
+    for (name, seconds, reference) in regressions:
+        print("REGRESSION {}: {:.3f}ms (baseline {:.3f}ms)".format(
+            name, seconds * 1e3, reference * 1e3))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+Stub executables used by the benchmarks.
+
+The stubs replace conda, virtualenv, pip, git, verdi and reentry on the
+PATH. Every call sleeps for the latency given by the environment variable
+`AIIDA_PROJECT_BENCH_LATENCY` (in seconds, defaults to 0) and only creates
+what aiida-project relies on afterwards (i.e. virtualenv creates the
+environment's activate script and site-packages folder), i.e. the measured
+times are dominated by aiida-project itself.
+
+Every call is appended to the file given by `AIIDA_PROJECT_BENCH_CALLS` (if
+set) so that the number of spawned commands can be tracked as well.
+"""
+import os
+import sys
+import stat
+
+
+LATENCY_VARIABLE = 'AIIDA_PROJECT_BENCH_LATENCY'
+CALLS_VARIABLE = 'AIIDA_PROJECT_BENCH_CALLS'
+
+FAKE_COMMIT = '0123456789abcdef0123456789abcdef01234567'
+
+HEADER = """#!/bin/sh
+if [ -n "${calls}" ]; then
+  echo "{name} $*" >> "${calls}"
+fi
+if [ -n "${latency}" ] && [ "${latency}" != 0 ]; then
+  sleep "${latency}"
+fi
+"""
+
+# command specific behaviour (the last argument of the command is
+# available as $last)
+BODIES = {
+    'conda': """
+case "$1" in
+  --version) echo "conda 4.10.3" ;;
+  list) echo "@EXPLICIT" ;;
+esac
+""",
+    'virtualenv': """
+mkdir -p "$last/bin" "$last/lib/python3.8/site-packages"
+echo 'deactivate() { :; }' > "$last/bin/activate"
+""",
+    'pip': """
+case "$1" in
+  --version) echo "pip 21.2.4" ;;
+  freeze) echo "aiida-core==1.6.4" ;;
+esac
+""",
+    'git': """
+case "$1" in
+  --version) echo "git version 2.30.2" ;;
+  clone) mkdir -p "$last" ;;
+  ls-remote) printf '{commit}\\tHEAD\\n' ;;
+  -C) [ "$3" = rev-parse ] && echo "{commit}" ;;
+esac
+""".format(commit=FAKE_COMMIT),
+    'verdi': """
+case "$1" in
+  completioncommand) echo "complete -o nospace -F _verdi_completion verdi" ;;
+esac
+""",
+    'reentry': "",
+}
+
+
+def write_stub_executables(bin_folder):
+    """
+    Write all stub executables to bin_folder.
+
+    :param bin_folder: folder the stubs are written to (prepend it to the
+        PATH to use them)
+    :type bin_folder: pathlib.Path
+    :returns: list of paths to the written stubs
+    """
+    if not bin_folder.exists():
+        bin_folder.mkdir(parents=True)
+    written = []
+    for (name, body) in sorted(BODIES.items()):
+        header = (HEADER.replace('{name}', name)
+                  .replace('{calls}', CALLS_VARIABLE)
+                  .replace('{latency}', LATENCY_VARIABLE))
+        stub = bin_folder / name
+        stub.write_text(header + 'for last; do :; done\n' + body)
+        stub.chmod(stub.stat().st_mode | stat.S_IXUSR | stat.S_IXGRP
+                   | stat.S_IXOTH)
+        written.append(stub)
+    # aiida-project itself (i.e. if the package is not installed)
+    launcher = bin_folder / 'aiida-project'
+    launcher.write_text(u"#!{}\nfrom aiida_project.cli import main\n"
+                        u"main()\n".format(sys.executable))
+    launcher.chmod(launcher.stat().st_mode | stat.S_IXUSR)
+    written.append(launcher)
+    return written
+
+
+def get_stub_environment(bin_folder, home, latency=0.0, calls_file=None):
+    """
+    Return the environment running aiida-project with the stubs.
+
+    :param bin_folder: folder containing the stubs
+    :param home: home folder used by aiida-project
+    :param float latency: latency (in seconds) of every stub call
+    :param calls_file: optional file recording all stub calls
+    :returns: dictionary of environment variables
+    """
+    package_root = os.path.dirname(os.path.dirname(os.path.abspath(
+        __file__)))
+    env = {
+        'HOME': str(home),
+        # keep the basic tools (sleep, mkdir, ...) but nothing else
+        'PATH': os.pathsep.join([str(bin_folder), '/usr/bin', '/bin']),
+        'PYTHONPATH': package_root,
+        'LANG': os.environ.get('LANG', 'C.UTF-8'),
+        LATENCY_VARIABLE: str(latency),
+    }
+    if calls_file is not None:
+        env[CALLS_VARIABLE] = str(calls_file)
+    return env
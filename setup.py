@@ -17,7 +17,7 @@ setup(
     install_requires=[
         "pathlib2; python_version<'3.0'",
         "pathlib; python_version>='3.0'",
-        "click",
+        "click>=8.0",
         "click-spinner",
         "pyyaml",
         # bug in conda < 4.6
@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
+import io
 import shutil
 import tempfile
+import subprocess
 import sys
 if sys.version_info >= (3, 0):
     import pathlib as pathlib
@@ -78,6 +80,11 @@ def fake_popen(monkeypatch):
             # all commands used are called with shell=True and are composed
             # of a single string
             self.cmd = " ".join(args)
+            # provide the defined outputs as streams for commands which are
+            # read line by line
+            stdout, stderr = self.get_outputs()
+            self.stdout = io.BytesIO(stdout)
+            self.stderr = io.BytesIO(stderr)
 
         @classmethod
         def set_cmd_attrs(cls, cmd, returncode=1, stdout=b"", stderr=b""):
@@ -88,18 +95,46 @@ def fake_popen(monkeypatch):
             }
             cls.cmd_defs.update({cmd: command_attrs})
 
-        def communicate(self, input=None):
+        def get_outputs(self):
             # return defined attrs if command is in command attributes dict
             for (command, cmd_attrs) in self.cmd_defs.items():
                 if command in self.cmd:
                     self.returncode = cmd_attrs['returncode']
                     return (cmd_attrs['stdout'], cmd_attrs['stderr'])
             # else: return the defaults
-            return (self.stdout, self.stderr)
+            return (type(self).stdout, type(self).stderr)
+
+        def communicate(self, input=None):
+            return self.get_outputs()
+
+        def wait(self, timeout=None):
+            return self.returncode
     monkeypatch.setattr('subprocess.Popen', FakePopen)
     yield FakePopen
 
 
+@pytest.fixture
+def fake_executables(monkeypatch, temporary_folder):
+    """Replace the PATH by a folder containing only the added executables."""
+    class FakeExecutables(object):
+        bin_folder = temporary_folder / 'fake-bin'
+
+        def add(self, *names):
+            for name in names:
+                executable = self.bin_folder / name
+                executable.write_text(u"#!/bin/sh\nexit 0\n")
+                executable.chmod(0o755)
+
+        def remove(self, *names):
+            for name in names:
+                executable = self.bin_folder / name
+                if executable.exists():
+                    executable.unlink()
+    FakeExecutables.bin_folder.mkdir()
+    monkeypatch.setenv('PATH', str(FakeExecutables.bin_folder))
+    yield FakeExecutables()
+
+
 @pytest.fixture
 def temporary_home(monkeypatch, temporary_folder):
     def override_home(cls):
@@ -139,3 +174,20 @@ def project_spec_file(temporary_home):
 @pytest.fixture
 def click_cli_runner():
     yield CliRunner()
+
+
+@pytest.fixture
+def git_repository(temporary_folder):
+    """Create a local git repository with a few commits on branch main."""
+    repository = temporary_folder / 'upstream' / 'repository'
+    repository.mkdir(parents=True)
+    git = ["git", "-c", "user.name=aiida", "-c", "user.email=aiida@localhost"]
+    subprocess.check_call(git + ["init", "-q", "-b", "main"],
+                          cwd=str(repository))
+    for commit in range(3):
+        (repository / 'file.txt').write_text(u"commit {}".format(commit))
+        subprocess.check_call(git + ["add", "file.txt"], cwd=str(repository))
+        subprocess.check_call(git + ["commit", "-q", "-m",
+                                     "commit {}".format(commit)],
+                              cwd=str(repository))
+    yield repository
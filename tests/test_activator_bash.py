@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 import sys
 import os
+import shutil
+import subprocess
 if sys.version_info >= (3, 0):
     import pathlib as pathlib
 else:
@@ -8,6 +10,8 @@ else:
 
 import pytest
 
+from aiida_project import utils
+from aiida_project import constants
 from aiida_project.activate import ActivateEnvBash
 from aiida_project.constants import AIIDA_SUBFOLDER
 
@@ -86,3 +90,216 @@ def test_venv_activation(project_spec_file, fake_popen):
     assert "No activation script found at location" in str(exception.value)
     # reset environment
     os.environ['AIIDA_PROJECT_ACTIVE'] = ''
+
+
+def test_micromamba_activation(temporary_home, fake_popen, fake_executables):
+    """Test environments created by micromamba are activated by it."""
+    fake_executables.add('micromamba')
+    base_path = pathlib.Path.home() / 'mamba_project'
+    (base_path / AIIDA_SUBFOLDER).mkdir(parents=True)
+    utils.save_project_spec({
+        'project_name': 'mamba_project',
+        'project_path': str(base_path),
+        'aiida': '1.0.0',
+        'python': '3.6',
+        'env_sub': str(base_path / 'env'),
+        'src_sub': str(base_path / 'src'),
+        'manager': constants.MANAGER_NAME_CONDA,
+        'solver': constants.CONDA_SOLVER_MICROMAMBA,
+    })
+    bash = ActivateEnvBash('mamba_project')
+    env_name = "{}/mamba_project".format(base_path / 'env')
+    assert ("micromamba activate {}".format(env_name)
+            in bash.activate_commands)
+    assert "micromamba deactivate" in bash.deactivate_commands
+    # missing micromamba results in a meaningful error message
+    fake_executables.remove('micromamba')
+    with pytest.raises(Exception) as exception:
+        ActivateEnvBash('mamba_project')
+    assert "micromamba does not seem to be available" in str(exception.value)
+
+
+def test_cached_completion(temporary_home):
+    """Test verdi's completion script is only regenerated if aiida-core
+    changed."""
+    base_path = pathlib.Path.home() / 'venv_project'
+    (base_path / AIIDA_SUBFOLDER).mkdir(parents=True)
+    env_path = base_path / 'env' / 'venv_project'
+    (env_path / 'bin').mkdir(parents=True)
+    (env_path / 'bin' / 'activate').touch()
+    project_spec = {
+        'project_name': 'venv_project',
+        'project_path': str(base_path),
+        'aiida': '1.0.0',
+        'python': '3.6',
+        'env_sub': str(env_path),
+        'src_sub': str(base_path / 'src'),
+        'manager': constants.MANAGER_NAME_VENV,
+    }
+    utils.save_project_spec(project_spec)
+    # without site-packages completion is evaluated on every activation
+    bash = ActivateEnvBash('venv_project')
+    assert bash.activate_commands[-1] == 'eval "$(verdi completioncommand)"'
+    # otherwise the cached completion script is regenerated and sourced
+    site_packages = env_path / 'lib' / 'python3.6' / 'site-packages'
+    (site_packages / 'aiida_core-1.0.0.dist-info').mkdir(parents=True)
+    completion_file = base_path / constants.VERDI_COMPLETION_FILE
+    bash = ActivateEnvBash('venv_project')
+    commands = bash.build_cmd_completion(project_spec, env_path)
+    assert bash.activate_commands[-2:] == commands
+    assert commands[-1] == "if [ -f '{0}' ]; then . '{0}'; fi".format(
+        completion_file)
+    # the precomputed script runs the very same check
+    assert "\n".join(commands) in bash.build_script_activate()
+    home = pathlib.Path.home()
+    assert run_counting_calls(commands, home, 'verdi') == 1
+    assert completion_file.read_text().startswith("# aiida-core: ")
+    # an up to date completion script is sourced only, also if other
+    # packages were installed
+    assert run_counting_calls(commands, home, 'verdi') == 0
+    (site_packages / 'aiida_vasp-1.0.0.dist-info').mkdir()
+    assert run_counting_calls(commands, home, 'verdi') == 0
+    # upgrading aiida-core regenerates the completion script
+    (site_packages / 'aiida_core-1.0.0.dist-info').rename(
+        site_packages / 'aiida_core-1.1.0.dist-info')
+    assert run_counting_calls(commands, home, 'verdi') == 1
+    # as does bumping the version of an editable aiida-core
+    shutil.rmtree(str(site_packages / 'aiida_core-1.1.0.dist-info'))
+    egg_info = base_path / 'src' / 'aiida-core' / 'aiida_core.egg-info'
+    egg_info.mkdir(parents=True)
+    (egg_info / 'PKG-INFO').write_text(u"Name: aiida-core\nVersion: 2.0.0\n")
+    (site_packages / 'aiida-core.egg-link').write_text(
+        u"{}\n.".format(egg_info.parent))
+    assert run_counting_calls(commands, home, 'verdi') == 1
+    assert run_counting_calls(commands, home, 'verdi') == 0
+    (egg_info / 'PKG-INFO').write_text(u"Name: aiida-core\nVersion: 2.1.0\n")
+    assert run_counting_calls(commands, home, 'verdi') == 1
+
+
+def run_counting_calls(commands, temporary_folder, name='reentry'):
+    """Run commands in bash and return how often name (reentry or verdi)
+    was called."""
+    bin_folder = temporary_folder / 'counting-bin'
+    calls_file = temporary_folder / 'calls'
+    if not bin_folder.exists():
+        bin_folder.mkdir()
+        for executable in ['reentry', 'verdi']:
+            (bin_folder / executable).write_text(
+                u"#!/bin/sh\necho {} >> '{}'\necho '# {}'\n"
+                .format(executable, calls_file, executable))
+            (bin_folder / executable).chmod(0o755)
+
+    def count():
+        if not calls_file.exists():
+            return 0
+        return calls_file.read_text().splitlines().count(name)
+    calls_before = count()
+    env = {'PATH': "{}:{}".format(bin_folder, os.environ['PATH'])}
+    subprocess.check_call(['bash', '-c', "\n".join(commands)], env=env)
+    return count() - calls_before
+
+
+def test_reentry_scan_skipped(temporary_home):
+    """Test reentry scan only runs if the entry points changed."""
+    base_path = pathlib.Path.home() / 'venv_project'
+    (base_path / AIIDA_SUBFOLDER).mkdir(parents=True)
+    env_path = base_path / 'env' / 'venv_project'
+    (env_path / 'bin').mkdir(parents=True)
+    (env_path / 'bin' / 'activate').touch()
+    project_spec = {
+        'project_name': 'venv_project',
+        'project_path': str(base_path),
+        'aiida': '1.0.0',
+        'python': '3.6',
+        'env_sub': str(env_path),
+        'src_sub': str(base_path / 'src'),
+        'manager': constants.MANAGER_NAME_VENV,
+    }
+    utils.save_project_spec(project_spec)
+    # without site-packages the scan is always run
+    bash = ActivateEnvBash('venv_project')
+    assert "reentry scan -r aiida" in bash.activate_commands
+    site_packages = env_path / 'lib' / 'python3.6' / 'site-packages'
+    (site_packages / 'aiida_core-1.0.0.dist-info').mkdir(parents=True)
+    bash = ActivateEnvBash('venv_project')
+    scan_commands = bash.build_cmd_reentry_scan(project_spec, env_path)
+    assert all(cmd in bash.activate_commands for cmd in scan_commands)
+    # the precomputed script runs the very same check
+    assert "\n".join(scan_commands) in bash.build_script_activate()
+    home = pathlib.Path.home()
+    assert run_counting_calls(scan_commands, home) == 1
+    # an unchanged environment is not scanned again
+    assert run_counting_calls(scan_commands, home) == 0
+    # installing another plugin changes the fingerprint
+    (site_packages / 'aiida_vasp-1.0.0.dist-info').mkdir()
+    assert run_counting_calls(scan_commands, home) == 1
+    # as does an editable plugin (its metadata is in the source tree)
+    egg_info = base_path / 'src' / 'aiida-ase' / 'aiida_ase.egg-info'
+    egg_info.mkdir(parents=True)
+    (egg_info / 'entry_points.txt').write_text(u"[aiida.calculations]\n")
+    egg_link = site_packages / 'aiida-ase.egg-link'
+    egg_link.write_text(u"{}\n.".format(egg_info.parent))
+    assert run_counting_calls(scan_commands, home) == 1
+    assert run_counting_calls(scan_commands, home) == 0
+    # new entry points of the editable plugin are picked up
+    (egg_info / 'entry_points.txt').write_text(
+        u"[aiida.calculations]\nase.ase = aiida_ase.calculations:Ase\n")
+    assert run_counting_calls(scan_commands, home) == 1
+    # and so is an egg-link rewritten in place
+    other_source = base_path / 'src' / 'aiida-ase-fork'
+    (other_source / 'aiida_ase.egg-info').mkdir(parents=True)
+    egg_link.write_text(u"{}\n.".format(other_source))
+    assert run_counting_calls(scan_commands, home) == 1
+
+
+def test_precomputed_scripts(temporary_home):
+    """Test the shell sources precomputed scripts without running python."""
+    base_path = pathlib.Path.home() / 'venv_project'
+    (base_path / AIIDA_SUBFOLDER).mkdir(parents=True)
+    env_path = base_path / 'env' / 'venv_project'
+    (env_path / 'bin').mkdir(parents=True)
+    (env_path / 'bin' / 'activate').write_text(
+        u"deactivate() { unset VENV_ACTIVE; }\nexport VENV_ACTIVE=1\n")
+    site_packages = env_path / 'lib' / 'python3.6' / 'site-packages'
+    site_packages.mkdir(parents=True)
+    utils.save_project_spec({
+        'project_name': 'venv_project',
+        'project_path': str(base_path),
+        'aiida': '1.0.0',
+        'python': '3.6',
+        'env_sub': str(base_path / 'env'),
+        'src_sub': str(base_path / 'src'),
+        'manager': constants.MANAGER_NAME_VENV,
+    })
+    # pretend entry points and completion are up to date
+    for marker in [constants.REENTRY_SCAN_FILE,
+                   constants.VERDI_COMPLETION_FILE]:
+        (base_path / marker).write_text(u"\n")
+        os.utime(str(base_path / marker), (2e9, 2e9))
+    bash = ActivateEnvBash('venv_project')
+    activate_script, deactivate_script = bash.write_scripts()
+    assert activate_script == bash.get_script_path('venv_project',
+                                                   'activate')
+    with open(str(activate_script), 'r') as f:
+        contents = f.read()
+    assert "export AIIDA_PROJECT_ACTIVE='venv_project'" in contents
+    assert "reentry scan -r aiida" in contents
+    # the aiida-project executable must not be called at all
+    setup_file = pathlib.Path.home() / 'setup.sh'
+    setup_file.write_text(ActivateEnvBash._setup('false'))
+    shell_script = "\n".join([
+        ". '{}'".format(setup_file),
+        "aiida-project-bash activate venv_project || exit 1",
+        'echo "$AIIDA_PROJECT_ACTIVE $VENV_ACTIVE $AIIDA_PATH"',
+        "aiida-project-bash deactivate 2> /dev/null",
+        'echo "[$AIIDA_PROJECT_ACTIVE $VENV_ACTIVE]"',
+    ])
+    output = subprocess.check_output(['bash', '-c', shell_script],
+                                     env={'PATH': os.environ['PATH']})
+    assert output.decode().splitlines() == [
+        "venv_project 1 {}".format(base_path), "[ ]"]
+    # outdated scripts are not sourced
+    os.utime(str(activate_script), (0, 0))
+    returncode = subprocess.call(['bash', '-c', shell_script],
+                                 env={'PATH': os.environ['PATH']})
+    assert returncode == 1
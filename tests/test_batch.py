@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+import time
+import threading
+import sys
+if sys.version_info >= (3, 0):
+    import pathlib as pathlib
+else:
+    import pathlib2 as pathlib
+
+import pytest
+
+from aiida_project import utils
+from aiida_project import constants
+from aiida_project.cli import create_many
+from aiida_project.create import CreateEnvBase
+from aiida_project.batch import (BatchCreator, ProjectResult, load_manifest,
+                                 format_report)
+
+
+def test_load_manifest(temporary_folder):
+    """Test the defaults of the manifest are applied to all projects."""
+    manifest = temporary_folder / 'manifest.yaml'
+    manifest.write_text(
+        u"defaults:\n"
+        u"  python: '3.8'\n"
+        u"  path: /some/path\n"
+        u"projects:\n"
+        u"  - name: project_a\n"
+        u"    aiida: 1.6.4\n"
+        u"    packages: [aiida-vasp]\n"
+        u"  - name: project_b\n"
+        u"    manager: conda\n"
+        u"    python: '3.9'\n"
+        u"    solver: mamba\n")
+    project_a, project_b = load_manifest(manifest)
+    assert project_a == {'name': 'project_a', 'manager': 'virtualenv',
+                         'python': '3.8', 'path': '/some/path',
+                         'aiida': '1.6.4', 'packages': ['aiida-vasp']}
+    assert project_b['manager'] == 'conda'
+    assert project_b['python'] == '3.9'
+    assert project_b['solver'] == 'mamba'
+    assert project_b['packages'] == []
+    # project names must be unique
+    manifest.write_text(u"projects:\n  - name: project_a\n"
+                        u"  - name: project_a\n")
+    with pytest.raises(Exception) as exception:
+        load_manifest(manifest)
+    assert "defined more than once" in str(exception.value)
+    # unquoted versions are read as numbers by YAML (3.10 as 3.1)
+    manifest.write_text(u"projects:\n  - name: project_a\n"
+                        u"    python: 3.10\n")
+    with pytest.raises(Exception) as exception:
+        load_manifest(manifest)
+    assert "python version 3.1 of project project_a" in str(exception.value)
+    assert "please quote it" in str(exception.value)
+
+
+class FakeCreator(CreateEnvBase):
+    """Creator running a network- and a CPU-bound step per project."""
+
+    lock = threading.Lock()
+    running = {constants.PHASE_NETWORK: 0, constants.PHASE_CPU: 0}
+    max_running = {constants.PHASE_NETWORK: 0, constants.PHASE_CPU: 0}
+
+    def __init__(self, proj_name):
+        self.proj_name = proj_name
+
+    def run_step(self, kind):
+        with self.phase(kind, kind):
+            with self.lock:
+                self.running[kind] += 1
+                self.max_running[kind] = max(self.max_running[kind],
+                                             self.running[kind])
+            time.sleep(0.02)
+            with self.lock:
+                self.running[kind] -= 1
+
+    def create_aiida_project_environment(self):
+        self.run_step(constants.PHASE_NETWORK)
+        self.run_step(constants.PHASE_CPU)
+        if self.proj_name == 'broken':
+            raise Exception("Environment setup failed")
+
+
+def test_phase_limits(temporary_folder, temporary_home, monkeypatch):
+    """Test network- and CPU-bound steps are limited separately."""
+    projects = [{'name': 'project_{}'.format(index), 'manager': 'virtualenv',
+                 'path': str(temporary_folder)} for index in range(8)]
+    projects.append({'name': 'broken', 'manager': 'virtualenv',
+                     'path': str(temporary_folder)})
+    batch_creator = BatchCreator(projects, network_jobs=3, cpu_jobs=1,
+                                 jobs=8)
+    monkeypatch.setattr(batch_creator, 'get_creator', lambda project:
+                        FakeCreator(project['name']))
+    results = batch_creator.run()
+    assert FakeCreator.max_running == {constants.PHASE_NETWORK: 3,
+                                       constants.PHASE_CPU: 1}
+    assert [result.name for result in results] == [
+        project['name'] for project in projects]
+    assert [result.success for result in results] == [True] * 8 + [False]
+    assert results[-1].error == "Environment setup failed"
+    # existing project folders are never touched
+    (temporary_folder / 'project_0').mkdir()
+    result = batch_creator.create_project(projects[0])
+    assert result.success is False
+    assert "already exists" in result.error
+
+
+def test_format_report():
+    """Test the report lists every project's status and timing."""
+    report = format_report([
+        ProjectResult('project_a', True, 12.34),
+        ProjectResult('project_b', False, 1.0, "Environment setup failed"),
+    ])
+    lines = report.splitlines()
+    assert lines[1].split() == ['project_a', 'ok', '12.3']
+    assert lines[2].split() == ['project_b', 'FAILED', '1.0']
+    assert lines[3] == "1 of 2 project(s) created"
+    assert lines[4] == "project_b: Environment setup failed"
+
+
+def test_create_many(click_cli_runner, temporary_folder, temporary_home,
+                     fake_popen, fake_executables):
+    """Test all projects of a manifest are created and registered."""
+    fake_executables.add('virtualenv', 'git')
+    manifest = temporary_folder / 'manifest.yaml'
+    manifest.write_text(
+        u"defaults:\n"
+        u"  python: '3.8'\n"
+        u"  path: {}\n"
+        u"  wheelhouse: false\n"
+        u"projects:\n"
+        u"  - name: project_a\n"
+        u"    aiida: 1.6.4\n"
+        u"  - name: project_b\n"
+        u"    aiida: 1.6.4\n"
+        u"    packages: [aiida-vasp]\n".format(temporary_folder))
+    result = click_cli_runner.invoke(create_many, [str(manifest)])
+    assert result.exit_code == 0, result.output
+    assert "2 of 2 project(s) created" in result.output
+    assert sorted(utils.load_project_spec()) == ['project_a', 'project_b']
+    commands = [cmd for (cmd,) in fake_popen.args]
+    assert ("virtualenv  --python=python3.8 {}"
+            .format(temporary_folder / 'project_b' / 'env' / 'project_b')
+            in commands)
+    # running the manifest again fails for all (existing) projects
+    result = click_cli_runner.invoke(create_many, [str(manifest)])
+    assert result.exit_code == 1
+    assert "0 of 2 project(s) created" in result.output
+    assert pathlib.Path(temporary_folder / 'project_a').exists()
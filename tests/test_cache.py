@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import subprocess
+import sys
+import threading
+if sys.version_info >= (3, 0):
+    import pathlib as pathlib
+else:
+    import pathlib2 as pathlib
+
+import pytest
+
+from aiida_project import constants
+from aiida_project.utils import FileLock
+from aiida_project.trace import Tracer
+from aiida_project.cache import (GitMirrorCache, Wheelhouse, SourceWheelCache,
+                                 prune_entries, get_folder_size)
+
+
+def add_commit(repository, message):
+    """Add a new commit to the given repository."""
+    git = ["git", "-c", "user.name=aiida", "-c", "user.email=aiida@localhost"]
+    (repository / 'file.txt').write_text(message)
+    subprocess.check_call(git + ["commit", "-q", "-a", "-m", message],
+                          cwd=str(repository))
+
+
+# fake pip executable creating a wheel in the folder passed to --wheel-dir
+# (called as: <exe> wheel --no-deps --wheel-dir <folder> <source>)
+FAKE_PIP_WHEEL = "sh -c 'touch \"$4\"/package-1.0-py3-none-any.whl' sh"
+
+
+def git_output(location, *args):
+    """Return the output of a git command run in location."""
+    output = subprocess.check_output(["git", "-C", str(location)] + list(args))
+    return output.decode().strip()
+
+
+def test_default_cache_folder(temporary_home):
+    """Test the mirrors are stored inside the configuration folder."""
+    cache = GitMirrorCache()
+    wanted_folder = (pathlib.Path.home() / constants.CONFIG_FOLDER
+                     / constants.GIT_CACHE_FOLDER)
+    assert cache.cache_folder == wanted_folder
+    # mirrors of different repositories never share a location
+    url_a = "https://github.com/user1/repo"
+    url_b = "https://github.com/user2/repo"
+    assert cache.get_mirror_path(url_a) != cache.get_mirror_path(url_b)
+    assert cache.get_mirror_path(url_a).name.startswith("repo-")
+
+
+def test_clone_from_mirror(git_repository, temporary_folder):
+    """Test cloning through the mirror of a local file:// repository."""
+    cache = GitMirrorCache(temporary_folder / 'git-cache')
+    url = git_repository.as_uri()
+    # cold cache: the mirror is created first
+    location = temporary_folder / 'clone1'
+    tracer = Tracer()
+    with tracer.span('clone') as span:
+        cache.clone(url, str(location), branch='main')
+    mirror = cache.get_mirror_path(url)
+    # the objects fetched into the mirror are recorded by the running step
+    assert span.fetched_bytes == get_folder_size(mirror)
+    assert mirror.exists()
+    assert git_output(location, "rev-list", "--count", "HEAD") == "3"
+    # the clone points to the original repository, not to the mirror
+    assert git_output(location, "remote", "get-url", "origin") == url
+    # warm cache: new upstream commits are fetched into the mirror
+    add_commit(git_repository, "commit 3")
+    location = temporary_folder / 'clone2'
+    cache.clone(url, str(location), branch='main')
+    assert git_output(location, "rev-list", "--count", "HEAD") == "4"
+    assert (git_output(location, "rev-parse", "HEAD")
+            == git_output(git_repository, "rev-parse", "HEAD"))
+
+
+def test_clone_modes_from_mirror(git_repository, temporary_folder):
+    """Test shallow and blobless clones through the mirror."""
+    cache = GitMirrorCache(temporary_folder / 'git-cache')
+    url = git_repository.as_uri()
+    location = temporary_folder / 'shallow'
+    cache.clone(url, str(location), branch='main',
+                mode=constants.CLONE_MODE_SHALLOW, depth=1)
+    assert git_output(location, "rev-list", "--count", "HEAD") == "1"
+    assert (location / '.git' / 'shallow').exists()
+    location = temporary_folder / 'blobless'
+    cache.clone(url, str(location), branch='main',
+                mode=constants.CLONE_MODE_BLOBLESS)
+    assert git_output(location, "rev-list", "--count", "HEAD") == "3"
+    assert git_output(location, "config", "remote.origin.promisor") == "true"
+    assert git_output(location, "remote", "get-url", "origin") == url
+
+
+def test_clone_from_mirror_failure(temporary_folder):
+    """Test that a missing upstream repository raises."""
+    cache = GitMirrorCache(temporary_folder / 'git-cache')
+    url = (temporary_folder / 'does-not-exist').as_uri()
+    with pytest.raises(Exception) as exception:
+        cache.clone(url, str(temporary_folder / 'clone'))
+    assert "Updating the cached mirror" in str(exception.value)
+    assert not cache.get_mirror_path(url).exists()
+
+
+def test_prune_mirrors(git_repository, temporary_folder):
+    """Test eviction of mirrors by age and by size."""
+    cache = GitMirrorCache(temporary_folder / 'git-cache')
+    urls = [git_repository.as_uri(), git_repository.as_uri() + '/']
+    mirrors = [cache.update_mirror(url) for url in urls]
+    # make the first mirror look like it was last used 10 days ago
+    old = time.time() - 10 * 24 * 60 * 60
+    os.utime(str(mirrors[0]), (old, old))
+    assert cache.prune(max_age=20 * 24 * 60 * 60) == []
+    assert cache.prune(max_age=5 * 24 * 60 * 60) == [mirrors[0]]
+    assert not mirrors[0].exists()
+    assert mirrors[1].exists()
+    # mirrors in use are skipped
+    with FileLock(mirrors[1].with_suffix('.lock')):
+        assert cache.prune(max_size=0) == []
+    assert mirrors[1].exists()
+    # evict by size
+    assert cache.prune(max_size=0) == [mirrors[1]]
+    assert cache.list_mirrors() == []
+
+
+def test_prune_entries():
+    """Test least recently used entries are evicted first."""
+    now = time.time()
+    entries = [('a', 10, now - 1), ('b', 10, now - 3), ('c', 10, now - 2)]
+    assert prune_entries(entries) == []
+    assert prune_entries(entries, max_size=25) == ['b']
+    assert prune_entries(entries, max_size=10) == ['b', 'c']
+    assert prune_entries(entries, max_age=1.5, max_size=10) == ['b', 'c']
+
+
+def test_wheelhouse_fill(temporary_folder, fake_popen):
+    """Test only the wheels of missing pins are added without resolving."""
+    wheelhouse = Wheelhouse(temporary_folder / 'wheelhouse')
+    wheelhouse.wheelhouse_folder.mkdir()
+    (wheelhouse.wheelhouse_folder / 'aiida_core-1.0.0-py3-none-any.whl'
+     ).write_bytes(b'0')
+    pins = ['aiida-core==1.0.0', 'pymatgen==2022.0.0']
+    assert wheelhouse.get_missing_pins(pins) == ['pymatgen==2022.0.0']
+    hits, misses = wheelhouse.fill(pins, pkg_flags=['--pre'])
+    generated_cmd, = fake_popen.args.pop()
+    wanted_cmd = ("pip wheel --no-deps --pre --wheel-dir {wh} --find-links "
+                  "{wh} pymatgen==2022.0.0"
+                  .format(wh=wheelhouse.wheelhouse_folder))
+    assert generated_cmd == wanted_cmd
+    assert (hits, misses) == (['aiida_core-1.0.0-py3-none-any.whl'], [])
+    # pip is not called at all if all wheels are present
+    wheelhouse.fill(['aiida-core==1.0.0'])
+    assert fake_popen.args == []
+    fake_popen.set_cmd_attrs('pip wheel', returncode=1, stderr=b'no index')
+    with pytest.raises(Exception) as exception:
+        wheelhouse.fill(pins)
+    assert "Filling the wheelhouse failed" in str(exception.value)
+
+
+def test_wheelhouse_resolution(temporary_folder):
+    """Test the pins of resolved requirements are stored by key."""
+    wheelhouse = Wheelhouse(temporary_folder / 'wheelhouse')
+    key = wheelhouse.get_resolution_key(['python3.8', 'aiida-core'])
+    assert key != wheelhouse.get_resolution_key(['python3.9', 'aiida-core'])
+    assert wheelhouse.get_resolution(key) is None
+    wheelhouse.save_resolution(key, ['aiida-core==1.0.0', 'six==1.16.0'])
+    assert wheelhouse.get_resolution(key) == ['aiida-core==1.0.0',
+                                              'six==1.16.0']
+
+
+def test_wheelhouse_usage_and_eviction(temporary_folder):
+    """Test hit / miss statistics and least recently used eviction."""
+    wheelhouse = Wheelhouse(temporary_folder / 'wheelhouse', max_size=250)
+    wheelhouse.wheelhouse_folder.mkdir()
+    old = time.time() - 2 * constants.WHEELHOUSE_GRACE_PERIOD
+    for (index, name) in enumerate(['a-1.0-py3-none-any.whl',
+                                    'b-1.0-py3-none-any.whl',
+                                    'aa-1.0-py3-none-any.whl']):
+        wheel = wheelhouse.wheelhouse_folder / name
+        wheel.write_bytes(b'0' * 100)
+        os.utime(str(wheel), (old + index, old + index))
+    wheels_before = set(w.name for (w, _, _) in wheelhouse.list_wheels())
+    # pretend pip reused wheels b and aa and added wheel c
+    new_wheel = wheelhouse.wheelhouse_folder / 'c-1.0-py3-none-any.whl'
+    new_wheel.write_bytes(b'0' * 100)
+    used = {'b-1.0-py3-none-any.whl', 'aa-1.0-py3-none-any.whl'}
+    hits, misses = wheelhouse.record_usage(wheels_before, used)
+    assert hits == ['aa-1.0-py3-none-any.whl', 'b-1.0-py3-none-any.whl']
+    assert misses == ['c-1.0-py3-none-any.whl']
+    # wheel a was the least recently used one and has been evicted while
+    # the recently used wheels are kept although they exceed the size
+    remaining = sorted(w.name for (w, _, _) in wheelhouse.list_wheels())
+    assert remaining == ['aa-1.0-py3-none-any.whl', 'b-1.0-py3-none-any.whl',
+                         'c-1.0-py3-none-any.whl']
+    stats = wheelhouse.get_stats()
+    assert stats == {'hits': 2, 'misses': 1, 'evictions': 1}
+    # wheels are evicted once the grace period passed
+    assert wheelhouse.prune(max_size=250) == []
+    assert len(wheelhouse.prune(max_size=250, grace_period=0)) == 1
+    # nothing is evicted while someone else holds the wheelhouse lock
+    removed = []
+    with FileLock(wheelhouse.wheelhouse_folder / '.lock'):
+        prune = threading.Thread(target=lambda: removed.extend(
+            wheelhouse.prune(max_size=0, grace_period=0)))
+        prune.start()
+        prune.join(0.2)
+        assert prune.is_alive()
+    prune.join()
+    assert len(removed) == 2
+
+
+def test_source_wheel_cache(temporary_folder):
+    """Test building and looking up wheels by repository and commit."""
+    cache = SourceWheelCache(temporary_folder / 'wheel-cache')
+    url = "https://github.com/user/repo"
+    commit_a = "a" * 40
+    commit_b = "b" * 40
+    assert cache.lookup(url, commit_a) is None
+    # entries are content-addressed by repository and commit
+    assert (cache.get_entry_folder(url, commit_a)
+            != cache.get_entry_folder(url, commit_b))
+    assert (cache.get_entry_folder(url, commit_a)
+            == SourceWheelCache(cache.cache_folder).get_entry_folder(
+                url, commit_a))
+    wheel = cache.build(url, commit_a, str(temporary_folder),
+                        pkg_executable=FAKE_PIP_WHEEL)
+    assert wheel.name == 'package-1.0-py3-none-any.whl'
+    assert wheel.parent == cache.get_entry_folder(url, commit_a)
+    assert cache.lookup(url, commit_a) == wheel
+    assert cache.lookup(url, commit_b) is None
+    # a failed build leaves nothing behind
+    with pytest.raises(Exception) as exception:
+        cache.build(url, commit_b, str(temporary_folder),
+                    pkg_executable="exit 1;")
+    assert "Building wheel from" in str(exception.value)
+    assert cache.lookup(url, commit_b) is None
+    assert [e for (e, _, _) in cache.list_entries()] == [wheel.parent]
+    assert cache.prune(max_age=0) == [wheel.parent]
+    assert cache.lookup(url, commit_a) is None
@@ -1,14 +1,114 @@
 # -*- coding: utf-8 -*-
+import os
 import sys
+import subprocess
 if sys.version_info >= (3, 0):
     import pathlib as pathlib
 else:
     import pathlib2 as pathlib
 
-from aiida_project.cli import create
+from aiida_project.cli import create, init
+from aiida_project.activate import ActivateEnvBash
 
 
 def test_confirm_directory_delete(click_cli_runner):
     """Check that an existing directory raises a prompt for deletion."""
     result = click_cli_runner.invoke(create, [""])
     assert "Cannot create project folder" in result.output
+
+
+def test_resume_with_options(click_cli_runner):
+    """Check that options cannot be changed when resuming a creation."""
+    result = click_cli_runner.invoke(create, ['project', '--resume',
+                                              '--utility-pkg', 'aiida-ase',
+                                              '--no-git-cache'])
+    assert result.exit_code == 2
+    assert ("--resume cannot be combined with --utility-pkg, "
+            "--git-cache/--no-git-cache" in result.output)
+
+
+def test_init_write(click_cli_runner, temporary_folder):
+    """Test the init file only rewrites itself if the executable changed."""
+    init_file = temporary_folder / 'init.bash'
+    result = click_cli_runner.invoke(init, ['bash', '--write',
+                                            str(init_file)])
+    assert result.exit_code == 0
+    assert init_file.exists()
+    with open(str(init_file), 'r') as f:
+        assert "init file format" in f.readline() + f.readline()
+    # fake executable which writes a marker into the init file when called
+    bin_folder = temporary_folder / 'bin'
+    bin_folder.mkdir()
+    executable = bin_folder / 'aiida-project'
+    executable.write_text(u"#!/bin/sh\necho 'REWRITTEN=1' > \"$4\"\n")
+    executable.chmod(0o755)
+    os.utime(str(executable), (1e9, 1e9))
+    init_file.write_text(ActivateEnvBash._setup_file(executable, init_file))
+    shell_script = (". '{}'; echo \"$REWRITTEN\"; "
+                    "type -t aiida-project-bash || true")
+    env = {'PATH': "{}:{}".format(bin_folder, os.environ['PATH'])}
+    output = subprocess.check_output(
+        ['bash', '-c', shell_script.format(init_file)], env=env)
+    assert output.decode().splitlines() == ["", "function"]
+    # a reinstalled executable triggers the rewrite
+    os.utime(str(executable), (3e9, 3e9))
+    output = subprocess.check_output(
+        ['bash', '-c', shell_script.format(init_file)], env=env)
+    assert output.decode().splitlines()[0] == "1"
+
+
+# import budget of the activate command (modules imported in addition to
+# the ones imported at interpreter startup and total import time)
+ACTIVATE_IMPORT_BUDGET_MODULES = 110
+ACTIVATE_IMPORT_BUDGET_SECONDS = 0.5
+
+
+def get_imported_modules(code, env):
+    """Run code with `python -X importtime` and return the import times."""
+    output = subprocess.check_output([sys.executable, '-X', 'importtime',
+                                      '-c', code], env=env,
+                                     stderr=subprocess.STDOUT)
+    imports = {}
+    for line in output.decode().splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_time, _, module = line[len('import time:'):].split('|')
+        imports[module.strip()] = int(self_time) * 1e-6
+    return imports
+
+
+def test_activate_import_budget(temporary_folder):
+    """Test the activate command only imports what it needs."""
+    # setup a minimal virtualenv project in a separate home folder
+    project_path = temporary_folder / 'venv_project'
+    (project_path / '.aiida').mkdir(parents=True)
+    activate_script = (project_path / 'env' / 'venv_project' / 'bin'
+                       / 'activate')
+    activate_script.parent.mkdir(parents=True)
+    activate_script.touch()
+    config_folder = temporary_folder / '.aiida_project'
+    config_folder.mkdir()
+    (config_folder / '.projects.yaml').write_text(
+        u"venv_project:\n"
+        u"  project_path: {0}\n"
+        u"  env_sub: {0}/env\n"
+        u"  src_sub: {0}/src\n"
+        u"  manager: virtualenv\n".format(project_path))
+    package_root = pathlib.Path(__file__).absolute().parent.parent
+    env = {
+        'HOME': str(temporary_folder),
+        'PATH': os.environ['PATH'],
+        'PYTHONPATH': str(package_root),
+    }
+    startup_imports = get_imported_modules("pass", env)
+    activate_imports = get_imported_modules(
+        "from aiida_project.cli import main\n"
+        "main(['activate', 'bash', 'venv_project'], standalone_mode=False)",
+        env)
+    imported = set(activate_imports) - set(startup_imports)
+    for module in ['aiida_project.create', 'aiida_project.cache',
+                   'click_spinner', 'concurrent.futures', 'shutil']:
+        assert module not in imported
+    assert len(imported) <= ACTIVATE_IMPORT_BUDGET_MODULES
+    import_time = sum(activate_imports[module] for module in imported)
+    assert import_time <= ACTIVATE_IMPORT_BUDGET_SECONDS
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 import pytest
+import shutil
 import sys
 if sys.version_info >= (3, 0):
     import pathlib as pathlib
@@ -7,6 +8,8 @@ else:
     import pathlib2 as pathlib
 
 from aiida_project.create import CreateEnvBase
+from aiida_project import constants
+from aiida_project.cache import Wheelhouse, SourceWheelCache
 
 
 def test_has_source():
@@ -129,18 +132,173 @@ def test_install_source_routine(env_creator, fake_popen):
         "{}{}".format(str(env_creator.src_folder / 'repo2'), '[extra2]'),
         "{}{}".format(str(env_creator.src_folder / 'repo3'), '[extra3]'),
     ]
-    wanted_cmds = []
+    # all source packages are installed with a single call to the installer
+    # where every package is prefixed by the source flags
+    install_args = []
     for source_package in source_packages:
-        print(source_package)
-        cmd_args = {
-            'exe': env_creator.pkg_executable,
-            'cmds': " ".join(env_creator.pkg_commands),
-            'flags': " ".join(env_creator.pkg_flags_source),
-            'args': source_package,
-        }
-        wanted_cmds.append(('{exe} {cmds} {flags} {args}'.format(**cmd_args),))
+        install_args += env_creator.pkg_flags_source + [source_package]
+    cmd_args = {
+        'exe': env_creator.pkg_executable,
+        'cmds': " ".join(env_creator.pkg_commands),
+        'flags': " ".join(env_creator.pkg_flags),
+        'args': " ".join(install_args),
+    }
+    wanted_cmd = '{exe} {cmds} {flags} {args}'.format(**cmd_args)
+    env_creator.install_packages_from_source()
+    # all repositories are cloned first (in parallel) and the packages are
+    # installed from the cloned sources afterwards
+    generated_cmds = [cmd for (cmd,) in fake_popen.args]
+    assert len(generated_cmds) == len(source_packages) + 1
+    assert all(cmd.startswith('git clone') for cmd in generated_cmds[:-1])
+    assert generated_cmds[-1] == wanted_cmd
+
+
+def test_install_routine(env_creator, fake_popen):
+    """Test installation of index and source packages in a single call."""
+    env_creator.install_packages()
+    install_cmds = [cmd for (cmd,) in fake_popen.args
+                    if cmd.startswith(env_creator.pkg_executable)]
+    assert len(install_cmds) == 1
+    install_cmd = install_cmds[0]
+    for index_package in ["arg1", "arg2=1.0.0", "arg3[extra1]",
+                          "arg4==0.12.1[extra4]"]:
+        assert " {} ".format(index_package) in install_cmd
+    flags_source = " ".join(env_creator.pkg_flags_source)
+    for source_package in ["repo1", "repo2[extra2]", "repo3[extra3]"]:
+        source_path = str(env_creator.src_folder / source_package)
+        assert "{} {}".format(flags_source, source_path) in install_cmd
+
+
+def test_install_failure_names_package(env_creator, fake_popen):
+    """Test that a failing batched install names the responsible package."""
+    stderr = ("ERROR: Command errored out with exit status 1: python "
+              "setup.py egg_info Check the logs for full command output.\n"
+              "ERROR: could not install {}[extra2]"
+              .format(env_creator.src_folder / 'repo2'))
+    fake_popen.set_cmd_attrs('pkg_executable', returncode=1,
+                             stderr=stderr.encode())
+    with pytest.raises(Exception) as exception:
+        env_creator.install_packages()
+    assert "failed packages: user2/repo2[extra2])" in str(exception.value)
+    # index packages are identified by their name only
+    stderr = ("ERROR: No matching distribution found for arg4==0.12.1")
+    fake_popen.set_cmd_attrs('pkg_executable', returncode=1,
+                             stderr=stderr.encode())
+    with pytest.raises(Exception) as exception:
+        env_creator.install_packages(source=False)
+    assert "failed packages: arg4==0.12.1[extra4])" in str(exception.value)
+
+
+def test_install_source_clone_failure(env_creator, fake_popen):
+    """Test that a failing clone names the responsible package."""
+    fake_popen.set_cmd_attrs('user2/repo2', returncode=1, stderr=b'404')
+    with pytest.raises(Exception) as exception:
+        env_creator.install_packages_from_source()
+    assert "user2/repo2" in str(exception.value)
+    # all repositories are cloned but nothing is installed
+    installed = [cmd for (cmd,) in fake_popen.args
+                 if cmd.startswith(env_creator.pkg_executable)]
+    assert len(installed) == 0
+    assert len(fake_popen.args) == 3
+
+
+def test_clone_failure_removes_partial_clone(env_creator, git_repository,
+                                             monkeypatch):
+    """Test a clone is removed if checking out the pinned commit fails."""
+    monkeypatch.setattr('aiida_project.utils.build_source_url',
+                        lambda user, repo: git_repository.as_uri())
+    env_creator.create_folder_structure()
+    with pytest.raises(Exception) as exception:
+        env_creator.clone_source_package('user1/repository:' + 'f' * 40)
+    assert "user1/repository" in str(exception.value)
+    assert not (env_creator.src_folder / 'repository').exists()
+
+    # a folder that existed before the clone is left alone
+    (env_creator.src_folder / 'repository').mkdir()
+    (env_creator.src_folder / 'repository' / 'file.txt').write_text(u'')
+    with pytest.raises(Exception):
+        env_creator.clone_source_package('user2/repository:main')
+    assert (env_creator.src_folder / 'repository' / 'file.txt').exists()
+
+
+def test_duplicate_clone_paths(env_creator):
+    """Test source packages sharing a repository name are rejected."""
+    with pytest.raises(Exception) as exception:
+        env_creator.check_clone_paths(['userA/aiida-foo:main',
+                                       'userB/aiida-foo[docs]'])
+    assert "`userA/aiida-foo:main`, `userB/aiida-foo`" in str(exception.value)
+    env_creator.check_clone_paths(['userA/aiida-foo', 'userA/aiida-bar'])
+
+
+def test_clone_modes(env_creator, fake_popen):
+    """Test global and per package clone modes."""
+    env_creator.clone_mode = 'shallow'
+    env_creator.clone_depth = 10
+    env_creator.clone_modes = {'user2/repo2': 'blobless', 'repo3': 'full'}
     env_creator.install_packages_from_source()
-    # call to source install calls popen twice to clone the source from
-    # github and install from the cloned source afterwards
-    generated_cmds = fake_popen.args[1::2]
-    assert wanted_cmds == generated_cmds
+    clone_cmds = {cmd.split()[-1]: cmd for (cmd,) in fake_popen.args
+                  if cmd.startswith('git clone')}
+    src_folder = env_creator.src_folder
+    assert "--depth 10" in clone_cmds[str(src_folder / 'repo1')]
+    assert "--filter=blob:none" in clone_cmds[str(src_folder / 'repo2')]
+    assert "--depth" not in clone_cmds[str(src_folder / 'repo3')]
+    assert "--filter" not in clone_cmds[str(src_folder / 'repo3')]
+
+
+def test_install_with_wheelhouse(env_creator, fake_popen, temporary_folder):
+    """Test index packages are installed from and their resolved pins are
+    collected in the wheelhouse."""
+    env_creator.wheelhouse = Wheelhouse(temporary_folder / 'wheelhouse')
+    wheelhouse_folder = env_creator.wheelhouse.wheelhouse_folder
+    env_creator.get_lock_command = lambda: "pkg_executable freeze"
+    fake_popen.set_cmd_attrs('pkg_executable freeze', returncode=0,
+                             stdout=b"arg1==1.0\n-e /src/repo1\n")
+    env_creator.install_packages(source=False)
+    install_cmd, freeze_cmd, fill_cmd = [cmd for (cmd,) in fake_popen.args]
+    index_packages = "arg1 arg2=1.0.0 arg3[extra1] arg4==0.12.1[extra4]"
+    assert "--find-links {}".format(wheelhouse_folder) in install_cmd
+    assert "--no-index" not in install_cmd
+    assert install_cmd.endswith(index_packages)
+    # only the resolved pins are added without resolving them again
+    assert fill_cmd.startswith("pkg_executable wheel --no-deps ")
+    assert fill_cmd.endswith(" arg1==1.0")
+    assert "--wheel-dir {}".format(wheelhouse_folder) in fill_cmd
+    assert env_creator.wheelhouse.get_resolution(
+        env_creator.get_resolution_key()) == ['arg1==1.0']
+    # the package index is not used once all wheels are present
+    (wheelhouse_folder / 'arg1-1.0-py3-none-any.whl').write_bytes(b'0')
+    del fake_popen.args[:]
+    env_creator.install_packages(source=False)
+    install_cmd, freeze_cmd = [cmd for (cmd,) in fake_popen.args]
+    assert "--no-index --find-links {}".format(wheelhouse_folder) in (
+        install_cmd)
+    # a failing wheel build does not fail the installation
+    (wheelhouse_folder / 'arg1-1.0-py3-none-any.whl').unlink()
+    fake_popen.set_cmd_attrs('pkg_executable wheel', returncode=1)
+    env_creator.install_packages(source=False)
+
+
+def test_source_wheels(env_creator, git_repository, temporary_folder,
+                       monkeypatch):
+    """Test source packages are only cloned and built on a cache miss."""
+    monkeypatch.setattr('aiida_project.utils.build_source_url',
+                        lambda user, repo: git_repository.as_uri())
+    env_creator.pkg_arguments = ['user1/repository:main[extra1]']
+    env_creator.pkg_executable = (
+        "sh -c 'touch \"$4\"/repository-1.0-py3-none-any.whl' sh")
+    env_creator.source_install = constants.SOURCE_INSTALL_WHEEL
+    env_creator.wheel_cache = SourceWheelCache(temporary_folder / 'wheels')
+    env_creator.create_folder_structure()
+    # cache miss: the package is cloned and the wheel is built
+    targets = env_creator.get_source_wheels(env_creator.pkg_arguments)
+    wheel, = env_creator.wheel_cache.list_entries()
+    wanted_target = "{}[extra1]".format(
+        wheel[0] / 'repository-1.0-py3-none-any.whl')
+    assert targets == {'user1/repository:main[extra1]': wanted_target}
+    clone_path = env_creator.src_folder / 'repository'
+    assert clone_path.exists()
+    # cache hit: nothing is cloned
+    shutil.rmtree(str(clone_path))
+    targets = env_creator.get_source_wheels(env_creator.pkg_arguments)
+    assert targets == {'user1/repository:main[extra1]': wanted_target}
+    assert not clone_path.exists()
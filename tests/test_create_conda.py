@@ -1,4 +1,6 @@
 # -*- coding: utf-8 -*-
+import json
+import os
 import pytest
 import sys
 if sys.version_info >= (3, 0):
@@ -11,33 +13,30 @@ from aiida_project import utils
 from aiida_project import constants
 
 
-def test_python_version(valid_env_input, fake_popen):
+def test_python_version(valid_env_input, fake_popen, fake_executables):
     """Test python package definition is correct."""
     # setup Popen
-    fake_popen.set_cmd_attrs('conda --version', returncode=0)
-    fake_popen.set_cmd_attrs('git --version', returncode=0)
+    fake_executables.add('conda', 'git')
     valid_env_input['python_version'] = '123.456'
     env_creator = CreateEnvConda(**valid_env_input)
     wanted_format = "python=123.456"
     assert wanted_format in env_creator.env_arguments
 
 
-def test_aiida_version(valid_env_input, fake_popen):
+def test_aiida_version(valid_env_input, fake_popen, fake_executables):
     """Test aiida package definition is correct."""
     # setup Popen
-    fake_popen.set_cmd_attrs('conda --version', returncode=0)
-    fake_popen.set_cmd_attrs('git --version', returncode=0)
+    fake_executables.add('conda', 'git')
     valid_env_input['aiida_version'] = '1.2.3b56'
     env_creator = CreateEnvConda(**valid_env_input)
     wanted_format = "aiida-core=1.2.3b56"
     assert wanted_format in env_creator.pkg_arguments
 
 
-def test_source_package_raises(valid_env_input, fake_popen):
+def test_source_package_raises(valid_env_input, fake_popen, fake_executables):
     """Check that source package definition raises exception."""
     # setup Popen
-    fake_popen.set_cmd_attrs('conda --version', returncode=0)
-    fake_popen.set_cmd_attrs('git --version', returncode=0)
+    fake_executables.add('conda', 'git')
     # this should work
     try:
         env_creator = CreateEnvConda(**valid_env_input)
@@ -51,11 +50,10 @@ def test_source_package_raises(valid_env_input, fake_popen):
     assert "Installation from source" in str(exception.value)
 
 
-def test_defined_extra_raises(valid_env_input, fake_popen):
+def test_defined_extra_raises(valid_env_input, fake_popen, fake_executables):
     """Check that package with defined extra raises exception."""
     # setup Popen
-    fake_popen.set_cmd_attrs('conda --version', returncode=0)
-    fake_popen.set_cmd_attrs('git --version', returncode=0)
+    fake_executables.add('conda', 'git')
     # this should work
     try:
         env_creator = CreateEnvConda(**valid_env_input)
@@ -70,11 +68,10 @@ def test_defined_extra_raises(valid_env_input, fake_popen):
 
 
 def test_create_project_environment_success(temporary_folder, temporary_home,
-                                            fake_popen):
+                                            fake_popen, fake_executables):
     """Test full cycle for creating an environment from conda."""
     # setup Popen
-    fake_popen.set_cmd_attrs('conda --version', returncode=0)
-    fake_popen.set_cmd_attrs('git --version', returncode=0)
+    fake_executables.add('conda', 'git')
     # make sure we write to the correct directory
     assert pathlib.Path.home() == temporary_folder
     arguments = {
@@ -89,18 +86,18 @@ def test_create_project_environment_success(temporary_folder, temporary_home,
     creator.create_aiida_project_environment()
     base_folder = str((creator.env_folder / creator.proj_name).absolute())
     expected_cmd_order = [
-        "conda --version",
         "conda create --yes --prefix {} python=0.0".format(base_folder),
         ("conda install --yes --channel conda-forge --channel bioconda "
          "--channel matsci --prefix {} aiida-core=0.0.0 aiida-core.services "
          "pymatgen=2019.3.13".format(base_folder)),
+        "conda list --explicit --md5 --prefix {}".format(base_folder),
     ]
     # compare expected cmd order with actual cmd order send to Popen
     actual_cmd_order = [_ for (_,) in fake_popen.args]
     assert actual_cmd_order == expected_cmd_order
     # test the written project specs
     path_to_config = (pathlib.Path.home() / constants.CONFIG_FOLDER
-                      / constants.PROJECTS_FILE)
+                      / constants.PROJECTS_FOLDER)
     assert path_to_config.exists() is True
     loaded_specs = utils.load_project_spec()
     assert 'conda_project' in loaded_specs.keys()
@@ -116,12 +113,48 @@ def test_create_project_environment_success(temporary_folder, temporary_home,
     assert contents['manager'] == constants.MANAGER_NAME_CONDA
 
 
+def test_create_project_environment_single_solve(temporary_folder,
+                                                 temporary_home, fake_popen,
+                                                 fake_executables):
+    """Test creating the environment and packages with a single solve."""
+    fake_executables.add('conda')
+    arguments = {
+        'proj_name': 'conda_project',
+        'proj_path': pathlib.Path(temporary_folder),
+        'python_version': '0.0',
+        'aiida_version': '0.0.0',
+        'packages': ['aiida-core.services', 'pymatgen=2019.3.13'],
+        'single_solve': True,
+    }
+    creator = CreateEnvConda(**arguments)
+    conda_output = (b"Collecting package metadata (repodata.json): "
+                    b"...working... done\n"
+                    b"Solving environment: ...working... done\n"
+                    b"Preparing transaction: ...working... done\n")
+    fake_popen.set_cmd_attrs('conda create', returncode=0,
+                             stdout=conda_output)
+    creator.create_aiida_project_environment()
+    base_folder = str((creator.env_folder / creator.proj_name).absolute())
+    expected_cmd_order = [
+        ("conda create --yes --channel conda-forge --channel bioconda "
+         "--channel matsci --prefix {} python=0.0 aiida-core=0.0.0 "
+         "aiida-core.services pymatgen=2019.3.13".format(base_folder)),
+        "conda list --explicit --md5 --prefix {}".format(base_folder),
+    ]
+    actual_cmd_order = [_ for (_,) in fake_popen.args]
+    assert actual_cmd_order == expected_cmd_order
+    timings = creator.transaction_timings
+    assert set(timings.keys()) == set(['total', 'solve', 'link'])
+    assert timings['solve'] + timings['link'] == pytest.approx(
+        timings['total'])
+    assert 'conda_project' in utils.load_project_spec().keys()
+
+
 def test_create_project_environment_failure(temporary_folder, temporary_home,
-                                            fake_popen):
+                                            fake_popen, fake_executables):
     """Test that exit_on_exception() is called on failed creation."""
     # setup Popen
-    fake_popen.set_cmd_attrs('conda --version', returncode=0)
-    fake_popen.set_cmd_attrs('git --version', returncode=0)
+    fake_executables.add('conda', 'git')
     # make sure we write to the correct directory
     assert pathlib.Path.home() == temporary_folder
     arguments = {
@@ -142,5 +175,157 @@ def test_create_project_environment_failure(temporary_folder, temporary_home,
     assert creator.proj_folder.exists() is False
     # check that nothing is written to the projects file
     path_to_config = (pathlib.Path.home() / constants.CONFIG_FOLDER
-                      / constants.PROJECTS_FILE)
+                      / constants.PROJECTS_FOLDER)
     assert path_to_config.exists() is False
+
+
+def test_solver_backends(valid_env_input, fake_popen, fake_executables):
+    """Test the executables and flags used by the solver backends."""
+    fake_executables.add('conda', 'mamba', 'micromamba')
+    prefix = "--prefix /some/system/path/test_project/env/test_project"
+    # mamba and micromamba replace the conda executable
+    for solver in ['mamba', 'micromamba']:
+        env_creator = CreateEnvConda(solver=solver, **valid_env_input)
+        assert env_creator.solver == solver
+        assert env_creator.env_executable == solver
+        assert env_creator.pkg_executable == solver
+    # libmamba is used by conda through the --solver flag
+    env_creator = CreateEnvConda(solver='libmamba', **valid_env_input)
+    assert env_creator.env_executable == 'conda'
+    assert env_creator.env_flags == ["--yes", "--solver=libmamba", prefix]
+    assert "--solver=libmamba" in env_creator.pkg_flags
+    with pytest.raises(Exception) as exception:
+        CreateEnvConda(solver='unknown', **valid_env_input)
+    assert "Unknown solver" in str(exception.value)
+
+
+def test_solver_detection(valid_env_input, temporary_home, fake_popen,
+                          fake_executables):
+    """Test automatic detection of the fastest solver backend."""
+    fake_executables.add('conda')
+    conda = pathlib.Path(os.environ['PATH']) / 'conda'
+    fake_popen.set_cmd_attrs('conda --version', returncode=0,
+                             stdout=b"conda 23.11.0")
+    env_creator = CreateEnvConda(solver='auto', **valid_env_input)
+    assert env_creator.solver == 'libmamba'
+    # older conda versions still use the classic solver by default (the
+    # cached version probe is invalidated by the updated executable)
+    fake_popen.set_cmd_attrs('conda --version', returncode=0,
+                             stdout=b"conda 4.14.0")
+    os.utime(str(conda), (0, 0))
+    env_creator = CreateEnvConda(solver='auto', **valid_env_input)
+    assert env_creator.solver == 'conda'
+    # mamba is preferred whenever it is available
+    fake_executables.add('mamba')
+    env_creator = CreateEnvConda(solver='auto', **valid_env_input)
+    assert env_creator.solver == 'mamba'
+    assert not any('mamba --version' in cmd for (cmd,) in fake_popen.args)
+
+
+def test_solver_recorded_in_spec(temporary_folder, temporary_home,
+                                 fake_popen, fake_executables):
+    """Test the solver backend is written to the project spec."""
+    fake_executables.add('micromamba')
+    fake_popen.set_cmd_attrs('micromamba', returncode=0)
+    arguments = {
+        'proj_name': 'conda_project',
+        'proj_path': pathlib.Path(temporary_folder),
+        'python_version': '0.0',
+        'aiida_version': '0.0.0',
+        'packages': [],
+        'solver': 'micromamba',
+    }
+    creator = CreateEnvConda(**arguments)
+    creator.create_aiida_project_environment()
+    generated_cmd, = fake_popen.args[0]
+    assert generated_cmd.startswith("micromamba create --yes")
+    contents = utils.load_project_spec()['conda_project']
+    assert contents['solver'] == 'micromamba'
+
+
+def test_channel_flags(valid_env_input, temporary_home, fake_popen):
+    """Test configured channels are passed to the installer."""
+    env_creator = CreateEnvConda(**valid_env_input)
+    channel_flags = ["--channel {}".format(channel)
+                     for channel in constants.DEFAULT_CONDA_CHANNELS]
+    assert env_creator.pkg_flags[1:-1] == channel_flags
+    # the configuration file replaces the defaults ...
+    config_folder = pathlib.Path.home() / constants.CONFIG_FOLDER
+    config_folder.mkdir()
+    with open(str(config_folder / constants.CONFIG_FILE), 'w') as f:
+        f.write("conda_channels: [conda-forge]\n"
+                "conda_override_channels: true\n")
+    env_creator = CreateEnvConda(**valid_env_input)
+    assert env_creator.pkg_flags[1:-1] == ["--channel conda-forge",
+                                           "--override-channels"]
+    # ... while explicitly given options take precedence
+    env_creator = CreateEnvConda(channels=['matsci', 'conda-forge'],
+                                 override_channels=False,
+                                 strict_channel_priority=True,
+                                 **valid_env_input)
+    assert env_creator.pkg_flags[1:-1] == ["--channel matsci",
+                                           "--channel conda-forge",
+                                           "--strict-channel-priority"]
+
+
+def test_preflight_channels(valid_env_input, temporary_home, fake_popen):
+    """Test channel usage is extracted from a dry-run solve."""
+    solution = {
+        'success': True,
+        'actions': {
+            'LINK': [
+                {'name': 'python', 'channel': 'conda-forge'},
+                {'name': 'aiida-core',
+                 'channel': 'https://conda.anaconda.org/conda-forge/noarch'},
+                {'name': 'openssl', 'channel': 'pkgs/main'},
+            ],
+        },
+    }
+    fake_popen.set_cmd_attrs('--dry-run', returncode=0,
+                             stdout=json.dumps(solution).encode())
+    env_creator = CreateEnvConda(**valid_env_input)
+    channel_usage = env_creator.preflight_channels()
+    assert channel_usage == {
+        'conda-forge': ['python', 'aiida-core'],
+        'bioconda': [],
+        'matsci': [],
+        'pkgs/main': ['openssl'],
+    }
+    generated_cmd, = fake_popen.args[-1]
+    assert generated_cmd.startswith("conda create --dry-run --json --yes")
+    # failing solves are reported
+    solution = {'success': False, 'message': 'PackagesNotFoundError'}
+    fake_popen.set_cmd_attrs('--dry-run', returncode=1,
+                             stdout=json.dumps(solution).encode())
+    with pytest.raises(Exception) as exception:
+        env_creator.preflight_channels()
+    assert "PackagesNotFoundError" in str(exception.value)
+
+
+def test_create_from_lock_file(temporary_folder, temporary_home, fake_popen):
+    """Test creating the environment from an explicit package list."""
+    fake_popen.set_cmd_attrs('conda', returncode=0)
+    lock_file = pathlib.Path(temporary_folder) / 'aiida-project.lock'
+    lock_file.write_text(
+        u"@EXPLICIT\n"
+        u"https://conda.anaconda.org/conda-forge/noarch/"
+        u"aiida-core-1.2.3-pyh9f0ad1d_0.tar.bz2#0123456789abcdef\n")
+    arguments = {
+        'proj_name': 'conda_project',
+        'proj_path': pathlib.Path(temporary_folder),
+        'python_version': '0.0',
+        'aiida_version': None,
+        'packages': [],
+    }
+    creator = CreateEnvConda(lock_file=str(lock_file), single_solve=True,
+                             **arguments)
+    assert creator.pkg_arguments == ["aiida-core=1.2.3"]
+    creator.create_aiida_project_environment()
+    base_folder = str((creator.env_folder / creator.proj_name).absolute())
+    expected_cmd_order = [
+        "conda create --yes --prefix {} --file {}".format(base_folder,
+                                                          lock_file),
+        "conda list --explicit --md5 --prefix {}".format(base_folder),
+    ]
+    actual_cmd_order = [_ for (_,) in fake_popen.args]
+    assert actual_cmd_order == expected_cmd_order
@@ -6,25 +6,24 @@ if sys.version_info >= (3, 0):
 else:
     import pathlib2 as pathlib
 
+from aiida_project import create
 from aiida_project.create import CreateEnvVirtualenv
 from aiida_project import constants
 from aiida_project import utils
 
 
-def test_python_version(valid_env_input, fake_popen):
+def test_python_version(valid_env_input, fake_popen, fake_executables):
     """Test python flag is created correctly."""
-    fake_popen.set_cmd_attrs('virtualenv --version', returncode=0)
-    fake_popen.set_cmd_attrs('git --version', returncode=0)
+    fake_executables.add('virtualenv', 'git')
     valid_env_input['python_version'] = '123.456'
     env_creator = CreateEnvVirtualenv(**valid_env_input)
     wanted_python_flag = "--python=python123.456"
     assert wanted_python_flag in env_creator.env_flags
 
 
-def test_aiida_version(valid_env_input, fake_popen):
+def test_aiida_version(valid_env_input, fake_popen, fake_executables):
     """Test aiida package definition is correct."""
-    fake_popen.set_cmd_attrs('virtualenv --version', returncode=0)
-    fake_popen.set_cmd_attrs('git --version', returncode=0)
+    fake_executables.add('virtualenv', 'git')
     # index package
     valid_env_input['aiida_version'] = "1.2.3b56"
     env_creator = CreateEnvVirtualenv(**valid_env_input)
@@ -48,10 +47,9 @@ def test_aiida_version(valid_env_input, fake_popen):
 
 
 def test_create_project_environment_success(temporary_folder, temporary_home,
-                                            fake_popen):
+                                            fake_popen, fake_executables):
     """Test full cycle for creating an environment from conda."""
-    fake_popen.set_cmd_attrs('virtualenv --version', returncode=0)
-    fake_popen.set_cmd_attrs('git --version', returncode=0)
+    fake_executables.add('virtualenv', 'git')
     # make sure we write to the correct directory
     assert pathlib.Path.home() == temporary_folder
     arguments = {
@@ -68,25 +66,25 @@ def test_create_project_environment_success(temporary_folder, temporary_home,
     base_folder = str((creator.env_folder / creator.proj_name).absolute())
     src_folder = creator.src_folder.absolute()
     expected_cmd_order = [
-        "virtualenv --version",
-        "git --version",
         # !!! There are 2 empty spaces expected after virtualenv due to the
         # !!! empty env_arguments list
         "virtualenv  --python=python0.0 {}".format(base_folder),
-        ("pip install --pre aiida-core==0.0.0 aiida-vasp[extras1] "
-         "pymatgen==2019.3.13"),
         ("git clone --single-branch --branch devel https://github.com/"
          "aiidateam/aiida-ase {}"
          .format(str(src_folder / "aiida-ase"))),
-        ("pip install --editable {}"
-         .format(str(src_folder / "aiida-ase[extras1]")))
+        ("pip install --pre aiida-core==0.0.0 aiida-vasp[extras1] "
+         "pymatgen==2019.3.13 --editable {}"
+         .format(str(src_folder / "aiida-ase[extras1]"))),
+        "pip freeze",
     ]
-    # compare expected cmd order with actual cmd order send to Popen
+    # compare expected cmd order with actual cmd order send to Popen (the
+    # source package is cloned while the environment is built)
     actual_cmd_order = [_ for (_,) in fake_popen.args]
-    assert actual_cmd_order == expected_cmd_order
+    assert sorted(actual_cmd_order[:2]) == sorted(expected_cmd_order[:2])
+    assert actual_cmd_order[2:] == expected_cmd_order[2:]
     # test the written project specs
     path_to_config = (pathlib.Path.home() / constants.CONFIG_FOLDER
-                      / constants.PROJECTS_FILE)
+                      / constants.PROJECTS_FOLDER)
     assert path_to_config.exists() is True
     loaded_specs = utils.load_project_spec()
     assert 'venv_project' in loaded_specs.keys()
@@ -103,10 +101,9 @@ def test_create_project_environment_success(temporary_folder, temporary_home,
 
 
 def test_create_project_environment_failure(temporary_folder, temporary_home,
-                                            fake_popen):
+                                            fake_popen, fake_executables):
     """Test full cycle for creating an environment from conda."""
-    fake_popen.set_cmd_attrs('virtualenv --version', returncode=0)
-    fake_popen.set_cmd_attrs('git --version', returncode=0)
+    fake_executables.add('virtualenv', 'git')
     # make sure we write to the correct directory
     assert pathlib.Path.home() == temporary_folder
     arguments = {
@@ -126,16 +123,16 @@ def test_create_project_environment_failure(temporary_folder, temporary_home,
     assert creator.proj_folder.exists() is False
     # check that nothing is written to the projects file
     path_to_config = (pathlib.Path.home() / constants.CONFIG_FOLDER
-                      / constants.PROJECTS_FILE)
+                      / constants.PROJECTS_FOLDER)
     assert path_to_config.exists() is False
 
 
 def test_git_is_ignored_for_missing_source(temporary_folder, temporary_home,
-                                           fake_popen):
+                                           fake_popen, fake_executables):
     """Test missing git does not trigger if no source packages are defined."""
     # test that git raises in case of source files defined
-    fake_popen.set_cmd_attrs('virtualenv --version', returncode=0)
-    fake_popen.set_cmd_attrs('git --version', returncode=1)
+    fake_executables.add('virtualenv')
+    fake_executables.remove('git')
     arguments = {
         'proj_name': 'venv_project',
         'proj_path': pathlib.Path(temporary_folder),
@@ -156,3 +153,115 @@ def test_git_is_ignored_for_missing_source(temporary_folder, temporary_home,
         'packages': ['aiida-vasp[extras1]', 'pymatgen==2019.3.13']
     }
     creator = CreateEnvVirtualenv(**arguments)
+
+
+def test_lock_file(temporary_folder, temporary_home, fake_popen,
+                   fake_executables):
+    """Test the lock file is written and hashed from the wheelhouse."""
+    fake_executables.add('virtualenv', 'git')
+    fake_popen.set_cmd_attrs('pip freeze', returncode=0,
+                             stdout=b"aiida-core==0.0.0\nsix==1.16.0\n")
+    arguments = {
+        'proj_name': 'venv_project',
+        'proj_path': pathlib.Path(temporary_folder),
+        'python_version': '0.0',
+        'aiida_version': '0.0.0',
+        'packages': [],
+    }
+    creator = CreateEnvVirtualenv(wheelhouse=True, **arguments)
+    wheelhouse_folder = creator.wheelhouse.wheelhouse_folder
+    wheelhouse_folder.mkdir(parents=True)
+    for wheel in ['aiida_core-0.0.0-py3-none-any.whl',
+                  'six-1.16.0-py2.py3-none-any.whl']:
+        (wheelhouse_folder / wheel).write_bytes(wheel.encode())
+    creator.create_aiida_project_environment()
+    with open(str(creator.lock_path), 'r') as f:
+        lock_lines = f.read().splitlines()
+    assert lock_lines[0].startswith('#')
+    assert lock_lines[1] == "aiida-core==0.0.0 --hash=sha256:{}".format(
+        utils.get_file_hash(wheelhouse_folder
+                            / 'aiida_core-0.0.0-py3-none-any.whl'))
+    assert lock_lines[2].startswith("six==1.16.0 --hash=sha256:")
+    # hashes are omitted if a single wheel is missing
+    (wheelhouse_folder / 'six-1.16.0-py2.py3-none-any.whl').unlink()
+    assert creator.add_hashes(["six==1.16.0"]) == ["six==1.16.0"]
+
+
+def test_create_from_lock_file(temporary_folder, temporary_home, fake_popen,
+                               fake_executables):
+    """Test installing the packages of a lock file without resolving."""
+    fake_executables.add('virtualenv', 'git')
+    lock_file = pathlib.Path(temporary_folder) / 'aiida-project.lock'
+    lock_file.write_text(u"aiida-core==1.2.3\nsix==1.16.0\n")
+    arguments = {
+        'proj_name': 'venv_project',
+        'proj_path': pathlib.Path(temporary_folder),
+        'python_version': '0.0',
+        'aiida_version': None,
+        'packages': [],
+    }
+    creator = CreateEnvVirtualenv(lock_file=str(lock_file), **arguments)
+    # the aiida version is taken from the lock file
+    assert creator.pkg_arguments == ["aiida-core==1.2.3"]
+    creator.create_aiida_project_environment()
+    install_cmd, = [cmd for (cmd,) in fake_popen.args
+                    if cmd.startswith('pip install')]
+    assert install_cmd == (
+        "pip install --pre --no-deps --src {} --requirement {}"
+        .format(creator.src_folder, lock_file))
+    assert utils.load_project_spec()['venv_project']['aiida'] == '1.2.3'
+    # lock files created for another python version are rejected
+    lock_file.write_text(u"# aiida-project lock file (virtualenv, python "
+                         u"3.8)\naiida-core==1.2.3\n")
+    arguments['python_version'] = '3.10'
+    with pytest.raises(Exception) as exception:
+        CreateEnvVirtualenv(lock_file=str(lock_file), **arguments)
+    assert "created for python 3.8 but python 3.10" in str(exception.value)
+    arguments['python_version'] = '3.8'
+    CreateEnvVirtualenv(lock_file=str(lock_file), **arguments)
+
+
+def test_resume_creation(temporary_folder, temporary_home, fake_popen,
+                         fake_executables):
+    """Test a failed creation is resumed from its first incomplete step."""
+    fake_executables.add('virtualenv', 'git')
+    arguments = {
+        'proj_name': 'venv_project',
+        'proj_path': pathlib.Path(temporary_folder),
+        'python_version': '0.0',
+        'aiida_version': '0.0.0',
+        'packages': ['aiidateam/aiida-ase:devel', 'aiidateam/aiida-cp2k'],
+    }
+    creator = CreateEnvVirtualenv(jobs=1, **arguments)
+    fake_popen.set_cmd_attrs('pip install', returncode=1, stderr=b'Typo')
+    with pytest.raises(Exception) as exception:
+        creator.create_aiida_project_environment()
+    assert "Typo" in str(exception.value)
+    # the environment and the clones are kept
+    assert creator.proj_folder.exists() is True
+    checkpoint = create.load_checkpoint('venv_project')
+    assert checkpoint['manager'] == constants.MANAGER_NAME_VENV
+    assert checkpoint['options']['packages'] == arguments['packages']
+    assert sorted(checkpoint['completed']) == [
+        'build_python_environment', 'clone-aiida-ase', 'clone-aiida-cp2k']
+    assert utils.project_name_exists('venv_project') is False
+    # (the fake commands do not create the environment and the clones)
+    activate_script = creator.env_folder / 'venv_project' / 'bin' / 'activate'
+    activate_script.parent.mkdir(parents=True)
+    activate_script.touch()
+    (creator.src_folder / 'aiida-ase' / '.git').mkdir(parents=True)
+    # only the failed install and the invalid clone are repeated
+    fake_popen.set_cmd_attrs('pip install', returncode=0)
+    del fake_popen.args[:]
+    creator = create.resume_creator('venv_project')
+    assert creator.clone_jobs == 1
+    creator.create_aiida_project_environment()
+    commands = [cmd for (cmd,) in fake_popen.args]
+    assert [cmd.split()[:2] for cmd in commands] == [
+        ['git', 'clone'], ['pip', 'install'], ['pip', 'freeze']]
+    assert 'aiida-cp2k' in commands[0]
+    assert utils.project_name_exists('venv_project') is True
+    assert creator.checkpoint_file.exists() is False
+    with pytest.raises(Exception) as exception:
+        create.resume_creator('venv_project')
+    assert "No unfinished creation" in str(exception.value)
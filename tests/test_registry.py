@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import subprocess
+if sys.version_info >= (3, 0):
+    import pathlib as pathlib
+else:
+    import pathlib2 as pathlib
+
+import pytest
+import yaml
+
+from aiida_project import utils
+from aiida_project import constants
+from aiida_project.registry import ProjectRegistry
+
+
+def test_save_load_remove(temporary_home):
+    """Test projects are stored in separate specification files."""
+    registry = ProjectRegistry()
+    assert registry.list_names() == []
+    assert registry.exists('project_a') is False
+    with pytest.raises(KeyError):
+        registry.load('project_a')
+    registry.save('project_a', {'manager': 'conda'})
+    registry.save('project_b', {'manager': 'virtualenv'})
+    assert registry.list_names() == ['project_a', 'project_b']
+    assert registry.exists('project_a') is True
+    assert registry.load('project_b') == {'manager': 'virtualenv'}
+    spec_path = registry.get_spec_path('project_a')
+    assert spec_path == (pathlib.Path.home() / constants.CONFIG_FOLDER
+                         / constants.PROJECTS_FOLDER / 'project_a.yaml')
+    # a single project is loaded without reading any other project
+    registry.get_spec_path('project_b').write_text(u"{ broken")
+    assert registry.load('project_a') == {'manager': 'conda'}
+    registry.remove('project_a')
+    assert registry.exists('project_a') is False
+    assert utils.project_name_exists('project_a') is False
+    # names must not leave the registry folder
+    for project_name in ['', '.hidden', '../project']:
+        with pytest.raises(Exception) as exception:
+            registry.save(project_name, {})
+        assert "Invalid project name" in str(exception.value)
+
+
+def test_migrate_legacy_file(temporary_home):
+    """Test the legacy projects file is migrated once."""
+    config_folder = pathlib.Path.home() / constants.CONFIG_FOLDER
+    config_folder.mkdir()
+    legacy_file = config_folder / constants.PROJECTS_FILE
+    project_specs = {
+        'project_a': {'manager': 'conda', 'aiida': '1.0.0'},
+        'project_b': {'manager': 'virtualenv', 'aiida': '1.1.0'},
+    }
+    with open(str(legacy_file), 'w') as f:
+        yaml.dump(project_specs, f, default_flow_style=False)
+    registry = ProjectRegistry()
+    assert registry.load('project_a') == project_specs['project_a']
+    assert registry.load_all() == project_specs
+    assert legacy_file.exists() is False
+    assert legacy_file.with_name(legacy_file.name + '.migrated').exists()
+    # the migration is not repeated for a new legacy file
+    with open(str(legacy_file), 'w') as f:
+        yaml.dump({'project_c': {}}, f)
+    assert registry.migrate() is False
+    assert registry.list_names() == ['project_a', 'project_b']
+
+
+REGISTRATION_SCRIPT = """
+import sys
+from aiida_project.registry import ProjectRegistry
+worker = int(sys.argv[1])
+registry = ProjectRegistry()
+try:
+    registry.add('contested', {'worker': worker})
+    print('added')
+except Exception:
+    print('rejected')
+for index in range(int(sys.argv[2])):
+    registry.save('project_{}_{}'.format(worker, index), {'worker': worker})
+    registry.save('shared', {'worker': worker, 'index': index})
+"""
+
+
+def test_concurrent_registrations(temporary_folder, temporary_home):
+    """Stress test many processes registering projects at the same time."""
+    workers = 8
+    registrations = 25
+    config_folder = temporary_folder / constants.CONFIG_FOLDER
+    config_folder.mkdir()
+    # all workers race to migrate the legacy file first
+    (config_folder / constants.PROJECTS_FILE).write_text(
+        u"legacy_project:\n  manager: conda\n")
+    package_root = pathlib.Path(__file__).absolute().parent.parent
+    env = {
+        'HOME': str(temporary_folder),
+        'PATH': os.environ['PATH'],
+        'PYTHONPATH': str(package_root),
+    }
+    processes = [
+        subprocess.Popen([sys.executable, '-c', REGISTRATION_SCRIPT,
+                          str(worker), str(registrations)],
+                         env=env, stdout=subprocess.PIPE,
+                         stderr=subprocess.PIPE)
+        for worker in range(workers)
+    ]
+    outputs = []
+    for process in processes:
+        stdout, stderr = process.communicate()
+        assert process.returncode == 0, stderr.decode()
+        outputs.append(stdout.decode().strip())
+    # exactly one worker registered the contested name
+    assert sorted(outputs) == ['added'] + ['rejected'] * (workers - 1)
+    registry = ProjectRegistry()
+    names = registry.list_names()
+    wanted = ['project_{}_{}'.format(worker, index)
+              for worker in range(workers) for index in range(registrations)]
+    assert set(wanted) <= set(names)
+    assert len(names) == len(wanted) + 3  # legacy, shared and contested
+    assert registry.load('legacy_project') == {'manager': 'conda'}
+    assert registry.load('shared')['index'] == registrations - 1
+    # no temporary files are left behind
+    assert not [filename for filename
+                in os.listdir(str(registry.registry_folder))
+                if filename.endswith('.tmp')]
+
+
+def test_memoized_load(temporary_home, monkeypatch):
+    """Test parsed specification files are memoized until they change."""
+    parsed = []
+    yaml_safe_load = utils.yaml_safe_load
+
+    def counting_load(stream):
+        parsed.append(stream)
+        return yaml_safe_load(stream)
+    monkeypatch.setattr(utils, 'yaml_safe_load', counting_load)
+    registry = ProjectRegistry()
+    registry.save('project_a', {'manager': 'conda', 'channels': ['matsci']})
+    # the written specification is not parsed again
+    project_spec = registry.load('project_a')
+    assert project_spec == {'manager': 'conda', 'channels': ['matsci']}
+    assert ProjectRegistry().load('project_a') == project_spec
+    assert parsed == []
+    # returned specifications are copies of the memoized one
+    project_spec['channels'].append('conda-forge')
+    assert registry.load('project_a')['channels'] == ['matsci']
+    # changes made by other processes invalidate the memoized spec
+    registry.get_spec_path('project_a').write_text(u"manager: virtualenv\n")
+    assert registry.load('project_a') == {'manager': 'virtualenv'}
+    assert registry.load('project_a') == {'manager': 'virtualenv'}
+    assert len(parsed) == 1
+    # as well as for the list of registered projects
+    assert registry.list_names() == ['project_a']
+    registry.get_spec_path('project_b').write_text(u"manager: conda\n")
+    assert registry.list_names() == ['project_a', 'project_b']
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import time
+import threading
+
+import pytest
+
+from aiida_project.tasks import TaskGraph
+
+
+def test_dependencies():
+    """Test tasks are started as soon as their dependencies are done."""
+    events = []
+    lock = threading.Lock()
+
+    def step(name, seconds=0.0):
+        def run():
+            with lock:
+                events.append(('start', name))
+            time.sleep(seconds)
+            with lock:
+                events.append(('end', name))
+            return name.upper()
+        return run
+    graph = TaskGraph(max_workers=3)
+    folders = graph.add('folders', step('folders'))
+    environment = graph.add('environment', step('environment', 0.1),
+                            [folders])
+    clone = graph.add('clone', step('clone', 0.02), [folders])
+    graph.add('install', step('install'), [environment, clone])
+    results = graph.run()
+    assert results == {'folders': 'FOLDERS', 'environment': 'ENVIRONMENT',
+                       'clone': 'CLONE', 'install': 'INSTALL'}
+    # the clone runs while the environment is built
+    assert events.index(('end', 'clone')) < events.index(
+        ('end', 'environment'))
+    assert events[-2:] == [('start', 'install'), ('end', 'install')]
+    # dependencies have to be defined first
+    with pytest.raises(Exception) as exception:
+        graph.add('lock', step('lock'), ['unknown'])
+    assert "Unknown dependency" in str(exception.value)
+    with pytest.raises(Exception) as exception:
+        graph.add('clone', step('clone'))
+    assert "more than once" in str(exception.value)
+
+
+def test_failures():
+    """Test dependent tasks are skipped while independent tasks finish."""
+    done = []
+
+    def fail(message):
+        def run():
+            time.sleep(0.01)
+            raise ValueError(message)
+        return run
+    graph = TaskGraph(max_workers=2)
+    graph.add('environment', fail("Environment setup failed"))
+    graph.add('clone', lambda: done.append('clone'))
+    graph.add('install', lambda: done.append('install'),
+              ['environment', 'clone'])
+    graph.add('lock', lambda: done.append('lock'), ['install'])
+    # the exception of a single failed task is raised as it is
+    with pytest.raises(ValueError) as exception:
+        graph.run()
+    assert str(exception.value) == "Environment setup failed"
+    assert done == ['clone']
+    # all failures are reported
+    graph = TaskGraph(max_workers=2)
+    graph.add('clone_a', fail("Unable to clone a"))
+    graph.add('clone_b', fail("Unable to clone b"))
+    with pytest.raises(Exception) as exception:
+        graph.run()
+    assert sorted(str(exception.value).split("\n")) == [
+        "Unable to clone a", "Unable to clone b"]
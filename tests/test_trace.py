@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+import sys
+import json
+import threading
+if sys.version_info >= (3, 0):
+    import pathlib as pathlib
+else:
+    import pathlib2 as pathlib
+
+import pytest
+
+from aiida_project import utils
+from aiida_project import trace
+from aiida_project.trace import Tracer
+from aiida_project.create import CreateEnvVirtualenv
+
+
+def test_spans(temporary_folder):
+    """Test spans are nested and accumulate the usage of their children."""
+    tracer = Tracer()
+    with tracer.span('create', project='project_a') as create_span:
+        with tracer.span('environment', category='cpu') as env_span:
+            env_span.add_usage(commands=1, cpu_seconds=1.5, max_rss=100)
+            # downloads reported by pip are recorded by the running step
+            utils.record_download(
+                "  Downloading six-1.16.0-py2.py3-none-any.whl (11 kB)\n")
+            utils.record_download("Collecting six\n")
+        assert env_span.fetched_bytes == 11000
+        assert trace.current_span() is create_span
+
+        def clone():
+            # spans of worker threads are attached explicitly
+            with Tracer.attach(create_span):
+                with tracer.span('clone', category='network') as span:
+                    span.add_usage(commands=2, cpu_seconds=0.5, max_rss=300)
+                    utils.record_fetched(1000)
+        worker = threading.Thread(target=clone)
+        worker.start()
+        worker.join()
+        with pytest.raises(Exception):
+            with tracer.span('install'):
+                raise Exception("Installation failed")
+    assert trace.current_span() is None
+    assert [span.name for span in tracer.spans] == ['create', 'environment',
+                                                    'clone', 'install']
+    assert [span.project for span in tracer.spans] == ['project_a'] * 4
+    assert create_span.commands == 3
+    assert create_span.cpu_seconds == pytest.approx(2.0)
+    assert create_span.max_rss == 300
+    assert create_span.fetched_bytes == 12000
+    trace_dict = tracer.to_dict()
+    clone_span = trace_dict['spans'][2]
+    assert clone_span['parent'] == 0
+    assert clone_span['category'] == 'network'
+    assert clone_span['thread'] != trace_dict['spans'][0]['thread']
+    assert trace_dict['spans'][3]['error'] == "Installation failed"
+    assert trace_dict['spans'][0]['wall_seconds'] >= 0.0
+    assert trace_dict['spans'][2]['fetched_bytes'] == 1000
+    # host wide network counters are only recorded by top level spans
+    if trace.read_received_bytes() is not None:
+        assert trace_dict['spans'][0]['top_level_host_received_bytes'] >= 0
+    assert [span['top_level_host_received_bytes'] for span
+            in trace_dict['spans'][1:]] == [None] * 3
+    # the JSON trace is written together with a Chrome trace
+    trace_file, chrome_file = tracer.write(temporary_folder / 'out.json')
+    assert chrome_file == temporary_folder / 'out.chrome.json'
+    with open(str(trace_file), 'r') as f:
+        assert json.load(f)['spans'] == json.loads(
+            json.dumps(trace_dict['spans']))
+    with open(str(chrome_file), 'r') as f:
+        events = json.load(f)['traceEvents']
+    complete = [event for event in events if event['ph'] == 'X']
+    assert [event['name'] for event in complete] == ['create', 'environment',
+                                                     'clone', 'install']
+    assert complete[0]['args']['cpu_seconds'] == 2.0
+    assert complete[2]['tid'] != complete[0]['tid']
+    assert events[-1] == {'name': 'process_name', 'ph': 'M', 'pid': 1,
+                          'args': {'name': 'project_a'}}
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason="requires os.wait4")
+def test_run_command_usage():
+    """Test the resources used by commands are recorded."""
+    tracer = Tracer()
+    testcmd = ('{} -c "sum(range(10 ** 6)); '
+               'buffer = bytearray(50 * 1024 ** 2)"'.format(sys.executable))
+    with tracer.span('step') as span:
+        result = utils.run_command(testcmd)
+    assert result.returncode == 0
+    assert result.cpu_seconds > 0.0
+    assert result.max_rss > 50 * 1024 ** 2
+    assert span.commands == 1
+    assert span.cpu_seconds == result.cpu_seconds
+    assert span.max_rss == result.max_rss
+    # commands run outside of any span are not recorded
+    assert utils.run_command('exit 3').returncode == 3
+    assert span.commands == 1
+
+
+def test_create_trace(temporary_folder, temporary_home, fake_popen,
+                      fake_executables):
+    """Test all steps and phases of a creation are traced."""
+    fake_executables.add('virtualenv', 'git')
+    creator = CreateEnvVirtualenv(
+        proj_name='venv_project', proj_path=pathlib.Path(temporary_folder),
+        python_version='3.8', aiida_version='1.6.4',
+        packages=['aiidateam/aiida-ase:devel'])
+    creator.tracer = Tracer()
+    creator.create_aiida_project_environment()
+    spans = creator.tracer.to_dict()['spans']
+    by_name = dict((span['name'], span) for span in spans)
+    assert sorted(by_name) == sorted([
+        'create', 'create_folder_structure', 'build_python_environment',
+        'environment', 'clone_source_package[aiidateam/aiida-ase:devel]',
+        'clone-aiida-ase', 'install_packages', 'install', 'write_lock_file',
+        'lock', 'create_spec_entry', 'write_activation_scripts'])
+    assert len(spans) == len(by_name)
+    # the steps are run as tasks (the commands as phases of the tasks)
+    clone_task = by_name['clone_source_package[aiidateam/aiida-ase:devel]']
+    assert clone_task['category'] == 'task'
+    assert clone_task['parent'] == by_name['create']['id']
+    assert by_name['clone-aiida-ase']['category'] == 'network'
+    assert by_name['clone-aiida-ase']['parent'] == clone_task['id']
+    # the dependencies of the tasks are recorded
+    folders = by_name['create_folder_structure']['id']
+    assert clone_task['dependencies'] == [folders]
+    assert by_name['build_python_environment']['dependencies'] == [folders]
+    assert sorted(by_name['install_packages']['dependencies']) == sorted([
+        by_name['build_python_environment']['id'], clone_task['id']])
+    assert by_name['install_packages']['commands'] == 1
+    assert by_name['create']['commands'] == len(fake_popen.args)
+    assert set(span['project'] for span in spans) == {'venv_project'}
+    # and shown as flows in the Chrome trace
+    events = creator.tracer.to_chrome_trace()['traceEvents']
+    flows = [event for event in events if event['ph'] in ('s', 'f')]
+    assert len(flows) == 2 * 4
@@ -2,6 +2,7 @@
 import os
 import sys
 import string
+import subprocess
 import random
 if sys.version_info >= (3, 0):
     import pathlib as pathlib
@@ -12,6 +13,7 @@ import pytest
 
 from aiida_project import utils
 from aiida_project import constants
+from aiida_project.trace import Tracer
 
 
 def test_unpack_package_def():
@@ -143,14 +145,49 @@ def test_assert_valid_aiida_version():
         assert utils.assert_valid_aiida_version(testcase) is True
 
 
-def test_check_command():
+def test_check_command(temporary_home, fake_executables):
     """Test the check_command utility function."""
-    # if command succeeds with errorcode 0 we assume it is available
-    result = utils.check_command_avail('exit 0', test_version=False)
-    assert result is True
-    # for returncodes other than 0 we assume the command is not available
-    result = utils.check_command_avail('exit 1', test_version=False)
-    assert result is False
+    # commands found on the PATH are assumed to be available
+    fake_executables.add('conda')
+    tracer = Tracer()
+    with tracer.span('check') as span:
+        result = utils.check_command_avail('conda', test_version=False)
+        assert result is True
+        # missing commands are not available
+        result = utils.check_command_avail('mamba', test_version=False)
+        assert result is False
+    # the lookup itself must not start any subprocess
+    assert [(probe['command'], probe['kind']) for probe in span.probes] == [
+        ('conda', 'path'), ('mamba', 'path')]
+    assert tracer.to_dict()['spans'][0]['probes'] == span.probes
+
+
+def test_probe_command_cached(temporary_home, fake_popen, fake_executables):
+    """Test version probes are cached until the executable changes."""
+    fake_executables.add('conda')
+    fake_popen.set_cmd_attrs('conda --version', returncode=0,
+                             stdout=b"conda 23.11.0")
+    with Tracer().span('probe') as span:
+        assert utils.get_command_version('conda') == (23, 11, 0)
+    assert len(fake_popen.args) == 1
+    assert span.probes[-1]['kind'] == 'version'
+    # the second probe is answered from the command cache
+    with Tracer().span('probe') as span:
+        assert utils.get_command_version('conda') == (23, 11, 0)
+    assert len(fake_popen.args) == 1
+    assert span.probes[-1]['kind'] == 'cached'
+    cache_file = (pathlib.Path.home() / constants.CONFIG_FOLDER
+                  / constants.COMMAND_CACHE_FILE)
+    assert cache_file.exists()
+    # an updated executable is probed again
+    fake_popen.set_cmd_attrs('conda --version', returncode=0,
+                             stdout=b"conda 24.1.0")
+    os.utime(str(fake_executables.bin_folder / 'conda'), (0, 0))
+    assert utils.get_command_version('conda') == (24, 1, 0)
+    assert len(fake_popen.args) == 2
+    # missing executables are never run
+    assert utils.get_command_version('mamba') is None
+    assert len(fake_popen.args) == 2
 
 
 # TODO: Consider splitting this command and implement separate test
@@ -179,6 +216,48 @@ def test_run_command():
     assert stderr.rstrip() == ""
 
 
+def test_run_command_line_callback():
+    """Test run_command() passes every line of stdout to the callback."""
+    lines = []
+    errno, stdout, stderr = utils.run_command(
+        'echo first line && echo error 1>&2 && echo second line',
+        shell=True, line_callback=lines.append)
+    assert errno == 0
+    assert [line.rstrip() for line in lines] == ['first line', 'second line']
+    assert stdout == "".join(lines)
+    assert stderr.rstrip() == "error"
+
+
+def test_run_command_log_and_tail(temporary_folder, capsys):
+    """Test run_command() logs the output and only keeps its tail."""
+    log_file = temporary_folder / 'logs' / 'phase.log'
+    lines = constants.COMMAND_TAIL_LINES + 50
+    testcmd = '{} -c "for i in range({}): print(i)"'.format(sys.executable,
+                                                            lines)
+    result = utils.run_command(testcmd, log_file=log_file)
+    assert result.returncode == 0
+    assert result.command == testcmd
+    assert result.log_file == log_file
+    assert result.stdout.split() == [str(index) for index in
+                                     range(50, lines)]
+    # the log file keeps the complete output
+    logged = log_file.read_text().splitlines()
+    assert logged[0] == "$ {}".format(testcmd)
+    assert logged[1:-1] == [str(index) for index in range(lines)]
+    assert logged[-1].startswith("# exit code 0 after")
+    # unless captured (i.e. for parsed outputs)
+    result = utils.run_command(testcmd, capture=True)
+    assert result.stdout.split() == [str(index) for index in range(lines)]
+    assert capsys.readouterr().out == ""
+    # the output is passed through if verbose
+    with utils.command_log(log_file, verbose=True):
+        errno, stdout, stderr = utils.run_command('echo passed through')
+    assert errno == 0
+    assert capsys.readouterr().out == "passed through\n"
+    assert log_file.read_text().count("$ ") == 2
+    assert utils.get_command_log() == (None, False)
+
+
 def test_build_source_url():
     """Test creation of source urls for packages hosted on github."""
     username = "someuser"
@@ -208,6 +287,115 @@ def test_clone_git_repo_to_disk(fake_popen):
                   .format(branch, github_url, location_on_disk))
     assert wanted_cmd == generated_cmd
 
+    # check shallow and blobless clones
+    utils.clone_git_repo_to_disk(github_url, location_on_disk, branch=branch,
+                                 mode=constants.CLONE_MODE_SHALLOW, depth=5)
+    generated_cmd, = fake_popen.args.pop()
+    wanted_cmd = ("git clone --single-branch --depth 5 --branch {} {} {}"
+                  .format(branch, github_url, location_on_disk))
+    assert wanted_cmd == generated_cmd
+    utils.clone_git_repo_to_disk(github_url, location_on_disk,
+                                 mode=constants.CLONE_MODE_BLOBLESS)
+    generated_cmd, = fake_popen.args.pop()
+    wanted_cmd = ("git clone --single-branch --filter=blob:none {} {}"
+                  .format(github_url, location_on_disk))
+    assert wanted_cmd == generated_cmd
+    with pytest.raises(Exception) as exception:
+        utils.clone_git_repo_to_disk(github_url, location_on_disk,
+                                     mode='unknown')
+    assert "Unknown clone mode" in str(exception.value)
+
+
+def test_unshallow_git_repo(git_repository, temporary_folder):
+    """Test fetching the full history of shallow and blobless clones."""
+    url = git_repository.absolute().as_uri()
+    for mode in [constants.CLONE_MODE_SHALLOW, constants.CLONE_MODE_BLOBLESS]:
+        location = str(temporary_folder / mode)
+        utils.clone_git_repo_to_disk(url, location, branch='main', mode=mode)
+        assert utils.unshallow_git_repo(location) is True
+        commits = subprocess.check_output(
+            ["git", "-C", location, "rev-list", "--count", "HEAD"])
+        assert int(commits) == 3
+        assert not (pathlib.Path(location) / '.git' / 'shallow').exists()
+        # nothing left to do for the now complete clone
+        assert utils.unshallow_git_repo(location) is False
+
+
+def test_resolve_git_commit(git_repository):
+    """Test resolving branches of a remote repository to commits."""
+    url = git_repository.as_uri()
+    head = subprocess.check_output(["git", "-C", str(git_repository),
+                                    "rev-parse", "HEAD"]).decode().strip()
+    assert utils.resolve_git_commit(url, 'main') == head
+    assert utils.resolve_git_commit(url) == head
+    # full commit SHAs are returned without querying the remote at all
+    assert utils.resolve_git_commit('/does/not/exist', head) == head
+    assert utils.is_commit_sha(head) is True
+    assert utils.is_commit_sha('main') is False
+    with pytest.raises(Exception) as exception:
+        utils.resolve_git_commit(url, 'unknown-branch')
+    assert "Reference `unknown-branch` not found" in str(exception.value)
+
+
+def test_checkout_git_commit(git_repository, temporary_folder):
+    """Test checking out a specific commit of a cloned repository."""
+    url = git_repository.as_uri()
+    first_commit = subprocess.check_output(
+        ["git", "-C", str(git_repository), "rev-list", "--max-parents=0",
+         "HEAD"]).decode().strip()
+    location = str(temporary_folder / 'clone')
+    utils.clone_git_repo_to_disk(url, location, branch='main')
+    utils.checkout_git_commit(location, first_commit)
+    assert utils.get_git_head(location) == first_commit
+
+
+def test_parse_size():
+    """Test conversion of human readable sizes."""
+    assert utils.parse_size("1024") == 1024
+    assert utils.parse_size("2K") == 2048
+    assert utils.parse_size("1.5G") == int(1.5 * 1024**3)
+    assert utils.parse_size("500MB") == 500 * 1024**2
+    with pytest.raises(Exception) as exception:
+        utils.parse_size("large")
+    assert "Malformed size" in str(exception.value)
+
+
+def test_get_locked_version(temporary_folder):
+    """Test reading pinned versions from pip and conda lock files."""
+    lock_file = temporary_folder / 'lock'
+    lock_file.write_text(u"# comment\nAiiDA_Core==1.2.3\nsix==1.16.0\n")
+    assert utils.get_locked_version(lock_file, 'aiida-core') == '1.2.3'
+    assert utils.get_locked_version(lock_file, 'numpy') is None
+    lock_file.write_text(u"@EXPLICIT\nhttps://conda.anaconda.org/conda-forge/"
+                         u"noarch/aiida-core-1.2.3-py_0.conda#abc\n")
+    assert utils.get_locked_version(lock_file, 'aiida-core') == '1.2.3'
+
+
+def test_get_locked_python_version(temporary_folder):
+    """Test reading the python version of pip and conda lock files."""
+    lock_file = temporary_folder / 'lock'
+    lock_file.write_text(u"# aiida-project lock file (virtualenv, python "
+                         u"3.10)\nsix==1.16.0\n")
+    assert utils.get_locked_python_version(lock_file) == '3.10'
+    lock_file.write_text(u"@EXPLICIT\nhttps://conda.anaconda.org/conda-forge/"
+                         u"linux-64/python-3.8.13-h582c2e5_0.tar.bz2#abc\n")
+    assert utils.get_locked_python_version(lock_file) == '3.8.13'
+    lock_file.write_text(u"six==1.16.0\n")
+    assert utils.get_locked_python_version(lock_file) is None
+    assert utils.python_versions_match('3.8', '3.8.13')
+    assert not utils.python_versions_match('3.1', '3.10')
+
+
+def test_load_config(temporary_home):
+    """Test loading of the site-wide configuration."""
+    # a missing config file results in an empty configuration
+    assert utils.load_config() == {}
+    config_folder = pathlib.Path.home() / constants.CONFIG_FOLDER
+    config_folder.mkdir()
+    with open(str(config_folder / constants.CONFIG_FILE), 'w') as f:
+        f.write("conda_channels:\n  - conda-forge\n")
+    assert utils.load_config() == {'conda_channels': ['conda-forge']}
+
 
 def test_save_and_load_project_spec(temporary_home):
     """Test that the project spec is written and loaded correctly."""
@@ -232,7 +420,7 @@ def test_save_and_load_project_spec(temporary_home):
         'manager': 'manager_name',
     }
     path_to_config = (pathlib.Path.home() / constants.CONFIG_FOLDER
-                      / constants.PROJECTS_FILE)
+                      / constants.PROJECTS_FOLDER)
     # check that there is no file already
     assert path_to_config.exists() is False
     # write specs to file